@@ -0,0 +1,305 @@
+"""
+Cache Coherence - MSI/MESI snooping protocols over private per-core caches
+
+Each core gets its own DirectMappedCache (or FullyAssociativeCache) from
+memory_hierarchy.py. The cache still decides hits, misses and evictions;
+this module adds the per-line coherence state and the snooping bus that
+keeps the private copies consistent.
+
+Only coherence state and traffic are modelled, not data values.
+
+Usage:
+    system = MultiCoreSystem(num_cores=2, num_lines=64, line_size=64)
+    system.run(interleave_traces([core0_trace, core1_trace]))
+    system.show_report()
+"""
+
+from memory_hierarchy import DirectMappedCache
+
+# Line states (a block missing from a core's state table is Invalid)
+MODIFIED = "M"
+EXCLUSIVE = "E"
+SHARED = "S"
+INVALID = "I"
+
+
+class SnoopingBus:
+    """
+    Shared bus watched by every cache controller.
+
+    Transaction types:
+    - BusRd:   read miss, asks for a shared copy
+    - BusRdX:  write miss, asks for an exclusive copy (invalidates others)
+    - BusUpgr: write hit on a Shared line (invalidates others, no data)
+    - Flush:   write back of a Modified line
+    """
+
+    def __init__(self):
+        self.transactions = {"BusRd": 0, "BusRdX": 0, "BusUpgr": 0, "Flush": 0}
+
+    def broadcast(self, kind):
+        self.transactions[kind] += 1
+
+    def total(self):
+        return sum(self.transactions.values())
+
+
+class CoherentCore:
+    """A core's private cache plus the coherence state of its lines"""
+
+    def __init__(self, core_id, cache):
+        self.core_id = core_id
+        self.cache = cache
+        self.states = {}       # Block number -> MODIFIED / EXCLUSIVE / SHARED
+        self.invalidated = {}  # Block lost to another core -> words written since
+        self.reads = 0
+        self.writes = 0
+        self.coherence_misses = 0
+
+    def state(self, block):
+        """Current coherence state of block in this core"""
+        return self.states.get(block, INVALID)
+
+
+class MultiCoreSystem:
+    """
+    Multi-core memory system with private caches and a snooping bus.
+
+    Misses that happen because another core invalidated the line are
+    coherence misses. They are further split by the word touched:
+    - True sharing:  the word was written by another core since the
+                     invalidation (the communication was real)
+    - False sharing: only other words of the line were written (the
+                     cores just happen to share a line)
+    """
+
+    PROTOCOLS = ("MSI", "MESI")
+
+    def __init__(self, num_cores=4, num_lines=64, line_size=64, protocol="MESI",
+                 cache_class=DirectMappedCache, word_size=4, memory_size=1 << 16):
+        """
+        Args:
+            num_cores: Number of cores, each with a private cache
+            num_lines: Lines per private cache
+            line_size: Bytes per cache line
+            protocol: "MSI" or "MESI"
+            cache_class: DirectMappedCache or FullyAssociativeCache
+            word_size: Granularity used to tell true from false sharing
+            memory_size: Size of the backing memory the caches fill from
+        """
+        if protocol not in self.PROTOCOLS:
+            raise ValueError(f"Unknown protocol {protocol!r} (expected MSI or MESI)")
+
+        self.protocol = protocol
+        self.line_size = line_size
+        self.word_size = word_size
+        self.memory = [0] * memory_size
+        self.cores = [
+            CoherentCore(i, cache_class(num_lines=num_lines, line_size=line_size))
+            for i in range(num_cores)
+        ]
+        self.bus = SnoopingBus()
+        self.line_stats = {}  # Block number -> per-line counters
+
+    def _stats(self, block):
+        stats = self.line_stats.get(block)
+        if stats is None:
+            stats = self.line_stats[block] = {
+                "invalidations": 0,
+                "coherence_misses": 0,
+                "true_sharing": 0,
+                "false_sharing": 0,
+            }
+        return stats
+
+    def access(self, core_id, op, address):
+        """
+        Perform one memory operation.
+
+        Args:
+            core_id: Index of the issuing core
+            op: 'R' for a load, 'W' for a store
+            address: Byte address
+
+        Returns:
+            True on a cache hit, False on a miss
+        """
+        core = self.cores[core_id]
+        block = address // self.line_size
+        word = (address % self.line_size) // self.word_size
+        state = core.states.get(block, INVALID)
+
+        # Invalidated lines are dropped from the private cache, so the
+        # cache's own hit/miss answer already agrees with the state table
+        _, hit = core.cache.access(address, self.memory)
+        if core.cache.last_evicted is not None:
+            self._evict(core, core.cache.last_evicted)
+
+        if not hit:
+            written = core.invalidated.pop(block, None)
+            if written is not None:
+                stats = self._stats(block)
+                core.coherence_misses += 1
+                stats["coherence_misses"] += 1
+                if word in written:
+                    stats["true_sharing"] += 1
+                else:
+                    stats["false_sharing"] += 1
+
+        if op in ("W", "w"):
+            core.writes += 1
+            if state == SHARED:
+                self.bus.broadcast("BusUpgr")
+                self._invalidate_others(core, block)
+            elif state == INVALID:
+                self.bus.broadcast("BusRdX")
+                self._invalidate_others(core, block)
+            # EXCLUSIVE -> MODIFIED is silent, MODIFIED stays put
+            core.states[block] = MODIFIED
+
+            # Remember which words changed for cores waiting to re-read this line
+            for other in self.cores:
+                if other is not core and block in other.invalidated:
+                    other.invalidated[block].add(word)
+        else:
+            core.reads += 1
+            if state == INVALID:
+                self.bus.broadcast("BusRd")
+                shared = False
+                for other in self.cores:
+                    if other is core:
+                        continue
+                    other_state = other.states.get(block)
+                    if other_state is None:
+                        continue
+                    shared = True
+                    if other_state == MODIFIED:
+                        self.bus.broadcast("Flush")
+                    other.states[block] = SHARED
+                if shared or self.protocol == "MSI":
+                    core.states[block] = SHARED
+                else:
+                    core.states[block] = EXCLUSIVE
+
+        return hit
+
+    def _invalidate_others(self, core, block):
+        """Snoop a BusRdX/BusUpgr: every other copy of block goes Invalid"""
+        for other in self.cores:
+            if other is core:
+                continue
+            other_state = other.states.pop(block, None)
+            if other_state is None:
+                continue
+            if other_state == MODIFIED:
+                self.bus.broadcast("Flush")
+            other.cache.invalidate(block * self.line_size)
+            other.invalidated[block] = set()
+            self._stats(block)["invalidations"] += 1
+
+    def _evict(self, core, block):
+        """Replacement by the private cache; dirty lines are written back"""
+        if core.states.pop(block, None) == MODIFIED:
+            self.bus.broadcast("Flush")
+
+    def run(self, trace):
+        """
+        Run an interleaved multi-core trace.
+
+        Args:
+            trace: Iterable of (core_id, op, address) tuples
+
+        Returns:
+            Number of operations performed
+        """
+        access = self.access
+        count = 0
+        for core_id, op, address in trace:
+            access(core_id, op, address)
+            count += 1
+        return count
+
+    def totals(self):
+        """Whole-system counters"""
+        totals = {"invalidations": 0, "coherence_misses": 0, "true_sharing": 0, "false_sharing": 0}
+        for stats in self.line_stats.values():
+            for key in totals:
+                totals[key] += stats[key]
+        totals["bus_transactions"] = self.bus.total()
+        return totals
+
+    def show_report(self, max_lines=10):
+        """Print bus traffic, per-core misses and the most contended lines"""
+        totals = self.totals()
+
+        print(f"\n{'='*70}")
+        print(f"COHERENCE REPORT ({self.protocol}, {len(self.cores)} cores)")
+        print(f"{'='*70}")
+        print(f"  Bus transactions: {totals['bus_transactions']}")
+        for kind, count in self.bus.transactions.items():
+            print(f"    {kind:<8} {count:10d}")
+        print(f"  Invalidations:    {totals['invalidations']}")
+        print(f"  Coherence misses: {totals['coherence_misses']} "
+              f"(true sharing {totals['true_sharing']}, false sharing {totals['false_sharing']})")
+
+        print(f"\n{'Core':>4} | {'Reads':>8} | {'Writes':>8} | {'Misses':>8} | {'Coherence':>9}")
+        print(f"{'-'*4}-+-{'-'*8}-+-{'-'*8}-+-{'-'*8}-+-{'-'*9}")
+        for core in self.cores:
+            print(f"{core.core_id:4d} | {core.reads:8d} | {core.writes:8d} | "
+                  f"{core.cache.misses:8d} | {core.coherence_misses:9d}")
+
+        if not self.line_stats:
+            return
+        ranked = sorted(self.line_stats.items(), key=lambda item: -item[1]["coherence_misses"])
+        print(f"\n{'Line addr':>10} | {'Inval':>6} | {'Coh.miss':>8} | {'True':>6} | {'False':>6}")
+        print(f"{'-'*10}-+-{'-'*6}-+-{'-'*8}-+-{'-'*6}-+-{'-'*6}")
+        for block, stats in ranked[:max_lines]:
+            print(f"{block * self.line_size:#10x} | {stats['invalidations']:6d} | "
+                  f"{stats['coherence_misses']:8d} | {stats['true_sharing']:6d} | "
+                  f"{stats['false_sharing']:6d}")
+
+
+def interleave_traces(per_core_traces):
+    """
+    Round-robin merge of per-core traces.
+
+    Args:
+        per_core_traces: List where entry i is an iterable of (op, address)
+                         pairs issued by core i
+
+    Yields:
+        (core_id, op, address) tuples, one core at a time
+    """
+    iterators = [iter(trace) for trace in per_core_traces]
+    active = list(range(len(iterators)))
+    while active:
+        still_active = []
+        for core_id in active:
+            for op, address in iterators[core_id]:
+                yield core_id, op, address
+                still_active.append(core_id)
+                break
+        active = still_active
+
+
+def demo_false_sharing():
+    """Two cores bump their own counters: same line vs padded to separate lines"""
+    print("\n" + "="*70)
+    print("DEMO: False Sharing")
+    print("="*70)
+    print("\nEach core increments its own 4-byte counter 1000 times (load + store).")
+
+    for label, stride in [("Adjacent counters (same line)", 4), ("Padded counters (own line)", 64)]:
+        system = MultiCoreSystem(num_cores=2, num_lines=64, line_size=64)
+        traces = [
+            [(op, core * stride) for _ in range(1000) for op in ("R", "W")]
+            for core in range(2)
+        ]
+        system.run(interleave_traces(traces))
+
+        print(f"\n--- {label} ---")
+        system.show_report(max_lines=2)
+
+
+if __name__ == "__main__":
+    demo_false_sharing()
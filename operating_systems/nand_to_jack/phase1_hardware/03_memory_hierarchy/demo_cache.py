@@ -18,7 +18,8 @@ from memory_hierarchy import (
     demo_sequential_access,
     demo_fully_associative_no_conflicts,
     demo_lru_replacement,
-    demo_comparison
+    demo_comparison,
+    demo_large_trace
 )
 
 
@@ -39,9 +40,11 @@ def main_menu():
         print("\n=== Interactive ===")
         print("7. Interactive Mode (Direct-Mapped) - Try your own addresses")
         print("8. Interactive Mode (Fully Associative) - Try your own addresses")
-        print("9. Exit")
+        print("\n=== Large Traces ===")
+        print("9. Large Trace Summary - Miss heatmap and hit rate over time")
+        print("10. Exit")
 
-        choice = input("\nSelect a demo (1-9): ").strip()
+        choice = input("\nSelect a demo (1-10): ").strip()
 
         if choice == "1":
             demo_spatial_locality()
@@ -66,10 +69,13 @@ def main_menu():
         elif choice == "8":
             interactive_mode(cache_type="fully_associative")
         elif choice == "9":
+            demo_large_trace()
+            input("\nPress Enter to continue...")
+        elif choice == "10":
             print("\nGoodbye!")
             break
         else:
-            print("\nInvalid choice. Please select 1-9.")
+            print("\nInvalid choice. Please select 1-10.")
 
 
 def interactive_mode(cache_type="direct"):
@@ -1,3 +1,7 @@
+from array import array
+from collections import OrderedDict
+
+
 class DFF:
     """D Flip-Flop: 1-bit memory"""
     def __init__(self):
@@ -139,15 +143,111 @@ class PC:
         return self.current
 
 
+class MissClassifier:
+    """Sorts cache misses into the 3Cs: compulsory, capacity and conflict
+
+    - Compulsory: first reference to a block (tracked in a seen-block set)
+    - Capacity:   a fully associative LRU cache of the same size would
+                  also have missed
+    - Conflict:   the fully associative cache would have hit, so the miss
+                  is caused by the mapping, not by the size
+
+    The shadow fully associative cache is an OrderedDict used as an LRU
+    list, so every access costs O(1) regardless of cache size.
+    """
+
+    COMPULSORY = "compulsory"
+    CAPACITY = "capacity"
+    CONFLICT = "conflict"
+
+    def __init__(self, num_lines, num_sets=1):
+        self.capacity = num_lines
+        self.num_sets = num_sets
+        self.seen = set()
+        self.shadow = OrderedDict()  # Block number -> None, oldest first
+
+        self.compulsory = array('Q', [0]) * num_sets
+        self.capacity_misses = array('Q', [0]) * num_sets
+        self.conflict = array('Q', [0]) * num_sets
+
+    def observe(self, block, set_index, hit):
+        """Record one access; returns the miss type or None for a hit"""
+        # The shadow cache must see every access to keep its LRU order exact
+        shadow = self.shadow
+        shadow_hit = block in shadow
+        if shadow_hit:
+            shadow.move_to_end(block)
+        else:
+            shadow[block] = None
+            if len(shadow) > self.capacity:
+                shadow.popitem(last=False)
+
+        if hit:
+            return None
+
+        if block not in self.seen:
+            self.seen.add(block)
+            self.compulsory[set_index] += 1
+            return self.COMPULSORY
+        if shadow_hit:
+            self.conflict[set_index] += 1
+            return self.CONFLICT
+        self.capacity_misses[set_index] += 1
+        return self.CAPACITY
+
+    def breakdown(self):
+        """Overall miss counts by type"""
+        return {
+            self.COMPULSORY: sum(self.compulsory),
+            self.CAPACITY: sum(self.capacity_misses),
+            self.CONFLICT: sum(self.conflict),
+        }
+
+    def set_breakdown(self, set_index):
+        """Miss counts by type for one set"""
+        return {
+            self.COMPULSORY: self.compulsory[set_index],
+            self.CAPACITY: self.capacity_misses[set_index],
+            self.CONFLICT: self.conflict[set_index],
+        }
+
+    def show_report(self, max_sets=16):
+        """Print overall and per-set breakdowns (sets with most misses first)"""
+        totals = self.breakdown()
+        total = sum(totals.values())
+
+        print(f"\n{'='*70}")
+        print(f"MISS CLASSIFICATION (3Cs)")
+        print(f"{'='*70}")
+        for kind, count in totals.items():
+            share = count / total if total else 0
+            print(f"  {kind.capitalize():<11} {count:10d}  ({share:.1%})")
+
+        if self.num_sets == 1:
+            return
+
+        ranked = sorted(range(self.num_sets), key=lambda s: -sum(self.set_breakdown(s).values()))
+        print(f"\n{'Set':>5} | {'Compulsory':>10} | {'Capacity':>10} | {'Conflict':>10}")
+        print(f"{'-'*5}-+-{'-'*10}-+-{'-'*10}-+-{'-'*10}")
+        for s in ranked[:max_sets]:
+            print(f"{s:5d} | {self.compulsory[s]:10d} | "
+                  f"{self.capacity_misses[s]:10d} | {self.conflict[s]:10d}")
+        if self.num_sets > max_sets:
+            print(f"... ({self.num_sets - max_sets} more sets)")
+
+
 class DirectMappedCache:
     """Simple direct-mapped cache"""
-    def __init__(self, num_lines=256, line_size=64):
+    def __init__(self, num_lines=256, line_size=64, classify_misses=False):
         self.num_lines = num_lines
         self.line_size = line_size
         # Each cache line: [valid, tag, data]
         self.lines = [[False, 0, [0]*line_size] for _ in range(num_lines)]
         self.hits = 0
         self.misses = 0
+        self.last_evicted = None  # Block number replaced by the last access
+        # Optional 3C miss classification (see MissClassifier)
+        self.classifier = MissClassifier(num_lines, num_sets=num_lines) if classify_misses else None
 
     def access(self, address, main_memory):
         """Access byte at address (returns data, hit/miss)"""
@@ -161,10 +261,16 @@ class DirectMappedCache:
         # Check for hit
         if line_valid and line_tag == tag:
             self.hits += 1
+            self.last_evicted = None
+            if self.classifier:
+                self.classifier.observe(address // self.line_size, index, True)
             return line_data[offset], True  # HIT
 
         # Cache miss: fetch from main memory
         self.misses += 1
+        self.last_evicted = line_tag * self.num_lines + index if line_valid else None
+        if self.classifier:
+            self.classifier.observe(address // self.line_size, index, False)
         base_addr = (address // self.line_size) * self.line_size
         new_data = [main_memory[base_addr + i] for i in range(self.line_size)]
 
@@ -172,6 +278,16 @@ class DirectMappedCache:
         self.lines[index] = [True, tag, new_data]
         return new_data[offset], False  # MISS
 
+    def invalidate(self, address):
+        """Drop the line holding address, if cached (returns True if dropped)"""
+        index = (address // self.line_size) % self.num_lines
+        tag = address // (self.line_size * self.num_lines)
+        line = self.lines[index]
+        if line[0] and line[1] == tag:
+            line[0] = False
+            return True
+        return False
+
     def hit_rate(self):
         total = self.hits + self.misses
         return self.hits / total if total > 0 else 0
@@ -179,7 +295,7 @@ class DirectMappedCache:
 
 class FullyAssociativeCache:
     """Fully associative cache—any address can go anywhere"""
-    def __init__(self, num_lines=256, line_size=64):
+    def __init__(self, num_lines=256, line_size=64, classify_misses=False):
         self.num_lines = num_lines
         self.line_size = line_size
         self.lines = [[False, 0, [0]*line_size] for _ in range(num_lines)]
@@ -187,6 +303,9 @@ class FullyAssociativeCache:
         self.hits = 0
         self.misses = 0
         self.time = 0
+        self.last_evicted = None  # Block number replaced by the last access
+        # Optional 3C miss classification (never reports conflict misses here)
+        self.classifier = MissClassifier(num_lines) if classify_misses else None
 
     def access(self, address, main_memory):
         """Access with LRU replacement policy"""
@@ -199,10 +318,15 @@ class FullyAssociativeCache:
             if valid and line_tag == tag:
                 self.hits += 1
                 self.lru_counters[i] = self.time  # Update LRU
+                self.last_evicted = None
+                if self.classifier:
+                    self.classifier.observe(tag, 0, True)
                 return data[offset], True  # HIT
 
         # Miss: find victim line (LRU policy)
         self.misses += 1
+        if self.classifier:
+            self.classifier.observe(tag, 0, False)
         # Prefer invalid lines first, then use LRU among valid lines
         invalid_lines = [i for i in range(self.num_lines) if not self.lines[i][0]]
         if invalid_lines:
@@ -210,6 +334,8 @@ class FullyAssociativeCache:
         else:
             # All lines valid, use LRU
             victim = min(range(self.num_lines), key=lambda i: self.lru_counters[i])
+        victim_valid, victim_tag, _ = self.lines[victim]
+        self.last_evicted = victim_tag if victim_valid else None
 
         # Fetch cache line from memory
         base_addr = (address // self.line_size) * self.line_size
@@ -220,45 +346,155 @@ class FullyAssociativeCache:
         self.lru_counters[victim] = self.time
         return new_data[offset], False  # MISS
 
+    def invalidate(self, address):
+        """Drop the line holding address, if cached (returns True if dropped)"""
+        tag = address // self.line_size
+        for line in self.lines:
+            if line[0] and line[1] == tag:
+                line[0] = False
+                return True
+        return False
+
     def hit_rate(self):
         total = self.hits + self.misses
         return self.hits / total if total > 0 else 0
 
 
 class CacheVisualizer:
-    """Visualize cache operations (supports DirectMapped and FullyAssociative)"""
+    """Visualize cache operations (supports DirectMapped and FullyAssociative)
+
+    Every access is recorded in a fixed-size ring buffer built from parallel
+    typed arrays (address, index, tag, hit), so memory use stays constant no
+    matter how long the trace is. Per-set miss counts and per-window hit
+    counts are aggregated as accesses happen, which is what the summary
+    views (miss heatmap, hit-rate timeline) are drawn from.
+
+    With summary_only=True nothing is printed per access; call show_summary()
+    or the individual show_* methods once the run is finished.
+    """
+
+    HEATMAP_SHADES = " ░▒▓█"
+
+    def __init__(self, cache, memory, history_size=1024, summary_only=False, window=1000):
+        if history_size < 1:
+            raise ValueError("history_size must be at least 1")
+        if window < 1:
+            raise ValueError("window must be at least 1")
 
-    def __init__(self, cache, memory):
         self.cache = cache
         self.memory = memory
-        self.access_history = []
         self.cache_type = type(cache).__name__
+        self.summary_only = summary_only
+
+        # Ring buffer: slot i of every array describes the same access
+        self.history_size = history_size
+        self._addresses = array('q', [0]) * history_size
+        self._indices = array('l', [0]) * history_size
+        self._tags = array('q', [0]) * history_size
+        self._hits = array('B', [0]) * history_size
+        self._cursor = 0  # Next slot to overwrite
+        self.total_accesses = 0
+
+        # Whole-run aggregates (never truncated by the ring buffer)
+        self.num_sets = cache.num_lines if self.cache_type == "DirectMappedCache" else 1
+        self.set_accesses = array('Q', [0]) * self.num_sets
+        self.set_misses = array('Q', [0]) * self.num_sets
+        self.window = window
+        self.window_hits = array('L')  # Hits in each completed window
+        self._window_hit_count = 0
+        self._window_fill = 0
+
+    def _decode(self, address):
+        """Split address into (set index, tag) for the visualized cache"""
+        block = address // self.cache.line_size
+        if self.cache_type == "DirectMappedCache":
+            return block % self.cache.num_lines, block // self.cache.num_lines
+        return 0, block  # Fully associative: one set, tag is the block number
+
+    def _record(self, address, hit):
+        """Store one access in the ring buffer and update aggregates"""
+        index, tag = self._decode(address)
+
+        slot = self._cursor
+        self._addresses[slot] = address
+        self._indices[slot] = index
+        self._tags[slot] = tag
+        self._hits[slot] = hit
+        self._cursor = slot + 1 if slot + 1 < self.history_size else 0
+        self.total_accesses += 1
+
+        self.set_accesses[index] += 1
+        if hit:
+            self._window_hit_count += 1
+        else:
+            self.set_misses[index] += 1
+
+        self._window_fill += 1
+        if self._window_fill == self.window:
+            self.window_hits.append(self._window_hit_count)
+            self._window_hit_count = 0
+            self._window_fill = 0
+
+        return index, tag
+
+    def _history_slots(self):
+        """Ring buffer slots from oldest to newest retained access"""
+        retained = min(self.total_accesses, self.history_size)
+        start = (self._cursor - retained) % self.history_size
+        return [(start + i) % self.history_size for i in range(retained)]
+
+    @property
+    def access_history(self):
+        """Retained accesses (oldest first) as dicts, for ad-hoc inspection"""
+        return [
+            {
+                'address': self._addresses[slot],
+                'index': self._indices[slot],
+                'tag': self._tags[slot],
+                'offset': self._addresses[slot] % self.cache.line_size,
+                'hit': bool(self._hits[slot]),
+            }
+            for slot in self._history_slots()
+        ]
 
     def visualize_access(self, address):
         """Visualize a single cache access"""
         # Perform access first
         value, hit = self.cache.access(address, self.memory)
+        index, tag = self._record(address, hit)
+
+        if not self.summary_only:
+            self._render_access(address, index, tag, value, hit)
+
+        return value, hit
 
-        # Decode address based on cache type
+    def record_trace(self, addresses):
+        """Run a whole address trace without per-access rendering
+
+        Args:
+            addresses: Any iterable of addresses (generators are fine)
+
+        Returns:
+            Number of accesses performed
+        """
+        access = self.cache.access
+        memory = self.memory
+        record = self._record
+        count = 0
+        for address in addresses:
+            _, hit = access(address, memory)
+            record(address, hit)
+            count += 1
+        return count
+
+    def _render_access(self, address, index, tag, value, hit):
+        """Print the detailed report for one access"""
         offset = address % self.cache.line_size
 
         if self.cache_type == "DirectMappedCache":
-            index = (address // self.cache.line_size) % self.cache.num_lines
-            tag = address // (self.cache.line_size * self.cache.num_lines)
-
-            # Store in history
-            self.access_history.append({
-                'address': address,
-                'index': index,
-                'tag': tag,
-                'offset': offset,
-                'hit': hit,
-                'value': value
-            })
-
             # Print visualization
             print(f"\n{'='*70}")
-            print(f"Access #{len(self.access_history)}: Address {address} (0x{address:04X})")
+            print(f"Access #{self.total_accesses}: Address {address} (0x{address:04X})")
             print(f"{'='*70}")
 
             # Show address breakdown
@@ -282,20 +518,9 @@ class CacheVisualizer:
             print(f"  Data:     [{', '.join(str(data[i]) for i in range(min(8, len(data))))}...]")
 
         elif self.cache_type == "FullyAssociativeCache":
-            tag = address // self.cache.line_size
-
-            # Store in history
-            self.access_history.append({
-                'address': address,
-                'tag': tag,
-                'offset': offset,
-                'hit': hit,
-                'value': value
-            })
-
             # Print visualization
             print(f"\n{'='*70}")
-            print(f"Access #{len(self.access_history)}: Address {address} (0x{address:04X})")
+            print(f"Access #{self.total_accesses}: Address {address} (0x{address:04X})")
             print(f"{'='*70}")
 
             # Show address breakdown
@@ -332,8 +557,6 @@ class CacheVisualizer:
         print(f"  Misses:   {self.cache.misses}")
         print(f"  Hit Rate: {self.cache.hit_rate():.1%}")
 
-        return value, hit
-
     def show_cache_state(self, max_lines=8):
         """Display current state of cache"""
         print(f"\n{'='*70}")
@@ -351,33 +574,104 @@ class CacheVisualizer:
         if self.cache.num_lines > max_lines:
             print(f"... ({self.cache.num_lines - max_lines} more lines)")
 
-    def show_access_pattern(self):
-        """Show pattern of recent accesses"""
-        if not self.access_history:
+    def show_access_pattern(self, last=None):
+        """Show pattern of recent accesses (at most history_size of them)"""
+        if not self.total_accesses:
             print("No accesses yet")
             return
 
+        slots = self._history_slots()
+        if last is not None:
+            slots = slots[-last:]
+        first_number = self.total_accesses - len(slots) + 1
+        w = max(3, len(str(self.total_accesses)))  # Width of the '#' column
+
         print(f"\n{'='*70}")
-        print(f"ACCESS PATTERN (last {len(self.access_history)} accesses)")
+        print(f"ACCESS PATTERN (last {len(slots)} of {self.total_accesses} accesses)")
         print(f"{'='*70}")
 
         if self.cache_type == "DirectMappedCache":
-            print(f"{'#':>3} | {'Address':>7} | {'Index':>5} | {'Tag':>6} | {'Result':>6}")
-            print(f"{'-'*3}-+-{'-'*7}-+-{'-'*5}-+-{'-'*6}-+-{'-'*6}")
+            print(f"{'#':>{w}} | {'Address':>7} | {'Index':>5} | {'Tag':>6} | {'Result':>6}")
+            print(f"{'-'*w}-+-{'-'*7}-+-{'-'*5}-+-{'-'*6}-+-{'-'*6}")
 
-            for i, access in enumerate(self.access_history, 1):
-                result = "HIT ✓" if access['hit'] else "MISS ✗"
-                print(f"{i:3d} | {access['address']:7d} | {access['index']:5d} | "
-                      f"{access['tag']:6d} | {result:>6}")
+            for i, slot in enumerate(slots, first_number):
+                result = "HIT ✓" if self._hits[slot] else "MISS ✗"
+                print(f"{i:{w}d} | {self._addresses[slot]:7d} | {self._indices[slot]:5d} | "
+                      f"{self._tags[slot]:6d} | {result:>6}")
 
         elif self.cache_type == "FullyAssociativeCache":
-            print(f"{'#':>3} | {'Address':>7} | {'Tag':>6} | {'Result':>6}")
-            print(f"{'-'*3}-+-{'-'*7}-+-{'-'*6}-+-{'-'*6}")
+            print(f"{'#':>{w}} | {'Address':>7} | {'Tag':>6} | {'Result':>6}")
+            print(f"{'-'*w}-+-{'-'*7}-+-{'-'*6}-+-{'-'*6}")
+
+            for i, slot in enumerate(slots, first_number):
+                result = "HIT ✓" if self._hits[slot] else "MISS ✗"
+                print(f"{i:{w}d} | {self._addresses[slot]:7d} | "
+                      f"{self._tags[slot]:6d} | {result:>6}")
+
+    def hit_rate_windows(self):
+        """Hit rate of each window of accesses (last entry may be partial)"""
+        rates = [hits / self.window for hits in self.window_hits]
+        if self._window_fill:
+            rates.append(self._window_hit_count / self._window_fill)
+        return rates
+
+    def show_miss_heatmap(self, columns=32):
+        """Draw per-set miss counts as a grid of shaded cells"""
+        print(f"\n{'='*70}")
+        print(f"MISS HEATMAP ({self.num_sets} sets, {columns} per row)")
+        print(f"{'='*70}")
+
+        peak = max(self.set_misses) if self.num_sets else 0
+        if not peak:
+            print("No misses yet")
+            return
+
+        levels = len(self.HEATMAP_SHADES) - 1
+        for row_start in range(0, self.num_sets, columns):
+            row = self.set_misses[row_start:row_start + columns]
+            cells = "".join(
+                self.HEATMAP_SHADES[(count * levels + peak - 1) // peak] for count in row
+            )
+            print(f"{row_start:5d} |{cells}|")
+
+        hottest = max(range(self.num_sets), key=lambda s: self.set_misses[s])
+        print(f"\nHottest set: {hottest} ({self.set_misses[hottest]} misses "
+              f"of {self.set_accesses[hottest]} accesses)")
+
+    def show_hit_rate_timeline(self, max_rows=20, bar_width=40):
+        """Plot hit rate over time, merging windows so at most max_rows print"""
+        rates = self.hit_rate_windows()
+
+        print(f"\n{'='*70}")
+        print(f"HIT RATE OVER TIME (window = {self.window} accesses)")
+        print(f"{'='*70}")
+
+        if not rates:
+            print("No accesses yet")
+            return
+
+        per_row = -(-len(rates) // max_rows)  # Ceiling division
+        for row_start in range(0, len(rates), per_row):
+            chunk = rates[row_start:row_start + per_row]
+            rate = sum(chunk) / len(chunk)
+            first = row_start * self.window
+            last = min((row_start + len(chunk)) * self.window, self.total_accesses) - 1
+            bar = "█" * round(rate * bar_width)
+            print(f"{first:>10d}-{last:<10d} |{bar:<{bar_width}}| {rate:6.1%}")
+
+    def show_summary(self):
+        """Render the aggregate views for the whole run"""
+        print(f"\n{'='*70}")
+        print(f"SUMMARY: {self.cache_type}, {self.total_accesses} accesses")
+        print(f"{'='*70}")
+        print(f"  Hits:     {self.cache.hits}")
+        print(f"  Misses:   {self.cache.misses}")
+        print(f"  Hit Rate: {self.cache.hit_rate():.1%}")
 
-            for i, access in enumerate(self.access_history, 1):
-                result = "HIT ✓" if access['hit'] else "MISS ✗"
-                print(f"{i:3d} | {access['address']:7d} | "
-                      f"{access['tag']:6d} | {result:>6}")
+        if getattr(self.cache, 'classifier', None):
+            self.cache.classifier.show_report()
+        self.show_miss_heatmap()
+        self.show_hit_rate_timeline()
 
 
 def demo_spatial_locality():
@@ -589,6 +883,26 @@ def demo_comparison():
     print(f"  Fully Associative: Complex hardware (parallel search), no conflicts")
 
 
+def demo_large_trace():
+    """Summarize a long strided trace instead of printing every access"""
+    print("\n" + "="*70)
+    print("DEMO: Large Trace Summary")
+    print("="*70)
+    print("\nCache: 64 lines, 16 bytes per line")
+    print("Workload: 100,000 accesses looping over a 512-byte buffer, then")
+    print("          100,000 accesses sweeping a 4 KB array with stride 40")
+
+    cache = DirectMappedCache(num_lines=64, line_size=16, classify_misses=True)
+    memory = [i % 256 for i in range(4096)]
+    viz = CacheVisualizer(cache, memory, history_size=16, summary_only=True, window=10000)
+
+    viz.record_trace(i % 512 for i in range(100000))
+    viz.record_trace((i * 40) % 4096 for i in range(100000))
+
+    viz.show_summary()
+    viz.show_access_pattern(last=8)
+
+
 # Helper functions for testing
 def int_to_bits(value, width=16):
     """Convert integer to list of bits (LSB first)
@@ -0,0 +1,243 @@
+"""
+Perflab Traces - Address streams of the perflab rotate/smooth kernels
+
+Generators that reproduce, access by access, the memory references made by
+the kernels in
+systems_programming/module_10_cache_memory/perflab/perflab/kernels.c:
+
+- naive_rotate, blocked_rotate (optimized_rotate with any tile size)
+- naive_smooth, blocked_smooth (naive_smooth visiting T x T tiles),
+  optimized_smooth (corners, edges, then interior)
+
+A pixel is three unsigned shorts (red, green, blue) = 6 bytes, and each
+field is one 2-byte access, in the order the C code touches them. Only
+image memory is traced; loop counters and pixel_sum locals are assumed to
+live in registers.
+
+Traces are lazy, so they can be fed straight into a cache:
+    cache = DirectMappedCache(num_lines=512, line_size=64)
+    memory = [0] * image_footprint(256)
+    for addr in blocked_rotate_trace(256, tile=16):
+        cache.access(addr, memory)
+"""
+
+PIXEL_SIZE = 6
+FIELD_OFFSETS = (0, 2, 4)  # red, green, blue
+
+
+def image_layout(dim, src_base=0, dst_base=None, align=64):
+    """
+    Place src and dst images in memory.
+
+    Args:
+        dim: Image is dim x dim pixels
+        src_base: Byte address of src[0]
+        dst_base: Byte address of dst[0] (default: after src, aligned)
+        align: Alignment used for the default dst_base
+
+    Returns:
+        Tuple (src_base, dst_base, end) where end is one past the last byte
+    """
+    image_bytes = dim * dim * PIXEL_SIZE
+    if dst_base is None:
+        dst_base = (src_base + image_bytes + align - 1) // align * align
+    return src_base, dst_base, max(src_base, dst_base) + image_bytes
+
+
+def image_footprint(dim, src_base=0, dst_base=None):
+    """Size of a memory list large enough for both images"""
+    return image_layout(dim, src_base, dst_base)[2]
+
+
+def _pixel(base, index, op):
+    """The three field accesses of one pixel"""
+    address = base + index * PIXEL_SIZE
+    return [(op, address), (op, address + 2), (op, address + 4)]
+
+
+def _rotate(dim, src, dst, tile):
+    """dst[RIDX(dim-1-jj, ii, dim)] = src[RIDX(ii, jj, dim)], tile by tile"""
+    for i in range(0, dim, tile):
+        for j in range(0, dim, tile):
+            for ii in range(i, min(i + tile, dim)):
+                for jj in range(j, min(j + tile, dim)):
+                    yield from _pixel(src, ii * dim + jj, 'R')
+                    yield from _pixel(dst, (dim - 1 - jj) * dim + ii, 'W')
+
+
+def _avg(dim, src, dst, i, j):
+    """avg(): read the clipped 3x3 neighbourhood, then store dst[i][j]"""
+    for ii in range(max(i - 1, 0), min(i + 1, dim - 1) + 1):
+        for jj in range(max(j - 1, 0), min(j + 1, dim - 1) + 1):
+            yield from _pixel(src, ii * dim + jj, 'R')
+    yield from _pixel(dst, i * dim + j, 'W')
+
+
+def _smooth(dim, src, dst, tile):
+    """naive_smooth visiting the image in tile x tile blocks"""
+    for i in range(0, dim, tile):
+        for j in range(0, dim, tile):
+            for ii in range(i, min(i + tile, dim)):
+                for jj in range(j, min(j + tile, dim)):
+                    yield from _avg(dim, src, dst, ii, jj)
+
+
+def _fieldwise(src, dst, curr, neighbours):
+    """optimized_smooth style: red of every neighbour, store red, then green, blue"""
+    for offset in FIELD_OFFSETS:
+        for n in neighbours:
+            yield 'R', src + n * PIXEL_SIZE + offset
+        yield 'W', dst + curr * PIXEL_SIZE + offset
+
+
+def _optimized_smooth(dim, src, dst):
+    """Same visiting and field order as optimized_smooth in kernels.c"""
+    # Corners
+    yield from _fieldwise(src, dst, 0, (0, 1, dim, dim + 1))
+    curr = dim - 1
+    yield from _fieldwise(src, dst, curr, (curr, curr - 1, curr + dim - 1, curr + dim))
+    curr *= dim
+    yield from _fieldwise(src, dst, curr, (curr, curr + 1, curr - dim, curr - dim + 1))
+    curr += dim - 1
+    yield from _fieldwise(src, dst, curr, (curr, curr - 1, curr - dim, curr - dim - 1))
+
+    # Edge 0 (top row)
+    for ii in range(1, dim - 1):
+        yield from _fieldwise(src, dst, ii,
+                              (ii, ii - 1, ii + 1, ii + dim, ii + dim - 1, ii + dim + 1))
+    # Edge 3 (bottom row)
+    for ii in range((dim - 1) * dim + 1, dim * dim - 1):
+        yield from _fieldwise(src, dst, ii,
+                              (ii, ii - 1, ii + 1, ii - dim, ii - dim - 1, ii - dim + 1))
+    # Edge 1 (left column)
+    limit = dim * (dim - 1)
+    for jj in range(dim, limit, dim):
+        yield from _fieldwise(src, dst, jj,
+                              (jj, jj + 1, jj - dim, jj - dim + 1, jj + dim, jj + dim + 1))
+    # Edge 2 (right column)
+    for jj in range(2 * dim - 1, limit, dim):
+        yield from _fieldwise(src, dst, jj,
+                              (jj, jj - 1, jj - dim, jj - dim - 1, jj + dim, jj + dim - 1))
+
+    # Interior
+    for i in range(1, dim - 1):
+        for j in range(1, dim - 1):
+            c = i * dim + j
+            yield from _fieldwise(src, dst, c, (
+                c, c - 1, c + 1,
+                c - dim, c - dim - 1, c - dim + 1,
+                c + dim, c + dim - 1, c + dim + 1,
+            ))
+
+
+def _emit(stream, ops):
+    """Yield (op, address) pairs or bare addresses"""
+    if ops:
+        return stream
+    return (address for _, address in stream)
+
+
+def naive_rotate_trace(dim, src_base=0, dst_base=None, ops=False):
+    """
+    Address stream of naive_rotate.
+
+    Args:
+        dim: Image dimension
+        src_base, dst_base: Image placement (see image_layout)
+        ops: Yield ('R'|'W', address) pairs instead of bare addresses
+    """
+    src, dst, _ = image_layout(dim, src_base, dst_base)
+    return _emit(_rotate(dim, src, dst, dim), ops)
+
+
+def blocked_rotate_trace(dim, tile=16, src_base=0, dst_base=None, ops=False):
+    """Address stream of optimized_rotate with a tile x tile block size"""
+    src, dst, _ = image_layout(dim, src_base, dst_base)
+    return _emit(_rotate(dim, src, dst, tile), ops)
+
+
+def naive_smooth_trace(dim, src_base=0, dst_base=None, ops=False):
+    """Address stream of naive_smooth"""
+    src, dst, _ = image_layout(dim, src_base, dst_base)
+    return _emit(_smooth(dim, src, dst, dim), ops)
+
+
+def blocked_smooth_trace(dim, tile=16, src_base=0, dst_base=None, ops=False):
+    """Address stream of naive_smooth's per-pixel avg() over tile x tile blocks"""
+    src, dst, _ = image_layout(dim, src_base, dst_base)
+    return _emit(_smooth(dim, src, dst, tile), ops)
+
+
+def optimized_smooth_trace(dim, src_base=0, dst_base=None, ops=False):
+    """Address stream of optimized_smooth (needs dim >= 2)"""
+    src, dst, _ = image_layout(dim, src_base, dst_base)
+    return _emit(_optimized_smooth(dim, src, dst), ops)
+
+
+# Kernels with a tile-size knob, used by sweep_tile_sizes
+TILED_KERNELS = {
+    "rotate": (naive_rotate_trace, blocked_rotate_trace),
+    "smooth": (naive_smooth_trace, blocked_smooth_trace),
+}
+
+
+def sweep_tile_sizes(kernel, dim, tile_sizes, make_cache):
+    """
+    Simulate one kernel at several tile sizes against the same cache geometry.
+
+    Args:
+        kernel: "rotate" or "smooth"
+        dim: Image dimension
+        tile_sizes: Tile sizes to try
+        make_cache: Zero-argument callable returning a fresh cache
+
+    Returns:
+        List of (label, cache) pairs, naive baseline first
+    """
+    naive, blocked = TILED_KERNELS[kernel]
+    memory = [0] * image_footprint(dim)
+
+    runs = [("naive", naive(dim))]
+    runs += [(f"tile={tile}", blocked(dim, tile)) for tile in tile_sizes]
+
+    results = []
+    for label, trace in runs:
+        cache = make_cache()
+        access = cache.access
+        for address in trace:
+            access(address, memory)
+        results.append((label, cache))
+    return results
+
+
+def show_sweep(results):
+    """Print a sweep table and point out the best configuration"""
+    print(f"\n{'Variant':>10} | {'Accesses':>10} | {'Misses':>9} | {'Miss rate':>9}")
+    print(f"{'-'*10}-+-{'-'*10}-+-{'-'*9}-+-{'-'*9}")
+    for label, cache in results:
+        total = cache.hits + cache.misses
+        print(f"{label:>10} | {total:10d} | {cache.misses:9d} | {1 - cache.hit_rate():9.2%}")
+
+    best_label, best_cache = min(results, key=lambda item: item[1].misses)
+    print(f"\nFewest misses: {best_label} ({best_cache.misses})")
+
+
+def demo_rotate_sweep():
+    """Find the best rotate tile size for a 4 KB direct-mapped cache"""
+    from memory_hierarchy import DirectMappedCache
+
+    print("\n" + "="*70)
+    print("DEMO: Rotate Tile-Size Sweep")
+    print("="*70)
+    print("\nImage: 64 x 64 pixels (6 bytes each)")
+    print("Cache: direct-mapped, 128 lines x 32 bytes (4 KB)")
+
+    results = sweep_tile_sizes(
+        "rotate", 64, [4, 8, 16, 32],
+        lambda: DirectMappedCache(num_lines=128, line_size=32),
+    )
+    show_sweep(results)
+
+
+if __name__ == "__main__":
+    demo_rotate_sweep()
@@ -1,5 +1,10 @@
+import io
 import unittest
+from contextlib import redirect_stdout
 from memory_hierarchy import *
+from cache_coherence import MultiCoreSystem, interleave_traces
+from virtual_memory import TLB, PageTable, MMU
+from perflab_traces import *
 
 # -----------------------------------------------------------
 #  DFF
@@ -366,6 +371,291 @@ class TestFullyAssociativeCache(unittest.TestCase):
         self.assertTrue(hit)
 
 
+# -----------------------------------------------------------
+#  CacheVisualizer
+# -----------------------------------------------------------
+
+class TestCacheVisualizer(unittest.TestCase):
+    def setUp(self):
+        self.memory = [i % 256 for i in range(1024)]
+
+    def test_ring_buffer_keeps_most_recent(self):
+        """History is bounded and holds the newest accesses in order"""
+        cache = DirectMappedCache(num_lines=8, line_size=16)
+        viz = CacheVisualizer(cache, self.memory, history_size=4, summary_only=True)
+        viz.record_trace([0, 16, 32, 48, 64, 80])
+
+        self.assertEqual(viz.total_accesses, 6)
+        history = viz.access_history
+        self.assertEqual([a['address'] for a in history], [32, 48, 64, 80])
+        self.assertEqual(history[-1]['index'], 5)
+        self.assertFalse(history[-1]['hit'])
+
+    def test_summary_only_renders_nothing(self):
+        """summary_only suppresses per-access output until asked"""
+        cache = DirectMappedCache(num_lines=8, line_size=16)
+        viz = CacheVisualizer(cache, self.memory, summary_only=True)
+
+        out = io.StringIO()
+        with redirect_stdout(out):
+            viz.visualize_access(0)
+            viz.visualize_access(5)
+        self.assertEqual(out.getvalue(), "")
+
+        with redirect_stdout(out):
+            viz.show_summary()
+        self.assertIn("MISS HEATMAP", out.getvalue())
+        self.assertIn("HIT RATE OVER TIME", out.getvalue())
+
+    def test_per_set_misses(self):
+        """Conflicting addresses pile their misses onto one set"""
+        cache = DirectMappedCache(num_lines=8, line_size=16)
+        viz = CacheVisualizer(cache, self.memory, summary_only=True)
+        viz.record_trace([0, 128, 0, 128, 16])
+
+        self.assertEqual(viz.set_misses[0], 4)
+        self.assertEqual(viz.set_misses[1], 1)
+        self.assertEqual(sum(viz.set_accesses), 5)
+
+    def test_hit_rate_windows(self):
+        """Windowed hit rate tracks phases of the trace"""
+        cache = DirectMappedCache(num_lines=8, line_size=16)
+        viz = CacheVisualizer(cache, self.memory, summary_only=True, window=4)
+        viz.record_trace([0, 1, 2, 3])          # 1 miss, 3 hits
+        viz.record_trace([0, 128, 256, 384])    # 1 hit, 3 misses
+        viz.record_trace([384, 385])            # partial window, 2 hits
+
+        self.assertEqual(viz.hit_rate_windows(), [0.75, 0.25, 1.0])
+
+    def test_fully_associative_single_set(self):
+        """Fully associative caches report one set and block-number tags"""
+        cache = FullyAssociativeCache(num_lines=4, line_size=16)
+        viz = CacheVisualizer(cache, self.memory, summary_only=True)
+        viz.record_trace([0, 128, 0])
+
+        self.assertEqual(viz.num_sets, 1)
+        self.assertEqual([a['tag'] for a in viz.access_history], [0, 8, 0])
+        self.assertEqual(viz.set_misses[0], 2)
+
+
+# -----------------------------------------------------------
+#  MissClassifier (3Cs)
+# -----------------------------------------------------------
+
+class TestMissClassifier(unittest.TestCase):
+    def setUp(self):
+        self.memory = [i % 256 for i in range(4096)]
+
+    def test_conflict_misses_direct_mapped(self):
+        """Ping-ponging between two blocks on one set is a conflict problem"""
+        cache = DirectMappedCache(num_lines=8, line_size=16, classify_misses=True)
+        for addr in [0, 128, 0, 128, 0]:
+            cache.access(addr, self.memory)
+
+        self.assertEqual(cache.classifier.breakdown(), {
+            'compulsory': 2, 'capacity': 0, 'conflict': 3,
+        })
+        self.assertEqual(cache.classifier.set_breakdown(0)['conflict'], 3)
+        self.assertEqual(cache.classifier.set_breakdown(1)['conflict'], 0)
+
+    def test_capacity_misses(self):
+        """Cycling through more blocks than the cache holds is a capacity problem"""
+        cache = DirectMappedCache(num_lines=4, line_size=16, classify_misses=True)
+        trace = [i * 16 for i in range(5)] * 3  # 5 blocks, 4 lines
+        for addr in trace:
+            cache.access(addr, self.memory)
+
+        breakdown = cache.classifier.breakdown()
+        self.assertEqual(breakdown['compulsory'], 5)
+        self.assertEqual(sum(breakdown.values()), cache.misses)
+        self.assertGreater(breakdown['capacity'], 0)
+
+    def test_fully_associative_has_no_conflicts(self):
+        """An LRU fully associative cache matches its own shadow exactly"""
+        cache = FullyAssociativeCache(num_lines=4, line_size=16, classify_misses=True)
+        for addr in [0, 16, 32, 48, 64, 0, 16, 128, 0, 80]:
+            cache.access(addr, self.memory)
+
+        breakdown = cache.classifier.breakdown()
+        self.assertEqual(breakdown['conflict'], 0)
+        self.assertEqual(sum(breakdown.values()), cache.misses)
+
+    def test_classification_is_optional(self):
+        cache = DirectMappedCache(num_lines=8, line_size=16)
+        cache.access(0, self.memory)
+        self.assertIsNone(cache.classifier)
+
+
+# -----------------------------------------------------------
+#  Cache coherence (MSI / MESI)
+# -----------------------------------------------------------
+
+class TestCacheCoherence(unittest.TestCase):
+    def test_mesi_exclusive_write_is_silent(self):
+        """A private read gets E, and the following write needs no bus traffic"""
+        system = MultiCoreSystem(num_cores=2, num_lines=8, line_size=64)
+        system.access(0, 'R', 0)
+        self.assertEqual(system.cores[0].state(0), 'E')
+
+        system.access(0, 'W', 0)
+        self.assertEqual(system.cores[0].state(0), 'M')
+        self.assertEqual(system.bus.transactions['BusRd'], 1)
+        self.assertEqual(system.bus.total(), 1)
+
+    def test_msi_write_needs_upgrade(self):
+        """Without E, a read-then-write costs a BusUpgr"""
+        system = MultiCoreSystem(num_cores=2, num_lines=8, line_size=64, protocol="MSI")
+        system.access(0, 'R', 0)
+        system.access(0, 'W', 0)
+        self.assertEqual(system.bus.transactions['BusUpgr'], 1)
+
+    def test_read_of_modified_line_flushes(self):
+        """A remote read of a Modified line forces a write back and shares it"""
+        system = MultiCoreSystem(num_cores=2, num_lines=8, line_size=64)
+        system.access(0, 'W', 0)
+        system.access(1, 'R', 0)
+        self.assertEqual(system.bus.transactions['Flush'], 1)
+        self.assertEqual(system.cores[0].state(0), 'S')
+        self.assertEqual(system.cores[1].state(0), 'S')
+
+    def test_true_and_false_sharing(self):
+        """Re-reading the written word is true sharing, a neighbour is false"""
+        system = MultiCoreSystem(num_cores=3, num_lines=8, line_size=64)
+        for core in range(3):
+            system.access(core, 'R', 0)
+        system.access(0, 'W', 0)   # Invalidates cores 1 and 2
+        system.access(1, 'R', 0)   # Same word: true sharing
+        system.access(2, 'R', 8)   # Different word: false sharing
+
+        stats = system.line_stats[0]
+        self.assertEqual(stats['invalidations'], 2)
+        self.assertEqual(stats['coherence_misses'], 2)
+        self.assertEqual(stats['true_sharing'], 1)
+        self.assertEqual(stats['false_sharing'], 1)
+
+    def test_padding_removes_coherence_traffic(self):
+        """Counters on separate lines never invalidate each other"""
+        traces = [[(op, core * 64) for _ in range(50) for op in ('R', 'W')] for core in range(2)]
+        system = MultiCoreSystem(num_cores=2, num_lines=8, line_size=64)
+        system.run(interleave_traces(traces))
+        self.assertEqual(system.totals()['invalidations'], 0)
+
+        traces = [[(op, core * 4) for _ in range(50) for op in ('R', 'W')] for core in range(2)]
+        system = MultiCoreSystem(num_cores=2, num_lines=8, line_size=64)
+        system.run(interleave_traces(traces))
+        self.assertGreater(system.totals()['false_sharing'], 0)
+
+    def test_eviction_writes_back_dirty_line(self):
+        """Capacity eviction of a Modified line is a Flush and clears the state"""
+        system = MultiCoreSystem(num_cores=1, num_lines=1, line_size=16)
+        system.access(0, 'W', 0)
+        system.access(0, 'R', 16)  # Same (only) line, evicts block 0
+        self.assertEqual(system.bus.transactions['Flush'], 1)
+        self.assertEqual(system.cores[0].state(0), 'I')
+
+
+# -----------------------------------------------------------
+#  Virtual memory (TLB + page tables)
+# -----------------------------------------------------------
+
+class TestVirtualMemory(unittest.TestCase):
+    def test_tlb_lru_replacement(self):
+        tlb = TLB(entries=2, associativity=2)
+        tlb.insert(1, 0x100)
+        tlb.insert(2, 0x200)
+        self.assertEqual(tlb.lookup(1), 0x100)  # 1 becomes most recent
+        tlb.insert(3, 0x300)                    # Evicts 2
+        self.assertIsNone(tlb.lookup(2))
+        self.assertEqual(tlb.lookup(1), 0x100)
+        self.assertEqual(tlb.hits, 2)
+        self.assertEqual(tlb.misses, 1)
+
+    def test_tlb_geometry_validation(self):
+        with self.assertRaises(ValueError):
+            TLB(entries=6, associativity=4)
+        with self.assertRaises(ValueError):
+            TLB(replacement="MRU")
+
+    def test_page_walk_references(self):
+        """A walk reads one PTE per level, and the page keeps its offset"""
+        pt = PageTable(levels=3, page_size=256, bits_per_level=4)
+        frame, refs = pt.walk(0x1234)
+        self.assertEqual(len(refs), 3)
+        self.assertEqual(frame % 256, 0)
+
+        # Same page again: same frame, no new mapping
+        frame2, _ = pt.walk(0x12FF)
+        self.assertEqual(frame2, frame)
+        self.assertEqual(pt.mapped_pages, 1)
+
+    def test_huge_pages_shorten_walks(self):
+        pt = PageTable(levels=3, page_size=256, bits_per_level=4, huge_pages=True)
+        self.assertEqual(pt.page_size, 4096)
+        _, refs = pt.walk(0x1234)
+        self.assertEqual(len(refs), 2)
+
+    def test_mmu_translation_and_tlb(self):
+        """Only the first touch of each page walks the table"""
+        mmu = MMU(PageTable(levels=3, page_size=256, bits_per_level=4), TLB(entries=4, associativity=4))
+        p1 = mmu.translate(0x1010)
+        p2 = mmu.translate(0x1020)
+        self.assertEqual(p2 - p1, 0x10)
+        self.assertEqual(mmu.walks, 1)
+        self.assertEqual(mmu.walk_references, 3)
+        self.assertEqual(mmu.tlb.hits, 1)
+
+    def test_mmu_feeds_cache(self):
+        """Walk PTE reads and data both go through the cache"""
+        memory = [0] * (1 << 16)
+        cache = DirectMappedCache(num_lines=16, line_size=16)
+        mmu = MMU(PageTable(levels=2, page_size=256, bits_per_level=4), TLB(entries=4, associativity=2),
+                  cache=cache, memory=memory)
+        mmu.run([0, 4, 8])
+        self.assertEqual(cache.hits + cache.misses, 3 + 2)  # 3 data + 2 PTE reads
+
+
+# -----------------------------------------------------------
+#  Perflab kernel traces
+# -----------------------------------------------------------
+
+class TestPerflabTraces(unittest.TestCase):
+    def test_rotate_trace_shape(self):
+        """Each pixel copy is 3 field reads then 3 field writes"""
+        trace = list(naive_rotate_trace(4, ops=True))
+        self.assertEqual(len(trace), 4 * 4 * 6)
+        self.assertEqual([op for op, _ in trace[:6]], ['R'] * 3 + ['W'] * 3)
+
+        src, dst, end = image_layout(4)
+        # src[0][0] goes to dst[3][0]
+        self.assertEqual(trace[0][1], src)
+        self.assertEqual(trace[3][1], dst + 3 * 4 * PIXEL_SIZE)
+        self.assertTrue(all(src <= addr < end for _, addr in trace))
+
+    def test_full_size_tile_matches_naive(self):
+        self.assertEqual(list(blocked_rotate_trace(8, tile=8)), list(naive_rotate_trace(8)))
+        self.assertEqual(list(blocked_smooth_trace(8, tile=8)), list(naive_smooth_trace(8)))
+
+    def test_blocked_rotate_any_dimension(self):
+        """Tiles are clipped when the tile size does not divide dim"""
+        trace = list(blocked_rotate_trace(10, tile=4))
+        self.assertEqual(sorted(trace), sorted(naive_rotate_trace(10)))
+
+    def test_optimized_smooth_reads_same_pixels(self):
+        """optimized_smooth reorders, but touches exactly the same fields"""
+        from collections import Counter
+        self.assertEqual(Counter(optimized_smooth_trace(6)), Counter(naive_smooth_trace(6)))
+
+    def test_sweep_tile_sizes(self):
+        results = sweep_tile_sizes(
+            "rotate", 32, [8],
+            lambda: DirectMappedCache(num_lines=32, line_size=32),
+        )
+        (naive_label, naive), (tile_label, tiled) = results
+        self.assertEqual(naive_label, "naive")
+        self.assertEqual(naive.hits + naive.misses, tiled.hits + tiled.misses)
+        self.assertLess(tiled.misses, naive.misses)
+
+
 # -----------------------------------------------------------
 #  Helper Functions
 # -----------------------------------------------------------
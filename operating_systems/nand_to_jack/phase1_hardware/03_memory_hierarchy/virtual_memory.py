@@ -0,0 +1,321 @@
+"""
+Virtual Memory - TLB and multi-level page tables in front of the caches
+
+Virtual addresses are translated by an MMU made of:
+- TLB: small set-associative cache of recent translations
+- PageTable: radix tree walked level by level on a TLB miss; every level
+  read is a real memory reference (the PTE's physical address), so walks
+  can be pushed through the same cache as the program's data
+
+Pages are mapped on first touch to the next free physical frame. With
+huge_pages=True the walk stops one level early and each leaf maps a page
+that is 2**bits_per_level times larger (4 KB -> 2 MB with x86-64 sizes).
+
+Usage:
+    mmu = MMU(PageTable(), TLB(entries=64, associativity=4),
+              cache=DirectMappedCache(), memory=physical_memory)
+    for vaddr in trace:
+        mmu.access(vaddr)
+    mmu.show_report()
+"""
+
+import random
+from collections import OrderedDict
+
+
+class TLB:
+    """
+    Translation Lookaside Buffer.
+
+    Maps virtual page numbers to physical frame bases. Organized like a
+    set-associative cache: associativity=entries makes it fully associative,
+    associativity=1 makes it direct-mapped.
+
+    Replacement policies: "LRU", "FIFO", "random"
+    """
+
+    POLICIES = ("LRU", "FIFO", "random")
+
+    def __init__(self, entries=64, associativity=4, replacement="LRU", seed=0):
+        if entries % associativity:
+            raise ValueError("entries must be a multiple of associativity")
+        if replacement not in self.POLICIES:
+            raise ValueError(f"Unknown replacement policy {replacement!r}")
+
+        self.entries = entries
+        self.associativity = associativity
+        self.replacement = replacement
+        self.num_sets = entries // associativity
+        # Each set is an OrderedDict vpn -> frame; order is LRU or FIFO order
+        self.sets = [OrderedDict() for _ in range(self.num_sets)]
+        self.rng = random.Random(seed)
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, vpn):
+        """Return the cached frame base for vpn, or None on a miss"""
+        ways = self.sets[vpn % self.num_sets]
+        frame = ways.get(vpn)
+        if frame is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        if self.replacement == "LRU":
+            ways.move_to_end(vpn)
+        return frame
+
+    def insert(self, vpn, frame):
+        """Install a translation, evicting one if the set is full"""
+        ways = self.sets[vpn % self.num_sets]
+        if len(ways) >= self.associativity:
+            if self.replacement == "random":
+                del ways[self.rng.choice(list(ways))]
+            else:
+                ways.popitem(last=False)  # Oldest (FIFO) / least recent (LRU)
+        ways[vpn] = frame
+
+    def flush(self):
+        """Drop every translation (e.g. on a context switch)"""
+        for ways in self.sets:
+            ways.clear()
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else 0
+
+
+class PageTable:
+    """
+    Radix page table with demand paging.
+
+    Level 0 is the root. A virtual page number is split into `levels`
+    indices of bits_per_level bits each; each level holds a table of
+    2**bits_per_level PTEs of pte_size bytes in physical memory.
+
+    Tables and frames come from a bump allocator over physical memory,
+    aligned to their own size, starting at phys_base.
+    """
+
+    def __init__(self, levels=4, page_size=4096, bits_per_level=9, pte_size=8,
+                 huge_pages=False, phys_base=0):
+        if page_size & (page_size - 1):
+            raise ValueError("page_size must be a power of two")
+        if huge_pages and levels < 2:
+            raise ValueError("huge pages need at least two levels")
+
+        self.levels = levels
+        self.bits_per_level = bits_per_level
+        self.pte_size = pte_size
+        self.huge_pages = huge_pages
+        self.base_shift = page_size.bit_length() - 1
+        # Huge pages terminate the walk one level early
+        self.leaf_level = levels - 2 if huge_pages else levels - 1
+        self.page_shift = self.base_shift + (bits_per_level if huge_pages else 0)
+        self.page_size = 1 << self.page_shift
+
+        self.next_free = phys_base
+        self.table_bytes = 0
+        self.mapped_pages = 0
+        self.root = self._new_table()
+
+    def _allocate(self, size):
+        """Bump-allocate size bytes of physical memory aligned to size"""
+        base = (self.next_free + size - 1) // size * size
+        self.next_free = base + size
+        return base
+
+    def _new_table(self):
+        size = self.pte_size << self.bits_per_level
+        self.table_bytes += size
+        return [self._allocate(size), {}]  # [physical base, index -> child/frame]
+
+    def walk(self, vaddr):
+        """
+        Translate vaddr the slow way, mapping the page if it is new.
+
+        Returns:
+            Tuple (frame_base, pte_addresses) where pte_addresses lists the
+            physical address of each PTE read, root first
+        """
+        vpn = vaddr >> self.base_shift
+        mask = (1 << self.bits_per_level) - 1
+        node = self.root
+        refs = []
+
+        for level in range(self.leaf_level + 1):
+            index = (vpn >> (self.bits_per_level * (self.levels - 1 - level))) & mask
+            base, entries = node
+            refs.append(base + index * self.pte_size)
+
+            if level == self.leaf_level:
+                frame = entries.get(index)
+                if frame is None:
+                    frame = entries[index] = self._allocate(self.page_size)
+                    self.mapped_pages += 1
+                return frame, refs
+
+            child = entries.get(index)
+            if child is None:
+                child = entries[index] = self._new_table()
+            node = child
+
+
+class MMU:
+    """
+    Translates virtual addresses and forwards them to a cache.
+
+    The target cache is anything with access(address, memory), e.g.
+    DirectMappedCache or FullyAssociativeCache. Page-walk PTE reads go
+    through the same cache when walk_through_cache is True, so walks
+    compete with data for cache lines just like on real hardware.
+    For other consumers, translate_trace() yields physical addresses.
+    """
+
+    def __init__(self, page_table, tlb, cache=None, memory=None, walk_through_cache=True):
+        self.page_table = page_table
+        self.tlb = tlb
+        self.cache = cache
+        self.memory = memory
+        self.walk_through_cache = walk_through_cache
+
+        self.accesses = 0
+        self.walks = 0
+        self.walk_references = 0
+        self.walk_cache_misses = 0
+
+    def translate(self, vaddr):
+        """Virtual -> physical address (TLB first, page walk on a miss)"""
+        shift = self.page_table.page_shift
+        vpn = vaddr >> shift
+        frame = self.tlb.lookup(vpn)
+
+        if frame is None:
+            frame, refs = self.page_table.walk(vaddr)
+            self.walks += 1
+            self.walk_references += len(refs)
+            if self.cache is not None and self.walk_through_cache:
+                for pte_address in refs:
+                    _, hit = self.cache.access(pte_address, self.memory)
+                    if not hit:
+                        self.walk_cache_misses += 1
+            self.tlb.insert(vpn, frame)
+
+        return frame | (vaddr & ((1 << shift) - 1))
+
+    def access(self, vaddr):
+        """Translate and access vaddr through the cache (returns value, hit)"""
+        self.accesses += 1
+        paddr = self.translate(vaddr)
+        if self.cache is None:
+            return None, None
+        return self.cache.access(paddr, self.memory)
+
+    def translate_trace(self, vaddrs):
+        """Lazily translate a virtual trace into physical addresses"""
+        translate = self.translate
+        for vaddr in vaddrs:
+            self.accesses += 1
+            yield translate(vaddr)
+
+    def run(self, vaddrs):
+        """Access every address of a virtual trace; returns the count"""
+        access = self.access
+        count = 0
+        for vaddr in vaddrs:
+            access(vaddr)
+            count += 1
+        return count
+
+    def stats(self):
+        """Translation counters for the run so far"""
+        return {
+            "accesses": self.accesses,
+            "tlb_hit_rate": self.tlb.hit_rate(),
+            "walks": self.walks,
+            "walk_references": self.walk_references,
+            "walk_refs_per_access": self.walk_references / self.accesses if self.accesses else 0,
+            "walk_cache_misses": self.walk_cache_misses,
+            "page_size": self.page_table.page_size,
+            "mapped_pages": self.page_table.mapped_pages,
+            "page_table_bytes": self.page_table.table_bytes,
+        }
+
+    def show_report(self):
+        """Print TLB and page-walk statistics"""
+        stats = self.stats()
+
+        print(f"\n{'='*70}")
+        print(f"ADDRESS TRANSLATION ({stats['page_size']}-byte pages, "
+              f"{self.tlb.entries}-entry {self.tlb.associativity}-way TLB, {self.tlb.replacement})")
+        print(f"{'='*70}")
+        print(f"  Accesses:          {stats['accesses']}")
+        print(f"  TLB hit rate:      {stats['tlb_hit_rate']:.2%}")
+        print(f"  Page walks:        {stats['walks']}")
+        print(f"  Walk memory refs:  {stats['walk_references']} "
+              f"({stats['walk_refs_per_access']:.3f} per access)")
+        if self.cache is not None and self.walk_through_cache:
+            print(f"  Walk cache misses: {stats['walk_cache_misses']}")
+        print(f"  Pages mapped:      {stats['mapped_pages']} "
+              f"(page tables use {stats['page_table_bytes']} bytes)")
+        if self.cache is not None:
+            print(f"  Cache hit rate:    {self.cache.hit_rate():.2%} (data + walks)")
+
+
+def compare_page_sizes(trace, make_cache, memory, tlb_entries=64, tlb_associativity=4, **page_table_args):
+    """
+    Run the same virtual trace with base pages and with huge pages.
+
+    Args:
+        trace: Sequence of virtual addresses (iterated twice)
+        make_cache: Zero-argument callable returning a fresh cache
+        memory: Physical memory list backing the caches
+        tlb_entries, tlb_associativity: TLB geometry
+        page_table_args: Forwarded to PageTable (levels, page_size, ...)
+
+    Returns:
+        Dict {"base": mmu, "huge": mmu} after both runs
+    """
+    results = {}
+    for label, huge in (("base", False), ("huge", True)):
+        mmu = MMU(
+            PageTable(huge_pages=huge, **page_table_args),
+            TLB(entries=tlb_entries, associativity=tlb_associativity),
+            cache=make_cache(),
+            memory=memory,
+        )
+        mmu.run(trace)
+        results[label] = mmu
+    return results
+
+
+def demo_huge_pages():
+    """Strided sweep over a large array with small and huge pages"""
+    from memory_hierarchy import DirectMappedCache
+
+    print("\n" + "="*70)
+    print("DEMO: Do Huge Pages Pay Off?")
+    print("="*70)
+    print("\nPage table: 3 levels x 4 bits, 256-byte base pages, 4 KB huge pages")
+    print("TLB: 8 entries, 2-way. Cache: 64 lines x 16 bytes")
+    print("Workload: 4 passes over 64 KB with a 128-byte stride")
+
+    trace = [addr for _ in range(4) for addr in range(0, 1 << 16, 128)]
+    memory = [0] * (1 << 18)
+    results = compare_page_sizes(
+        trace,
+        lambda: DirectMappedCache(num_lines=64, line_size=16),
+        memory,
+        tlb_entries=8,
+        tlb_associativity=2,
+        levels=3,
+        page_size=256,
+        bits_per_level=4,
+    )
+
+    for label, mmu in results.items():
+        print(f"\n--- {label} pages ---")
+        mmu.show_report()
+
+
+if __name__ == "__main__":
+    demo_huge_pages()
@@ -2,15 +2,70 @@
 ALU (Arithmetic Logic Unit) - Performs all arithmetic and logical operations
 """
 
+# comp bits -> operation on (D, A-or-M), both unsigned 16-bit.
+# Two's complement arithmetic modulo 2^16 needs no signed conversion:
+# masking the unsigned result gives the same bits.
+OPERATIONS = {
+    # Constants
+    0b101010: lambda d, a: 0,                           # 0
+    0b111111: lambda d, a: 1,                           # 1
+    0b111010: lambda d, a: 0xFFFF,                      # -1
+
+    # Pass-through
+    0b001100: lambda d, a: d,                           # D
+    0b110000: lambda d, a: a,                           # A or M
+
+    # Bitwise NOT
+    0b001101: lambda d, a: ~d & 0xFFFF,                 # !D
+    0b110001: lambda d, a: ~a & 0xFFFF,                 # !A or !M
+
+    # Arithmetic negate (two's complement)
+    0b001111: lambda d, a: -d & 0xFFFF,                 # -D
+    0b110011: lambda d, a: -a & 0xFFFF,                 # -A or -M
+
+    # Increment
+    0b011111: lambda d, a: (d + 1) & 0xFFFF,            # D+1
+    0b110111: lambda d, a: (a + 1) & 0xFFFF,            # A+1 or M+1
+
+    # Decrement
+    0b001110: lambda d, a: (d - 1) & 0xFFFF,            # D-1
+    0b110010: lambda d, a: (a - 1) & 0xFFFF,            # A-1 or M-1
+
+    # Addition
+    0b000010: lambda d, a: (d + a) & 0xFFFF,            # D+A or D+M
+
+    # Subtraction
+    0b010011: lambda d, a: (d - a) & 0xFFFF,            # D-A or D-M
+    0b000111: lambda d, a: (a - d) & 0xFFFF,            # A-D or M-D
+
+    # Bitwise operations
+    0b000000: lambda d, a: d & a,                       # D&A or D&M
+    0b010101: lambda d, a: d | a,                       # D|A or D|M
+}
+
+# Extended ISA (CPU(extended_isa=True)): comp encodings the Hack ALU
+# leaves unused. Shift counts are the low 4 bits of A or M.
+EXTENDED_OPERATIONS = {
+    0b000001: lambda d, a: (d * a) & 0xFFFF,            # D*A or D*M (low 16 bits)
+    0b000011: lambda d, a: (d << (a & 0xF)) & 0xFFFF,   # D<<A or D<<M
+    0b000100: lambda d, a: d >> (a & 0xF),              # D>>A or D>>M (logical)
+}
+ALL_OPERATIONS = {**OPERATIONS, **EXTENDED_OPERATIONS}
+
+
 class ALU:
     """
     Arithmetic Logic Unit for the Hack computer.
 
     Performs computation based on 6-bit comp field from C-instructions.
     Supports arithmetic operations (addition, subtraction, increment, decrement),
-    bitwise operations (AND, OR, NOT), and constant generation.
+    bitwise operations (AND, OR, NOT), and constant generation. With
+    extended=True it also multiplies and shifts (EXTENDED_OPERATIONS).
     """
 
+    def __init__(self, extended=False):
+        self.operations = ALL_OPERATIONS if extended else OPERATIONS
+
     def compute(self, comp_bits, d_val, ay_val):
         """
         Perform ALU operation based on comp bits (6-bit comp field, no a-bit).
@@ -23,52 +78,4 @@ class ALU:
         Returns:
             16-bit result of the computation (unsigned)
         """
-        # Helper to convert to signed 16-bit
-        def to_signed(val):
-            val = val & 0xFFFF
-            return val if val < 0x8000 else val - 0x10000
-
-        # Helper to convert back to unsigned 16-bit
-        def to_unsigned(val):
-            return val & 0xFFFF
-
-        operations = {
-            # Constants
-            0b101010: lambda d, a: 0,                           # 0
-            0b111111: lambda d, a: 1,                           # 1
-            0b111010: lambda d, a: -1,                          # -1
-
-            # Pass-through
-            0b001100: lambda d, a: d,                           # D
-            0b110000: lambda d, a: a,                           # A or M
-
-            # Bitwise NOT
-            0b001101: lambda d, a: ~d,                          # !D
-            0b110001: lambda d, a: ~a,                          # !A or !M
-
-            # Arithmetic negate (two's complement)
-            0b001111: lambda d, a: -to_signed(d),               # -D
-            0b110011: lambda d, a: -to_signed(a),               # -A or -M
-
-            # Increment
-            0b011111: lambda d, a: to_signed(d) + 1,            # D+1
-            0b110111: lambda d, a: to_signed(a) + 1,            # A+1 or M+1
-
-            # Decrement
-            0b001110: lambda d, a: to_signed(d) - 1,            # D-1
-            0b110010: lambda d, a: to_signed(a) - 1,            # A-1 or M-1
-
-            # Addition
-            0b000010: lambda d, a: to_signed(d) + to_signed(a), # D+A or D+M
-
-            # Subtraction
-            0b010011: lambda d, a: to_signed(d) - to_signed(a), # D-A or D-M
-            0b000111: lambda d, a: to_signed(a) - to_signed(d), # A-D or M-D
-
-            # Bitwise operations
-            0b000000: lambda d, a: d & a,                       # D&A or D&M
-            0b010101: lambda d, a: d | a,                       # D|A or D|M
-        }
-
-        result = operations[comp_bits](d_val, ay_val)
-        return to_unsigned(result)
+        return self.operations[comp_bits](d_val & 0xFFFF, ay_val & 0xFFFF)
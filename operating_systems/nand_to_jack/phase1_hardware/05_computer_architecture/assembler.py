@@ -11,9 +11,17 @@ class Assembler:
     Instruction types:
     - A-instruction: @value → 0vvvvvvvvvvvvvvv
     - C-instruction: dest=comp;jump → 111accccccdddjjj
+
+    With extended=True the comp table also has the extended ISA's
+    multiply and shift instructions (run them on CPU(extended_isa=True)).
     """
 
-    def __init__(self):
+    EXTENDED_COMP = {
+        "D*A": "0000001", "D*M": "1000001", "D<<A": "0000011", "D<<M": "1000011",
+        "D>>A": "0000100", "D>>M": "1000100"
+    }
+
+    def __init__(self, extended=False):
         '''
         Computation codes (comp field):
 
@@ -37,6 +45,11 @@ class Assembler:
         A-D    | A-D    | M-D    | 000111  | Subtract D from A/M
         D&A    | D&A    | D&M    | 000000  | Bitwise AND
         D|A    | D|A    | D|M    | 010101  | Bitwise OR
+
+        Extended ISA (extended=True):
+        D*A    | D*A    | D*M    | 000001  | Multiply (low 16 bits)
+        D<<A   | D<<A   | D<<M   | 000011  | Shift D left by A/M (low 4 bits)
+        D>>A   | D>>A   | D>>M   | 000100  | Shift D right, logical
         '''
         self.comp_table = {
             "0": "0101010", "1": "0111111", "-1": "0111010", "D": "0001100", "A": "0110000", "M": "1110000",
@@ -45,6 +58,8 @@ class Assembler:
             "D+A": "0000010", "D+M": "1000010", "D-A": "0010011", "D-M": "1010011", "A-D": "0000111", "M-D": "1000111",
             "D&A": "0000000", "D&M": "1000000", "D|A": "0010101", "D|M": "1010101"
         }
+        if extended:
+            self.comp_table.update(self.EXTENDED_COMP)
         self.dest_table = {
             "": "000", "M": "001", "D": "010", "MD": "011", "A": "100", "AM": "101", "AD": "110", "AMD": "111"
         }
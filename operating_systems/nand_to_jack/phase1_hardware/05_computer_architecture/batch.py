@@ -0,0 +1,245 @@
+"""
+Batch - Run many ROM images and RAM vectors over a process pool
+
+A manifest lists jobs; each job is one ROM image with any number of
+cases (initial RAM presets, a cycle budget and expected RAM words):
+
+    {
+      "jobs": [
+        {
+          "name": "max",
+          "rom": "Max.hack",              # or an image; relative to the manifest
+          "max_cycles": 10000,
+          "read": [2],                    # words reported for every case
+          "cases": [
+            {"name": "3,5", "ram": {"0": 3, "1": 5}, "expect": {"2": 5}},
+            {"ram": {"0": 9, "1": 2}, "expect": {"2": 9}, "max_cycles": 500},
+            {"ram": {"100": [1, 2, 3]}}   # a list fills consecutive words
+          ]
+        }
+      ]
+    }
+
+Every ROM image is read once, in the parent, and handed to each worker
+once through the pool initializer. A worker builds one CPU per ROM on
+first use, snapshots its clean state and restores that snapshot before
+every case (see snapshot.py), so a case costs its presets and its run,
+not a CPU construction. Cases are sent in chunks and results stream
+back as compact tuples (cycles, halted, words read) in completion order.
+
+Usage:
+    python batch.py manifest.json
+    python batch.py manifest.json --workers 8 --results results.jsonl
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+from pathlib import Path
+
+from cpu import CPU
+from image import read_program
+
+
+class Case:
+    """One run of a job: RAM presets, budget and expected words"""
+
+    def __init__(self, name, ram=None, expect=None, max_cycles=None):
+        self.name = name
+        self.ram = ram or {}            # Address -> value or list of values
+        self.expect = expect or {}      # Address -> expected value
+        self.max_cycles = max_cycles    # None: the job's budget
+
+
+class Job:
+    """A ROM image and the cases to run on it"""
+
+    def __init__(self, name, words, cases, max_cycles=10000, read=()):
+        self.name = name
+        self.words = list(words)        # ROM image as 16-bit ints
+        self.cases = cases
+        self.max_cycles = max_cycles
+        self.read = list(read)
+
+    def addresses(self):
+        """Every address reported: `read` plus all expected addresses"""
+        addresses = dict.fromkeys(self.read)
+        for case in self.cases:
+            addresses.update(dict.fromkeys(case.expect))
+        return list(addresses)
+
+
+def read_hack(path):
+    """A .hack file or binary image (see image.py) as a list of 16-bit ints"""
+    return read_program(path).words.tolist()
+
+
+def _addresses(mapping):
+    return {int(address): value for address, value in mapping.items()}
+
+
+def load_manifest(path):
+    """
+    Parse a manifest file.
+
+    Returns:
+        List of Job
+    """
+    path = Path(path)
+    with open(path) as f:
+        manifest = json.load(f)
+
+    jobs = []
+    for j, entry in enumerate(manifest["jobs"]):
+        cases = [Case(case.get("name", str(i)), _addresses(case.get("ram", {})),
+                      _addresses(case.get("expect", {})), case.get("max_cycles"))
+                 for i, case in enumerate(entry.get("cases", [{}]))]
+        jobs.append(Job(entry.get("name", entry["rom"]), read_hack(path.parent / entry["rom"]), cases,
+                        entry.get("max_cycles", 10000), [int(a) for a in entry.get("read", [])]))
+    return jobs
+
+
+# ===== Worker side =====
+# Module globals, set once per worker process by _init_worker
+
+_images = []       # ROM image per job
+_options = {}      # CPU keyword arguments
+_machines = {}     # Job index -> (cpu, clean snapshot)
+
+
+def _init_worker(images, options):
+    global _images, _options
+    _images = images
+    _options = options
+    _machines.clear()
+
+
+def _machine(job):
+    if job not in _machines:
+        cpu = CPU(**_options)
+        cpu.rom.load_range(0, _images[job])
+        cpu.predecode()
+        _machines[job] = (cpu, cpu.snapshot())
+    return _machines[job]
+
+
+def _run_chunk(task):
+    """
+    Run a chunk of cases of one job.
+
+    Args:
+        task: (job index, addresses to report, [(case index, presets, max_cycles)])
+
+    Returns:
+        List of (job index, case index, cycles, halted, words)
+    """
+    job, addresses, cases = task
+    cpu, clean = _machine(job)
+    ram = cpu.ram
+    results = []
+    for index, presets, max_cycles in cases:
+        cpu.restore(clean)
+        for address, value in presets.items():
+            if isinstance(value, list):
+                ram.load_range(address, value)
+            else:
+                ram.write(address, value)
+        halted, cycles = cpu.run(max_cycles=max_cycles)
+        results.append((job, index, cycles, halted, [ram.read(a) for a in addresses]))
+    return results
+
+
+# ===== Parent side =====
+
+def _tasks(jobs, addresses, chunk_size):
+    for j, job in enumerate(jobs):
+        cases = [(i, case.ram, job.max_cycles if case.max_cycles is None else case.max_cycles)
+                 for i, case in enumerate(job.cases)]
+        for start in range(0, len(cases), chunk_size):
+            yield (j, addresses[j], cases[start:start + chunk_size])
+
+
+def _result(jobs, addresses, job, index, cycles, halted, words):
+    """Expand a worker tuple into a result dict and check expectations"""
+    case = jobs[job].cases[index]
+    values = dict(zip(addresses[job], words))
+    failures = {address: {"expected": expected, "actual": values[address]}
+                for address, expected in case.expect.items()
+                if values[address] != expected & 0xFFFF}
+    return {
+        "job": jobs[job].name,
+        "case": case.name,
+        "cycles": cycles,
+        "halted": halted,
+        "ram": {str(address): values[address] for address in jobs[job].read},
+        "passed": not failures,
+        "failures": {str(address): failure for address, failure in failures.items()},
+    }
+
+
+def run_batch(jobs, workers=None, chunk_size=64, cpu_options=None):
+    """
+    Run every case of every job, yielding results as they complete.
+
+    Args:
+        jobs: List of Job
+        workers: Worker processes (default: os.cpu_count(); 1 runs in
+                 this process without a pool)
+        chunk_size: Cases per task sent to a worker
+        cpu_options: Keyword arguments for CPU() (e.g. {"jit": True})
+
+    Yields:
+        Result dicts: job, case, cycles, halted, ram (the job's `read`
+        words), passed, failures
+    """
+    images = [job.words for job in jobs]
+    options = cpu_options or {}
+    addresses = [job.addresses() for job in jobs]
+    tasks = _tasks(jobs, addresses, chunk_size)
+    workers = workers or os.cpu_count() or 1
+
+    if workers == 1:
+        _init_worker(images, options)
+        for task in tasks:
+            for row in _run_chunk(task):
+                yield _result(jobs, addresses, *row)
+        return
+
+    with multiprocessing.Pool(workers, _init_worker, (images, options)) as pool:
+        for rows in pool.imap_unordered(_run_chunk, tasks):
+            for row in rows:
+                yield _result(jobs, addresses, *row)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a manifest of Hack programs and RAM vectors")
+    parser.add_argument("manifest", help="JSON manifest (see batch.py)")
+    parser.add_argument("--workers", type=int, help="worker processes (default: all cores)")
+    parser.add_argument("--chunk-size", type=int, default=64, help="cases per task")
+    parser.add_argument("--results", metavar="FILE", help="write one JSON result per line")
+    parser.add_argument("--jit", action="store_true", help="run through the JIT")
+    args = parser.parse_args(argv)
+
+    jobs = load_manifest(args.manifest)
+    out = open(args.results, "w") if args.results else None
+    total = failed = 0
+    try:
+        for result in run_batch(jobs, args.workers, args.chunk_size, {"jit": args.jit}):
+            total += 1
+            if out:
+                out.write(json.dumps(result) + "\n")
+            if not result["passed"]:
+                failed += 1
+                print(f"FAIL {result['job']} [{result['case']}]: {result['failures']}")
+    finally:
+        if out:
+            out.close()
+
+    print(f"{total - failed}/{total} cases passed")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
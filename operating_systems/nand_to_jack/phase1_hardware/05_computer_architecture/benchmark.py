@@ -0,0 +1,189 @@
+"""
+Benchmark - Instructions per second of the CPU run loops
+
+Runs a fixed number of cycles of every benchmark program through each
+execution tier and reports instructions per second:
+- interpreter: CPU(idioms=False), the plain predecoded run loop
+- idioms:      CPU(), with VM-translator superinstructions
+- jit:         CPU(jit=True), compiled basic blocks
+
+Programs:
+- phase2_software/06_assembler/*.asm (assembled with the 06 assembler)
+- phase2_software/08_vm_part2/examples/*/*.hack (translated VM programs)
+
+Programs that halt (or run off the end of ROM) before the cycle budget
+is used up are restarted from a reset, so every measurement covers the
+same number of instructions. Each measurement is the best of --repeat
+runs.
+
+Usage:
+    python benchmark.py
+    python benchmark.py --cycles 500000 --repeat 5 --json results.json
+    python benchmark.py --baseline results.json --tolerance 0.15
+
+With --baseline the run exits with status 1 if any tier's geometric
+mean drops more than --tolerance below the saved results.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import math
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from cpu import CPU
+from symbols import SOFTWARE_DIR, ASSEMBLER_DIR, load_symbolic_assembler
+
+VM_EXAMPLES_DIR = SOFTWARE_DIR / '08_vm_part2' / 'examples'
+
+TIERS = {
+    "interpreter": lambda: CPU(idioms=False, fast_forward=False),
+    "idioms": lambda: CPU(fast_forward=False),
+    "jit": lambda: CPU(jit=True),
+}
+
+
+def load_programs():
+    """
+    Collect the benchmark programs.
+
+    Returns:
+        List of (name, binary_instructions) pairs, sorted by name
+    """
+    programs = []
+
+    assembler_class = load_symbolic_assembler()
+    with tempfile.TemporaryDirectory() as scratch:
+        for source in sorted(ASSEMBLER_DIR.glob('*.asm')):
+            with contextlib.redirect_stdout(io.StringIO()):
+                binary = assembler_class().assemble(str(source), str(Path(scratch) / 'out.hack'))
+            programs.append((f"06/{source.stem}", binary))
+
+    for binary_file in sorted(VM_EXAMPLES_DIR.glob('*/*.hack')):
+        binary = [line.strip() for line in binary_file.read_text().splitlines() if line.strip()]
+        programs.append((f"08/{binary_file.stem}", binary))
+
+    return programs
+
+
+def run_cycles(cpu, cycles):
+    """Run exactly `cycles` instructions, restarting the program when it stops"""
+    done = 0
+    while done < cycles:
+        _, executed = cpu.run(max_cycles=cycles - done)
+        done += executed
+        if executed == 0:
+            break  # Nothing runnable (e.g. a zero-size ROM)
+        if done < cycles:
+            cpu.reset()
+    return done
+
+
+def measure(make_cpu, binary, cycles, repeat=3):
+    """
+    Best-of-`repeat` instructions per second for one program and tier.
+
+    Program loading (including predecoding) is not timed.
+    """
+    best = 0.0
+    for _ in range(repeat):
+        cpu = make_cpu()
+        cpu.load_program(binary)
+        start = time.perf_counter()
+        executed = run_cycles(cpu, cycles)
+        elapsed = time.perf_counter() - start
+        if elapsed > 0:
+            best = max(best, executed / elapsed)
+    return best
+
+
+def geometric_mean(values):
+    values = [value for value in values if value > 0]
+    if not values:
+        return 0.0
+    return math.exp(sum(math.log(value) for value in values) / len(values))
+
+
+def run_benchmark(cycles=200_000, repeat=3, tiers=None, programs=None):
+    """
+    Measure every program in every tier.
+
+    Returns:
+        Dict with "cycles", "results" (program -> tier -> ips) and
+        "geomean" (tier -> ips)
+    """
+    tiers = tiers or list(TIERS)
+    programs = load_programs() if programs is None else programs
+
+    results = {}
+    for name, binary in programs:
+        results[name] = {tier: measure(TIERS[tier], binary, cycles, repeat) for tier in tiers}
+
+    geomean = {tier: geometric_mean([row[tier] for row in results.values()]) for tier in tiers}
+    return {"cycles": cycles, "results": results, "geomean": geomean}
+
+
+def show_report(report):
+    """Print a table of instructions per second"""
+    tiers = list(report["geomean"])
+    print(f"\nInstructions per second ({report['cycles']} cycles per program, best run)")
+    print(f"{'Program':<24}" + "".join(f" | {tier:>12}" for tier in tiers))
+    print("-" * 24 + "".join("-+-" + "-" * 12 for _ in tiers))
+    for name, row in report["results"].items():
+        print(f"{name:<24}" + "".join(f" | {row[tier]:12,.0f}" for tier in tiers))
+    print("-" * 24 + "".join("-+-" + "-" * 12 for _ in tiers))
+    print(f"{'geometric mean':<24}" + "".join(f" | {report['geomean'][tier]:12,.0f}" for tier in tiers))
+
+
+def compare_to_baseline(report, baseline, tolerance):
+    """
+    Find tiers whose geometric mean fell more than tolerance below baseline.
+
+    Returns:
+        List of (tier, baseline_ips, current_ips) regressions
+    """
+    regressions = []
+    for tier, current in report["geomean"].items():
+        previous = baseline.get("geomean", {}).get(tier)
+        if previous and current < previous * (1 - tolerance):
+            regressions.append((tier, previous, current))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the Hack CPU run loops")
+    parser.add_argument("--cycles", type=int, default=200_000, help="instructions per program")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per measurement (best is kept)")
+    parser.add_argument("--tier", action="append", choices=list(TIERS), help="only these tiers")
+    parser.add_argument("--json", metavar="FILE", help="save results as JSON")
+    parser.add_argument("--baseline", metavar="FILE", help="compare against saved results")
+    parser.add_argument("--tolerance", type=float, default=0.15,
+                        help="allowed slowdown against the baseline (default 0.15)")
+    args = parser.parse_args(argv)
+
+    report = run_benchmark(args.cycles, args.repeat, args.tier)
+    show_report(report)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nSaved results to {args.json}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare_to_baseline(report, baseline, args.tolerance)
+        for tier, previous, current in regressions:
+            print(f"REGRESSION {tier}: {current:,.0f} ips vs baseline {previous:,.0f} ips")
+        if regressions:
+            return 1
+        print(f"\nNo tier more than {args.tolerance:.0%} slower than {args.baseline}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
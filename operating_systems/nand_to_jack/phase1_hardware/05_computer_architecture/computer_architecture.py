@@ -7,8 +7,29 @@ Individual components are separated into their own modules for clarity:
 - alu.py: Arithmetic Logic Unit
 - ram.py: Random Access Memory
 - rom.py: Read-Only Memory
+- decoder.py: Instruction decoder (predecoded ROM entries)
+- idioms.py: Superinstructions for VM-translator sequences
 - cpu.py: Central Processing Unit
+- jit.py: Basic-block JIT used by CPU(jit=True)
+- devices.py: Memory-mapped Screen and Keyboard
+- terminal.py: Real-time terminal rendering of the screen
+- snapshot.py: CPU snapshots with page-granular restore
+- batch.py: Manifest-driven batch runner over a process pool
+- lockstep.py: One ROM over many RAM states in lockstep (needs NumPy)
+- symbols.py: Assembling .asm files with their labels/variables; label and VM function lookup
+- counting.py: Per-PC instruction and taken-jump counts from a counting run loop
+- profiler.py: Per-PC profiler with label/function reports and flamegraph stacks
+- debugger.py: Trap-based breakpoints, watchpoints and VM frame backtraces
+- replay.py: KBD record/replay with checkpoints, seeking and binary traces
+- image.py: Binary ROM images (mmap loading, symbols, sections) and .hack conversion
+- spinloops.py: Idle and counting loop detection; the interpreter skips their iterations
+- intrinsics.py: Math/Memory OS routines run in Python at their ROM labels
+- stats.py: Instruction mix (comp/dest/jump), M traffic and taken-branch statistics
+- pipeline.py: Pipelined timing model (CPI, data/address/memory/branch stalls per address)
+- predictors.py: BTFN/bimodal/gshare/tournament predictors with BTB and return stack, scored during run()
+- reports.py: Per-address counter arrays and JSON export shared by stats, pipeline and predictors
 - assembler.py: Assembly language assembler
+- benchmark.py: Instructions-per-second benchmark of the run loops
 
 Usage:
     from computer_architecture import CPU, Assembler
@@ -0,0 +1,118 @@
+"""
+Counting - Per-PC execution counts from a CPU's own run loop
+
+ExecutionCounter drives a CPU through a run loop of its own, so CPU.run
+keeps its speed and nothing is counted unless a counter is used. Each
+step does one increment into a flat array('Q') indexed by ROM address,
+plus one per taken jump. Plain entries run through CPU.execute, exactly
+as CPU.step runs them. A superinstruction (see idioms.py) is counted
+once, at its start, and spread over the instructions it stands for when
+counts are read; its only jump is its last instruction. A jump counts
+as taken when execution continues anywhere but the next address.
+
+Profiler and InstructionStats extend it. A subclass that follows
+control flow sets jumped to a function(next_pc, target, cycle), called
+after each taken jump with the address it would have fallen through to
+and the cycles run so far.
+"""
+
+from array import array
+
+from decoder import SUPERINSTRUCTION
+from reports import zeros
+
+
+class ExecutionCounter:
+    """
+    Counts instructions and taken jumps per ROM address while running a CPU.
+
+    Attributes:
+        counts: array('Q'), plain instructions executed at each address
+        sequence_counts: array('Q'), superinstructions entered at each address
+        taken: array('Q'), jumps taken at each address
+        cycles: Total cycles counted
+        jumped: None, or function(next_pc, target, cycle) called per taken jump
+    """
+
+    def __init__(self, cpu):
+        self.cpu = cpu
+        self.jumped = None
+        self.reset()
+
+    def reset(self):
+        """Clear all counts"""
+        size = self.cpu.rom.size
+        self.counts = zeros(size)
+        self.sequence_counts = zeros(size)
+        self.taken = zeros(size)
+        self.cycles = 0
+
+    def run(self, max_cycles=1000):
+        """
+        Run the CPU while counting (same contract as CPU.run, including
+        superinstructions and check hooks).
+
+        Returns:
+            Tuple (halted, cycles_executed)
+        """
+        cpu = self.cpu
+        cpu.ensure_decoded()
+        fused, code = cpu.fused_code, cpu.code
+        memory = cpu.ram.memory
+        execute = cpu.execute
+        counts, sequence_counts, taken = self.counts, self.sequence_counts, self.taken
+        jumped = self.jumped
+        rom_size = cpu.rom.size
+        interval = max(1, cpu.check_interval)
+        next_check = interval
+        start_cycles = cpu.cycles
+
+        cycle = 0
+        halted = False
+        try:
+            while cycle < max_cycles:
+                pc = cpu.PC
+                if pc >= rom_size:
+                    break
+                if cycle >= next_check:
+                    next_check = cycle + interval
+                    if cpu.check_hooks:
+                        cpu.cycles = start_cycles + cycle
+                        if cpu.run_check_hooks():
+                            break
+                        continue
+
+                entry = fused[pc]
+                if entry[0] == SUPERINSTRUCTION and cycle + entry[2] <= max_cycles:
+                    cpu.A, cpu.D, cpu.PC = entry[1](cpu.A, cpu.D, memory)
+                    length = entry[2]
+                    sequence_counts[pc] += 1
+                else:
+                    # Plain entry (a sequence without the budget for it, a loop head or an intrinsic)
+                    length = 1
+                    counts[pc] += 1
+                    if not execute(code[pc]):
+                        cycle += 1
+                        halted = True  # HALT
+                        break
+
+                cycle += length
+                target = cpu.PC
+                if target != pc + length:
+                    taken[pc + length - 1] += 1
+                    if jumped is not None:
+                        jumped(pc + length, target, cycle)
+        finally:
+            cpu.cycles = start_cycles + cycle
+            self.cycles += cycle
+        return (halted, cycle)
+
+    def instruction_counts(self):
+        """Executions per ROM address, superinstructions spread over their instructions"""
+        result = array('Q', self.counts)
+        fused = self.cpu.fused_code
+        for pc, entered in enumerate(self.sequence_counts):
+            if entered:
+                for address in range(pc, pc + fused[pc][2]):
+                    result[address] += entered
+        return result
@@ -3,8 +3,14 @@ CPU (Central Processing Unit) - The brain of the computer
 """
 
 from alu import ALU
+from decoder import (decode, A_INSTRUCTION, C_INSTRUCTION, HALT, SUPERINSTRUCTION, LOOP, INTRINSIC,
+                     END_OF_ROM_ENTRY, JUMP_PREDICATES)
+from idioms import fuse
 from ram import RAM
 from rom import ROM
+from jit import JIT
+from snapshot import Snapshot
+from spinloops import SpinLoops
 
 
 class CPU:
@@ -19,15 +25,56 @@ class CPU:
     - ALU for arithmetic and logic operations
     - RAM for data storage
     - ROM for instruction storage
+
+    ROM words are decoded once into predecoded entries (see decoder.py)
+    and the run loop dispatches straight from them. The entries are
+    rebuilt whenever the ROM's version changes, so reloading ROM through
+    either the CPU or the ROM object is always picked up.
+
+    With idioms=True (the default), run() also executes the instruction
+    sequences emitted by the VM translator as single superinstructions
+    (see idioms.py). With jit=True, run() executes compiled basic blocks
+    instead (see jit.py). step() always interprets one instruction.
+
+    With fast_forward=True (the default), the interpreter collapses idle
+    and counting loops, applying many iterations at once with exactly
+    their effect (see spinloops.py). With stop_when_idle set, run()
+    stops as if halted when it reaches a loop that can never exit or
+    change anything.
+
+    use_intrinsics() makes the interpreter run registered VM functions
+    (Math.multiply, Memory.alloc, ...) in Python instead of their ROM
+    code (see intrinsics.py). use_branch_predictor() scores branch
+    predictors on the jumps run() executes (see predictors.py).
+
+    With extended_isa=True, comp encodings the Hack ALU leaves unused
+    multiply and shift D by A or M (D*A, D<<M, ...; see alu.py). The
+    assemblers accept them with extended=True.
+
+    run() keeps A, D, PC and memory in locals and only writes them back
+    every check_interval cycles, when it also calls the check hooks
+    (see add_check_hook).
+
+    Devices (see devices.py) are mapped with map_device(). Accesses below
+    read_limit/write_limit index RAM directly; the rest go through
+    load()/store(), which dispatch to devices and handle addresses
+    past the end of RAM.
     """
 
-    def __init__(self, rom_size=32768, ram_size=32768):
+    DEFAULT_CHECK_INTERVAL = 4096
+
+    def __init__(self, rom_size=32768, ram_size=32768, jit=False, idioms=True, fast_forward=True,
+                 extended_isa=False):
         """
         Initialize CPU with specified memory sizes.
 
         Args:
             rom_size: Size of ROM (instruction memory)
             ram_size: Size of RAM (data memory)
+            jit: Run through the basic-block JIT
+            idioms: Fuse VM-translator sequences into superinstructions
+            fast_forward: Collapse idle and counting loops
+            extended_isa: Decode the multiply and shift comps (see alu.py)
         """
         # Registers
         self.A = 0          # Address register
@@ -37,7 +84,42 @@ class CPU:
         # Components
         self.ram = RAM(ram_size)
         self.rom = ROM(rom_size)
-        self.alu = ALU()
+        self.extended_isa = extended_isa
+        self.alu = ALU(extended_isa)
+
+        # Predecoded ROM (one entry per word) and the ROM version it matches
+        self.code = []
+        self.code_version = -1
+
+        # Same entries with superinstructions where idioms start
+        self.use_idioms = idioms
+        self.fused_code = []
+        self.idiom_counts = {}
+
+        self.jit = JIT(self) if jit else None
+
+        # Loop heads in fused_code that run() may fast-forward
+        self.spin_loops = SpinLoops(self) if fast_forward else None
+        self.stop_when_idle = False
+
+        # VM functions run in Python (see use_intrinsics)
+        self.intrinsics = None
+
+        # Observes the jumps run() executes (see use_branch_predictor)
+        self.branch_predictor = None
+
+        # Called from run() every check_interval cycles
+        self.check_interval = self.DEFAULT_CHECK_INTERVAL
+        self.check_hooks = []
+
+        # Total cycles executed since reset (updated at check points)
+        self.cycles = 0
+
+        # Memory-mapped devices and the fast-path address limits they imply
+        self.devices = []
+        self.read_limit = ram_size
+        self.write_limit = ram_size
+        self.memory_map_version = 0
 
     def load_program(self, binary_instructions):
         """
@@ -47,6 +129,115 @@ class CPU:
             binary_instructions: List of 16-bit binary instruction strings
         """
         self.rom.load_program(binary_instructions)
+        self.predecode()
+
+    def load_program_binary(self, instructions):
+        """
+        Load program into ROM from 16-bit integers or a buffer of
+        little-endian words (see ROM.load_program_binary and image.py).
+        """
+        self.rom.load_program_binary(instructions)
+        self.predecode()
+
+    def predecode(self):
+        """Decode every ROM word into an entry (see decoder.decode)"""
+        self.code = [decode(word, self.extended_isa) for word in self.rom.memory]
+        self.code_version = self.rom.version
+        if self.use_idioms:
+            self.fused_code, self.idiom_counts = fuse(self.code, self.rom.memory, self.ram.size,
+                                                      self.read_limit, self.write_limit,
+                                                      self.load, self.store)
+        else:
+            self.fused_code, self.idiom_counts = list(self.code), {}
+        if self.spin_loops is not None and self.branch_predictor is None:
+            self.spin_loops.install(self.code, self.fused_code)
+        if self.intrinsics is not None:
+            self.intrinsics.install(self.code, self.fused_code)
+        if self.branch_predictor is not None:
+            self.branch_predictor.install(self.code, self.fused_code)
+        # Running off the end of ROM hits the sentinel instead of an index check
+        self.fused_code.append(END_OF_ROM_ENTRY)
+
+    def use_intrinsics(self, intrinsics):
+        """
+        Run the functions registered in intrinsics (an
+        intrinsics.Intrinsics, or None to stop) instead of their ROM code.
+        """
+        self.intrinsics = intrinsics
+        self.code_version = -1  # Entries are placed when ROM is next decoded
+
+    def use_branch_predictor(self, predictor):
+        """
+        Report every jump run() executes to predictor (a
+        predictors.BranchPredictor, or None to stop). Loops are not
+        fast-forwarded while one is attached.
+        """
+        if predictor is not None and self.jit is not None:
+            raise ValueError("The JIT does not report jumps: attach predictors to an interpreting CPU")
+        self.branch_predictor = predictor
+        self.code_version = -1
+
+    def map_device(self, device):
+        """
+        Map a memory-mapped device into the data address space.
+
+        The device needs `base` and `size` attributes, READS/WRITES flags,
+        read(address) / write(address, value, old) methods for the
+        accesses it intercepts and reset(); writing devices also need
+        invalidate(start, end) for RAM changed behind their back
+        (see devices.py).
+        """
+        self.devices.append(device)
+        self.read_limit = min([self.ram.size] + [d.base for d in self.devices if d.READS])
+        self.write_limit = min([self.ram.size] + [d.base for d in self.devices if d.WRITES])
+        self.memory_map_version += 1
+        if self.code_version != -1:
+            self.predecode()  # Superinstructions bake in the limits
+
+    def load(self, address):
+        """Slow-path read: devices first, then RAM, 0 past the end of RAM"""
+        for device in self.devices:
+            if device.READS and device.base <= address < device.base + device.size:
+                return device.read(address)
+        return self.ram.memory[address] if address < self.ram.size else 0
+
+    def store(self, address, value):
+        """Slow-path write: RAM (if in range), then any device watching address"""
+        old = 0
+        if address < self.ram.size:
+            old = self.ram.memory[address]
+            self.ram.memory[address] = value
+        for device in self.devices:
+            if device.WRITES and device.base <= address < device.base + device.size:
+                if value != old:
+                    device.write(address, value, old)
+
+    def add_check_hook(self, hook):
+        """
+        Call hook(cpu) from run() every check_interval cycles.
+
+        Registers are written back to the CPU before hooks run, so a hook
+        sees (and may change) the exact machine state. A hook returning
+        True stops run() early (halted=False).
+        """
+        self.check_hooks.append(hook)
+
+    def remove_check_hook(self, hook):
+        """Stop calling a hook added with add_check_hook"""
+        self.check_hooks.remove(hook)
+
+    def run_check_hooks(self):
+        """Call every check hook; True if one of them asked to stop"""
+        stop = False
+        for hook in self.check_hooks:
+            if hook(self):
+                stop = True
+        return stop
+
+    def ensure_decoded(self):
+        """Re-decode if ROM changed since the entries were built"""
+        if self.code_version != self.rom.version:
+            self.predecode()
 
     def fetch(self):
         """
@@ -70,9 +261,7 @@ class CPU:
         Args:
             instruction: 16-bit instruction word
         """
-        value = instruction & 0x7FFF  # Bottom 15 bits
-        self.A = value
-        self.PC += 1
+        self.execute(decode(instruction, self.extended_isa))
 
     def execute_c_instruction(self, instruction):
         """
@@ -88,29 +277,54 @@ class CPU:
         Args:
             instruction: 16-bit instruction word
         """
-        # Decode instruction bits
-        a_bit = (instruction >> 12) & 1 # 000000000000111a & 0000000000000001 = a (0 or 1)
-        comp_bits = (instruction >> 6) & 0x3F # 000000111acccccc & 0000000000111111 = cccccc
-        dest_bits = (instruction >> 3) & 0x7 # 000111accccccddd & 0000000000000111 = ddd
-        jump_bits = instruction & 0x7 # 111accccccdddjjj & 0000000000000111 = jjj
+        self.execute(decode(instruction, self.extended_isa))
+
+    def execute(self, entry):
+        """
+        Execute one predecoded entry.
+
+        Args:
+            entry: Tuple (kind, arg, use_m, dest, jump) from decoder.decode
+
+        Returns:
+            True if execution should continue, False if HALT encountered
+        """
+        kind, operation, use_m, dest, jump = entry
+
+        if kind == A_INSTRUCTION:
+            self.A = operation  # A-instruction value
+            self.PC += 1
+            return True
+        if kind == HALT:
+            return False
 
-        # Compute using ALU
-        y = self.ram[self.A] if a_bit else self.A
-        result = self.alu.compute(comp_bits, self.D, y)
+        # Compute using ALU. RAM's array is indexed directly: the address
+        # is checked once here instead of inside RAM.read/RAM.write.
+        memory = self.ram.memory
+        if use_m:
+            address = self.A
+            y = memory[address] if address < self.read_limit else self.load(address)
+        else:
+            y = self.A
+        result = operation(self.D, y)
 
         # Store result in destinations
-        if dest_bits & 0x4:  # A bit set (ddd & 100 = 100)
+        if dest & 0x4:  # A bit set (ddd & 100 = 100)
             self.A = result
-        if dest_bits & 0x2:  # D bit set (ddd & 010 = 010)
+        if dest & 0x2:  # D bit set (ddd & 010 = 010)
             self.D = result
-        if dest_bits & 0x1:  # M bit set (ddd & 001 = 001)
-            self.ram[self.A] = result
+        if dest & 0x1:  # M bit set (ddd & 001 = 001)
+            if self.A < self.write_limit:
+                memory[self.A] = result
+            else:
+                self.store(self.A, result)
 
         # Handle jump
-        if self.should_jump(jump_bits, result):
+        if jump is not None and jump(result):
             self.PC = self.A
         else:
             self.PC += 1
+        return True
 
     def should_jump(self, jump_bits, value):
         """
@@ -133,25 +347,8 @@ class CPU:
         Returns:
             True if should jump, False otherwise
         """
-        if jump_bits == 0:  # No jump
-            return False
-        if jump_bits == 0b111:  # Unconditional
-            return True
-
-        # Check conditions
-        is_negative = (value & 0x8000) != 0 # If MSB=1, the number is negative (i.e., 0b1111111111110101 = -(0b1010 + 1) = -0b1011 = -11 in decimal)
-        is_zero = value == 0
-        is_positive = not is_negative and not is_zero
-
-        conditions = {
-            0b001: is_positive,  # JGT
-            0b010: is_zero,      # JEQ
-            0b011: not is_negative,  # JGE
-            0b100: is_negative,  # JLT
-            0b101: not is_zero,  # JNE
-            0b110: is_negative or is_zero,  # JLE
-        }
-        return conditions.get(jump_bits, False)
+        predicate = JUMP_PREDICATES[jump_bits]
+        return predicate is not None and predicate(value & 0xFFFF)
 
     def step(self):
         """
@@ -160,18 +357,11 @@ class CPU:
         Returns:
             True if execution should continue, False if HALT encountered
         """
-        instruction = self.fetch()
-
-        # Check for HALT instruction (all 1s: 0xFFFF)
-        if instruction == 0xFFFF:
-            return False  # Signal to stop execution
-
-        if instruction & 0x8000:  # C-instruction (bit 15 = 1)
-            self.execute_c_instruction(instruction)
-        else:  # A-instruction (bit 15 = 0)
-            self.execute_a_instruction(instruction)
-
-        return True  # Continue execution
+        self.ensure_decoded()
+        self.cycles += 1
+        if self.PC < len(self.code):
+            return self.execute(self.code[self.PC])
+        return self.execute(decode(self.fetch(), self.extended_isa))
 
     def run(self, max_cycles=1000):
         """
@@ -193,19 +383,122 @@ class CPU:
             - halted: True if HALT was encountered, False if stopped by other means
             - cycles_executed: Number of instruction cycles executed
         """
-        for cycle in range(max_cycles):
-            if self.PC >= self.rom.size:
-                return (False, cycle)  # Stopped: PC beyond ROM
-
-            continue_execution = self.step()
-            if not continue_execution:
-                return (True, cycle + 1)  # Stopped: HALT instruction
+        if self.jit is not None:
+            return self.jit.run(max_cycles)
+
+        self.ensure_decoded()
+        code = self.code
+        fused = self.fused_code
+        memory = self.ram.memory
+        read_limit = self.read_limit
+        write_limit = self.write_limit
+        load = self.load
+        store = self.store
+        rom_size = self.rom.size
+        interval = max(1, self.check_interval)
+        start_cycles = self.cycles
+
+        A, D, pc = self.A, self.D, self.PC
+        cycle = 0
+        halted = False
+        stopped = pc >= rom_size  # Stopped: PC beyond ROM
+        try:
+            while cycle < max_cycles and not stopped:
+                limit = min(max_cycles, cycle + interval)
+                while cycle < limit:
+                    entry = fused[pc]
+                    kind = entry[0]
+                    if kind == SUPERINSTRUCTION:
+                        if cycle + entry[2] <= max_cycles:
+                            A, D, pc = entry[1](A, D, memory)
+                            cycle += entry[2]
+                            if pc >= rom_size:
+                                stopped = True  # Stopped: PC beyond ROM
+                                break
+                            continue
+                        entry = code[pc]  # Not enough budget left for the whole sequence
+                        kind = entry[0]
+
+                    if kind == C_INSTRUCTION:
+                        _, operation, use_m, dest, jump = entry
+                        if use_m:
+                            result = operation(D, memory[A] if A < read_limit else load(A))
+                        else:
+                            result = operation(D, A)
+                        if dest & 0x4:
+                            A = result
+                        if dest & 0x2:
+                            D = result
+                        if dest & 0x1:
+                            if A < write_limit:
+                                memory[A] = result
+                            else:
+                                store(A, result)
+                        cycle += 1
+                        if jump is not None and jump(result):
+                            pc = A
+                            if pc >= rom_size:
+                                stopped = True  # Stopped: PC beyond ROM
+                                break
+                        else:
+                            pc += 1
+                    elif kind == A_INSTRUCTION:
+                        A = entry[1]
+                        pc += 1
+                        cycle += 1
+                    elif kind == HALT:
+                        cycle += 1
+                        halted = stopped = True  # Stopped: HALT instruction
+                        break
+                    elif kind == LOOP:
+                        budget = (limit if self.check_hooks else max_cycles) - cycle
+                        A, D, pc, executed, idle = entry[1](pc, A, D, budget)
+                        cycle += executed
+                        if idle or pc >= rom_size:
+                            halted = idle  # Stopped: idle loop (stop_when_idle) or PC beyond ROM
+                            stopped = True
+                            break
+                    elif kind == INTRINSIC:
+                        A, D, pc, executed = entry[1](pc, A, D, max_cycles - cycle)
+                        cycle += executed
+                        if pc >= rom_size:
+                            stopped = True  # Stopped: PC beyond ROM
+                            break
+                    else:
+                        stopped = True  # Stopped: ran off the end of ROM, or a debugger trap
+                        break
+
+                if self.check_hooks and not stopped:
+                    self.A, self.D, self.PC = A, D, pc
+                    self.cycles = start_cycles + cycle
+                    stopped = self.run_check_hooks()
+                    A, D, pc = self.A, self.D, self.PC
+                    stopped = stopped or pc >= rom_size
+        finally:
+            self.A, self.D, self.PC = A, D, pc
+            self.cycles = start_cycles + cycle
+
+        return (halted, cycle)
+
+    def snapshot(self):
+        """Capture registers, cycle count, RAM and ROM (see snapshot.py)"""
+        return Snapshot.capture(self)
+
+    def restore(self, snapshot):
+        """
+        Return to a snapshot, copying only the RAM pages that changed.
 
-        return (False, max_cycles)  # Stopped: max cycles reached
+        Returns:
+            Number of RAM pages copied
+        """
+        return snapshot.restore(self)
 
     def reset(self):
         """Reset CPU to initial state."""
         self.A = 0
         self.D = 0
         self.PC = 0
+        self.cycles = 0
         self.ram.reset()
+        for device in self.devices:
+            device.reset()
@@ -0,0 +1,281 @@
+"""
+Debugger - Breakpoints, watchpoints and VM-aware stepping
+
+The debugger never slows down CPU.run itself. How it runs depends on
+what is set:
+- nothing:          cont() is a plain CPU.run
+- PC breakpoints:   the fused entry at each breakpoint is replaced by a
+                    TRAP entry (see decoder.py) for the duration of the
+                    run; the run loop stops on it like on the end of ROM.
+                    Superinstructions and fast-forwarded loops that
+                    span a breakpoint are unfused. Conditional
+                    breakpoints use the same traps and evaluate their
+                    condition only when hit.
+- watchpoints:      a separate instrumented loop checks every RAM access
+(or a JIT CPU)      made by each instruction
+
+Stops are reported after the watched access (the instruction has run)
+and before the instruction at a breakpoint (it has not).
+
+VM calling convention (08_vm_part2): SP = RAM[0], LCL = RAM[1],
+ARG = RAM[2], THIS = RAM[3], THAT = RAM[4]. A frame saves the return
+address, LCL, ARG, THIS and THAT at LCL-5 .. LCL-1, which is what
+frames() walks and run_to_return() uses: the current function has
+returned when PC reaches its return address with SP = ARG + 1.
+
+Usage:
+    debugger = Debugger(cpu, labels)      # labels from symbols.assemble_with_labels
+    debugger.break_at("Math.multiply")
+    debugger.watch(16, mode="w")
+    stop = debugger.cont()
+    print(stop, debugger.frames())
+    debugger.run_to_return()
+"""
+
+from decoder import C_INSTRUCTION, SUPERINSTRUCTION, LOOP, TRAP_ENTRY
+from symbols import LabelIndex
+
+SP, LCL, ARG, THIS, THAT = 0, 1, 2, 3, 4
+
+# Longest idiom (see idioms.IDIOMS) or loop (spinloops.MAX_BODY);
+# breakpoints this far after the start of one are inside it
+MAX_SEQUENCE = 128
+
+
+class Stop:
+    """Why and where execution stopped"""
+
+    def __init__(self, reason, pc, cycles, address=None, old=None, new=None):
+        self.reason = reason      # breakpoint, read, write, step, return, halt, end, budget, hook
+        self.pc = pc
+        self.cycles = cycles      # Cycles executed by the command
+        self.address = address    # Watched RAM address (read/write)
+        self.old = old
+        self.new = new
+
+    def __repr__(self):
+        detail = f" RAM[{self.address}] {self.old} -> {self.new}" if self.reason == "write" else \
+                 f" RAM[{self.address}] = {self.new}" if self.reason == "read" else ""
+        return f"Stop({self.reason} at PC {self.pc} after {self.cycles} cycles{detail})"
+
+
+class Debugger:
+    """
+    Breakpoints, watchpoints and stepping for a CPU.
+
+    Locations can be ROM addresses or label names; watched addresses can
+    be RAM addresses or the VM register names SP, LCL, ARG, THIS, THAT.
+    """
+
+    REGISTERS = {"SP": SP, "LCL": LCL, "ARG": ARG, "THIS": THIS, "THAT": THAT}
+
+    def __init__(self, cpu, labels=None):
+        self.cpu = cpu
+        self.index = LabelIndex(labels or {})
+        self.breakpoints = {}     # PC -> condition(cpu) or None
+        self.watchpoints = {}     # RAM address -> (mode, condition(cpu) or None)
+        self.values = {}          # Watched address -> last value seen
+
+    # ===== Setting breakpoints and watchpoints =====
+
+    def _pc(self, location):
+        return self.index.labels[location] if isinstance(location, str) else location
+
+    def break_at(self, location, condition=None):
+        """Stop before executing location (if condition(cpu) is true)"""
+        self.breakpoints[self._pc(location)] = condition
+
+    def clear(self, location):
+        self.breakpoints.pop(self._pc(location), None)
+
+    def watch(self, address, mode="w", condition=None):
+        """
+        Stop after an instruction reads and/or writes RAM[address].
+
+        Args:
+            address: RAM address or register name ("SP", "LCL", ...)
+            mode: "r", "w" or "rw"
+            condition: Optional condition(cpu) checked at the access
+        """
+        address = self.REGISTERS.get(address, address)
+        self.watchpoints[address] = (mode, condition)
+        self.values[address] = self.cpu.ram.read(address)
+
+    def unwatch(self, address):
+        address = self.REGISTERS.get(address, address)
+        self.watchpoints.pop(address, None)
+        self.values.pop(address, None)
+
+    # ===== Commands =====
+
+    def step(self, count=1):
+        """Execute count instructions (breakpoints are ignored)"""
+        cpu = self.cpu
+        for done in range(count):
+            if cpu.PC >= cpu.rom.size:
+                return Stop("end", cpu.PC, done)
+            if not cpu.step():
+                return Stop("halt", cpu.PC, done + 1)
+        return Stop("step", cpu.PC, count)
+
+    def cont(self, max_cycles=10_000_000):
+        """Run until a breakpoint, a watchpoint, HALT or max_cycles"""
+        if self.watchpoints or self.cpu.jit is not None:
+            return self._run_instrumented(max_cycles)
+        if self.breakpoints:
+            return self._run_trapped(max_cycles)
+        halted, cycles = self.cpu.run(max_cycles=max_cycles)
+        return self._finish(halted, cycles, max_cycles)
+
+    def run_to_return(self, max_cycles=10_000_000):
+        """Run until the current VM function returns to its caller"""
+        memory = self.cpu.ram.memory
+        frame = memory[LCL]
+        if frame < 5:
+            raise ValueError("Not inside a VM function (LCL < 5)")
+        return_address = memory[frame - 5]
+        caller_sp = (memory[ARG] + 1) & 0xFFFF
+
+        saved = self.breakpoints.get(return_address, False)
+        self.breakpoints[return_address] = lambda cpu: cpu.ram.memory[SP] == caller_sp
+        try:
+            stop = self.cont(max_cycles)
+        finally:
+            if saved is False:
+                del self.breakpoints[return_address]
+            else:
+                self.breakpoints[return_address] = saved
+        if stop.reason == "breakpoint" and stop.pc == return_address and \
+                self.cpu.ram.memory[SP] == caller_sp:
+            stop.reason = "return"
+        return stop
+
+    # ===== Inspection =====
+
+    def frames(self):
+        """
+        Backtrace of VM frames, innermost first.
+
+        Returns:
+            List of dicts: function, pc (current PC, then return
+            addresses), the frame's LCL/ARG/THIS/THAT and its arguments
+        """
+        memory = self.cpu.ram.memory
+        size = len(memory)
+        pc = self.cpu.PC
+        lcl, arg, this, that = memory[LCL], memory[ARG], memory[THIS], memory[THAT]
+        frames = []
+        while len(frames) < 1000:
+            frame = {"function": self.index.function_of(pc), "pc": pc,
+                     "LCL": lcl, "ARG": arg, "THIS": this, "THAT": that,
+                     "arguments": list(memory[arg:lcl - 5]) if 0 < arg <= lcl - 5 < size else []}
+            frames.append(frame)
+            if not 5 <= lcl < size:
+                break
+            caller = memory[lcl - 4]
+            if not 5 <= caller < lcl:
+                break  # Bootstrap code (LCL = 0), or not a frame: callers' frames are lower in RAM
+            pc = memory[lcl - 5]
+            lcl, arg, this, that = caller, memory[lcl - 3], memory[lcl - 2], memory[lcl - 1]
+        return frames
+
+    # ===== Run loops =====
+
+    def _finish(self, halted, cycles, max_cycles, reason=None):
+        cpu = self.cpu
+        if halted:
+            reason = "halt"
+        elif reason is None:
+            reason = "end" if cpu.PC >= cpu.rom.size else "budget" if cycles >= max_cycles else "hook"
+        return Stop(reason, cpu.PC, cycles)
+
+    def _patch(self):
+        """Place traps over the fused entries at breakpoints; returns the originals"""
+        cpu = self.cpu
+        cpu.ensure_decoded()
+        fused, code = cpu.fused_code, cpu.code
+        originals = {}
+        for pc in self.breakpoints:
+            if pc >= cpu.rom.size:
+                continue
+            for start in range(max(0, pc - MAX_SEQUENCE), pc + 1):
+                entry = fused[start]
+                if entry[0] in (SUPERINSTRUCTION, LOOP) and start < pc < start + entry[2]:
+                    originals.setdefault(start, entry)
+                    fused[start] = code[start]
+            originals.setdefault(pc, fused[pc])
+            fused[pc] = TRAP_ENTRY
+        return originals
+
+    def _run_trapped(self, max_cycles):
+        """CPU.run with traps at the breakpoints"""
+        cpu = self.cpu
+        cycles = 0
+        fused = None
+        originals = {}
+        try:
+            while cycles < max_cycles:
+                pc = cpu.PC
+                if pc in self.breakpoints and pc < cpu.rom.size:
+                    # Leave the breakpoint we are standing on (or whose condition is false)
+                    if not cpu.step():
+                        return Stop("halt", cpu.PC, cycles + 1)
+                    cycles += 1
+                    continue
+                if fused is not cpu.fused_code:
+                    originals = self._patch()
+                    fused = cpu.fused_code
+                halted, executed = cpu.run(max_cycles=max_cycles - cycles)
+                cycles += executed
+                pc = cpu.PC
+                if halted or pc not in self.breakpoints or cycles >= max_cycles:
+                    return self._finish(halted, cycles, max_cycles)
+                condition = self.breakpoints[pc]
+                if condition is None or condition(cpu):
+                    return Stop("breakpoint", pc, cycles)
+            return self._finish(False, cycles, max_cycles)
+        finally:
+            if fused is cpu.fused_code:
+                for pc, entry in originals.items():
+                    fused[pc] = entry
+
+    def _run_instrumented(self, max_cycles):
+        """Interpret one instruction at a time, checking every RAM access"""
+        cpu = self.cpu
+        cpu.ensure_decoded()
+        code = cpu.code
+        memory = cpu.ram.memory
+        ram_size = cpu.ram.size
+        rom_size = cpu.rom.size
+        breakpoints, watchpoints, values = self.breakpoints, self.watchpoints, self.values
+
+        for cycles in range(max_cycles):
+            pc = cpu.PC
+            if pc >= rom_size:
+                return Stop("end", pc, cycles)
+            if cycles and pc in breakpoints:
+                condition = breakpoints[pc]
+                if condition is None or condition(cpu):
+                    return Stop("breakpoint", pc, cycles)
+
+            entry = code[pc]
+            kind, _, use_m, dest, _ = entry
+            read = cpu.A if kind == C_INSTRUCTION and use_m else None
+            cpu.cycles += 1
+            if not cpu.execute(entry):
+                return Stop("halt", pc, cycles + 1)
+
+            if read in watchpoints:
+                mode, condition = watchpoints[read]
+                if "r" in mode and (condition is None or condition(cpu)):
+                    value = memory[read] if read < ram_size else 0
+                    return Stop("read", cpu.PC, cycles + 1, read, value, value)
+            if kind == C_INSTRUCTION and dest & 0x1:
+                written = cpu.A
+                if written in watchpoints:
+                    mode, condition = watchpoints[written]
+                    old = values[written]
+                    new = values[written] = memory[written] if written < ram_size else 0
+                    if "w" in mode and (condition is None or condition(cpu)):
+                        return Stop("write", cpu.PC, cycles + 1, written, old, new)
+        return Stop("budget", cpu.PC, max_cycles)
@@ -0,0 +1,84 @@
+"""
+Decoder - Turns 16-bit instruction words into predecoded entries
+
+Decoding a C-instruction means extracting the a-bit, comp, dest and jump
+fields and looking up the ALU operation. The CPU does this once per ROM
+word when a program is loaded instead of on every execution.
+
+Entry layout (a plain tuple, so the run loop can unpack it directly):
+
+    (kind, arg, use_m, dest, jump)
+
+    kind   A_INSTRUCTION, C_INSTRUCTION or HALT
+    arg    A-instruction: the 15-bit value
+           C-instruction: ALU function f(d, y) -> unsigned 16-bit result
+    use_m  True if the y operand is RAM[A] (a-bit set), False for A
+    dest   3-bit destination mask: 4 = A, 2 = D, 1 = M
+    jump   None (no jump) or predicate f(result) -> bool
+"""
+
+from functools import lru_cache
+
+from alu import OPERATIONS, ALL_OPERATIONS
+
+A_INSTRUCTION = 0
+C_INSTRUCTION = 1
+HALT = 2
+SUPERINSTRUCTION = 3  # Fused sequences, see idioms.py
+END_OF_ROM = 4        # Sentinel the run loop places after the last ROM word
+TRAP = 5              # Debugger breakpoint patched over a fused entry, see debugger.py
+LOOP = 6              # Loop head that can be fast-forwarded, see spinloops.py
+INTRINSIC = 7         # VM function run in Python, see intrinsics.py
+
+HALT_WORD = 0xFFFF
+
+END_OF_ROM_ENTRY = (END_OF_ROM, None, False, 0, None)
+TRAP_ENTRY = (TRAP, None, False, 0, None)
+
+# Jump predicates on the unsigned 16-bit ALU output, indexed by jump bits
+JUMP_PREDICATES = (
+    None,                                       # 000: no jump
+    lambda v: 0 < v < 0x8000,                   # 001: JGT
+    lambda v: v == 0,                           # 010: JEQ
+    lambda v: v < 0x8000,                       # 011: JGE
+    lambda v: v >= 0x8000,                      # 100: JLT
+    lambda v: v != 0,                           # 101: JNE
+    lambda v: v == 0 or v >= 0x8000,            # 110: JLE
+    lambda v: True,                             # 111: JMP
+)
+
+
+def _unknown_operation(comp_bits):
+    """ALU function for an unused comp encoding; fails only if executed"""
+    def operation(d, a):
+        raise KeyError(comp_bits)
+    return operation
+
+
+@lru_cache(maxsize=None)
+def decode(instruction, extended=False):
+    """
+    Decode one instruction word.
+
+    Results are memoized per word, so decoding a 32K ROM costs one
+    dictionary lookup for every repeated word (most of ROM is @0).
+
+    Args:
+        instruction: 16-bit instruction word
+        extended: Accept the extended ISA's comp encodings (see alu.py)
+
+    Returns:
+        Predecoded entry tuple (see module docstring)
+    """
+    if instruction == HALT_WORD:
+        return (HALT, None, False, 0, None)
+
+    if not instruction & 0x8000:
+        return (A_INSTRUCTION, instruction & 0x7FFF, False, 0, None)
+
+    use_m = bool((instruction >> 12) & 1)
+    comp_bits = (instruction >> 6) & 0x3F
+    dest = (instruction >> 3) & 0x7
+    jump = JUMP_PREDICATES[instruction & 0x7]
+    operation = (ALL_OPERATIONS if extended else OPERATIONS).get(comp_bits) or _unknown_operation(comp_bits)
+    return (C_INSTRUCTION, operation, use_m, dest, jump)
@@ -0,0 +1,262 @@
+"""
+Devices - Memory-mapped Screen and Keyboard for the Hack computer
+
+The Hack platform maps its I/O into the data address space:
+- SCREEN (16384-24575): 8K words, 256 rows x 32 words, 512 x 256 pixels.
+  Bit 0 of a word is its leftmost pixel; 1 is black.
+- KBD (24576): code of the key currently held down, 0 if none
+
+Devices are attached with CPU.map_device(). The CPU keeps ordinary RAM
+accesses on its fast path and only sends accesses at or above the lowest
+mapped device address through CPU.load/CPU.store, which call:
+- device.read(address) for devices with READS = True
+- device.write(address, value, old) for devices with WRITES = True
+  (after RAM has been updated, only when the word changed)
+
+Usage:
+    cpu = CPU()
+    screen, keyboard = attach_io(cpu)
+    keyboard.type_text("hi", start=0.0)
+    cpu.run(max_cycles=1_000_000)
+    delta = screen.render()        # rows/words changed since last frame
+    screen.save("frame.png")
+"""
+
+import heapq
+import struct
+import time
+import zlib
+
+SCREEN_BASE = 16384
+SCREEN_WIDTH = 512
+SCREEN_HEIGHT = 256
+WORDS_PER_ROW = SCREEN_WIDTH // 16
+SCREEN_WORDS = WORDS_PER_ROW * SCREEN_HEIGHT
+KBD_ADDRESS = 24576
+
+# Hack key codes for non-printable keys (printable characters use ASCII)
+KEY_CODES = {
+    "newline": 128, "backspace": 129,
+    "left": 130, "up": 131, "right": 132, "down": 133,
+    "home": 134, "end": 135, "page_up": 136, "page_down": 137,
+    "insert": 138, "delete": 139, "escape": 140,
+}
+KEY_CODES.update({f"f{n}": 140 + n for n in range(1, 13)})
+
+# Byte with its bit order reversed: Hack's leftmost pixel is bit 0,
+# PBM/PNG's leftmost pixel is the most significant bit
+REVERSED_BITS = bytes(int(f"{value:08b}"[::-1], 2) for value in range(256))
+
+
+def key_code(key):
+    """Hack key code for a character, a KEY_CODES name or an int"""
+    if isinstance(key, int):
+        return key
+    if len(key) == 1:
+        return 128 if key == "\n" else ord(key)
+    return KEY_CODES[key.lower()]
+
+
+class Screen:
+    """
+    Memory-mapped 512 x 256 monochrome screen with dirty tracking.
+
+    Pixels live in RAM (so programs can read them back); the screen
+    records which words were written and keeps a packed framebuffer
+    (one bit per pixel, PBM bit order) that render() brings up to date
+    by converting only those words.
+
+    Writes made behind the CPU's back (e.g. ram[16384] = 1 from Python)
+    are not seen; call invalidate() after them.
+    """
+
+    READS = False
+    WRITES = True
+
+    def __init__(self, ram, base=SCREEN_BASE):
+        self.ram = ram
+        self.base = base
+        self.size = SCREEN_WORDS
+        self.dirty = set()                          # Word offsets written since last render
+        self.framebuffer = bytearray(SCREEN_WORDS * 2)
+        self.frame = 0
+        self.words_written = 0
+
+    def write(self, address, value, old):
+        self.dirty.add(address - self.base)
+        self.words_written += 1
+
+    def invalidate(self, start=None, end=None):
+        """
+        Mark words dirty after RAM changed behind the CPU's back (direct
+        edits, a reset or a snapshot restore).
+
+        Args:
+            start, end: Address range [start, end) (default: the whole screen)
+        """
+        first = 0 if start is None else max(0, start - self.base)
+        last = self.size if end is None else min(self.size, end - self.base)
+        self.dirty.update(range(first, last))
+
+    def reset(self):
+        self.invalidate()
+
+    def render(self):
+        """
+        Bring the framebuffer up to date with RAM.
+
+        Returns:
+            Dict describing the frame-to-frame delta:
+            {"frame": n, "rows": sorted dirty rows, "words": number of
+            words converted}
+        """
+        memory = self.ram.memory
+        framebuffer = self.framebuffer
+        base = self.base
+        rows = set()
+        for offset in self.dirty:
+            value = memory[base + offset] if base + offset < len(memory) else 0
+            framebuffer[2 * offset] = REVERSED_BITS[value & 0xFF]
+            framebuffer[2 * offset + 1] = REVERSED_BITS[value >> 8]
+            rows.add(offset // WORDS_PER_ROW)
+        words = len(self.dirty)
+        self.dirty.clear()
+        self.frame += 1
+        return {"frame": self.frame, "rows": sorted(rows), "words": words}
+
+    def pixel(self, x, y):
+        """True if pixel (x, y) is black"""
+        word = self.ram.read(self.base + y * WORDS_PER_ROW + x // 16)
+        return bool((word >> (x % 16)) & 1)
+
+    def packed_bits(self):
+        """Current frame as 16384 bytes, one bit per pixel, MSB = leftmost"""
+        self.render()
+        return bytes(self.framebuffer)
+
+    def row_bits(self, row):
+        """Packed bytes of one pixel row (as of the last render)"""
+        start = row * WORDS_PER_ROW * 2
+        return bytes(self.framebuffer[start:start + WORDS_PER_ROW * 2])
+
+    def to_pbm(self):
+        """Current frame as a binary PBM (P4) image"""
+        return f"P4\n{SCREEN_WIDTH} {SCREEN_HEIGHT}\n".encode() + self.packed_bits()
+
+    def to_png(self):
+        """Current frame as a 1-bit grayscale PNG (standard library only)"""
+        bits = self.packed_bits()
+        stride = SCREEN_WIDTH // 8
+        # PNG grayscale: 1 is white, so invert; each row starts with filter type 0
+        raw = b"".join(
+            b"\x00" + bytes(byte ^ 0xFF for byte in bits[row * stride:(row + 1) * stride])
+            for row in range(SCREEN_HEIGHT)
+        )
+
+        def chunk(kind, data):
+            body = kind + data
+            return struct.pack(">I", len(data)) + body + struct.pack(">I", zlib.crc32(body))
+
+        header = struct.pack(">IIBBBBB", SCREEN_WIDTH, SCREEN_HEIGHT, 1, 0, 0, 0, 0)
+        return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header)
+                + chunk(b"IDAT", zlib.compress(raw)) + chunk(b"IEND", b""))
+
+    def save(self, path):
+        """Write the current frame as .png or .pbm (chosen by extension)"""
+        data = self.to_png() if str(path).lower().endswith(".png") else self.to_pbm()
+        with open(path, "wb") as f:
+            f.write(data)
+
+
+class Keyboard:
+    """
+    Memory-mapped keyboard fed from a time-stamped key queue.
+
+    Events are (time, key code) pairs; a code of 0 is a release. Reading
+    KBD applies every event whose time has come and returns the key held
+    down at that moment.
+
+    The clock is any zero-argument callable. The default is wall-clock
+    time (time.monotonic); for reproducible headless runs use a
+    simulated clock such as lambda: cpu.cycles.
+    """
+
+    READS = True
+    WRITES = False
+
+    def __init__(self, clock=time.monotonic, base=KBD_ADDRESS):
+        self.clock = clock
+        self.base = base
+        self.size = 1
+        self.queue = []       # Heap of (time, sequence, code)
+        self.sequence = 0     # Keeps events with equal times in order
+        self.current = 0
+        self.reads = 0
+
+    def push(self, at, key):
+        """Queue a raw event: key (code, char or name; 0 = release) at time at"""
+        heapq.heappush(self.queue, (at, self.sequence, key_code(key)))
+        self.sequence += 1
+
+    def press(self, key, at=None, duration=None):
+        """
+        Queue a key press.
+
+        Args:
+            key: Character, KEY_CODES name or Hack key code
+            at: Press time (default: now)
+            duration: Release after this long (default: held until
+                      the next event)
+        """
+        at = self.clock() if at is None else at
+        self.push(at, key)
+        if duration is not None:
+            self.push(at + duration, 0)
+
+    def release(self, at=None):
+        self.push(self.clock() if at is None else at, 0)
+
+    def type_text(self, text, start=None, interval=0.05, hold=None):
+        """Queue one press/release per character, interval apart"""
+        start = self.clock() if start is None else start
+        hold = interval / 2 if hold is None else hold
+        for i, char in enumerate(text):
+            self.press(char, at=start + i * interval, duration=hold)
+
+    def poll(self):
+        """Apply every event that is due; returns the current key code"""
+        queue = self.queue
+        if queue:
+            now = self.clock()
+            while queue and queue[0][0] <= now:
+                self.current = heapq.heappop(queue)[2]
+        return self.current
+
+    def pending(self):
+        """Number of events not yet applied"""
+        return len(self.queue)
+
+    def read(self, address):
+        self.reads += 1
+        return self.poll()
+
+    def reset(self):
+        self.current = 0
+
+
+def attach_io(cpu, clock=None):
+    """
+    Map a Screen and a Keyboard into cpu's address space.
+
+    Args:
+        cpu: CPU to attach to
+        clock: Keyboard clock (default: wall-clock time)
+
+    Returns:
+        Tuple (screen, keyboard)
+    """
+    screen = Screen(cpu.ram)
+    keyboard = Keyboard() if clock is None else Keyboard(clock)
+    cpu.map_device(screen)
+    cpu.map_device(keyboard)
+    return screen, keyboard
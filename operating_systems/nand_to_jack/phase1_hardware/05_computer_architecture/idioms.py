@@ -0,0 +1,400 @@
+"""
+Idioms - Superinstructions for VM-translator instruction sequences
+
+Code produced by 08_vm_part2/code_generator.py is a handful of fixed
+sequences (push, pop, arithmetic, call and return frames) repeated all
+over ROM. When a program is loaded, ROM is scanned for these sequences
+and each match becomes one superinstruction entry: a native Python
+function that has exactly the effect of the whole sequence.
+
+The effects are transcribed instruction by instruction from the VM
+translator's templates, so they match the interpreter exactly:
+- A, D, PC and every RAM write end up with the same values
+- reads past the end of RAM give 0 and writes there are dropped
+- the stack pointer may alias the registers; each step re-reads RAM
+
+A superinstruction is only used when execution enters at its first
+instruction and the cycle budget covers the whole sequence; jumps into
+the middle of a sequence and budget tails run the plain entries.
+
+Entry layout (see decoder.py for plain entries):
+
+    (SUPERINSTRUCTION, function, length, name)
+
+    function(A, D, M) -> (A, D, next_pc) does what `length` instructions
+    would, with M the RAM's backing array
+"""
+
+from decoder import SUPERINSTRUCTION, JUMP_PREDICATES
+from alu import OPERATIONS
+
+MASK = 0xFFFF
+
+# Encodings of the C-instructions used by the patterns. Kept as a table
+# (rather than assembling at import time) because the 06 and 05
+# assemblers share a module name on the VM translator's sys.path.
+C_WORDS = {
+    "A=M": 0xFC20, "M=D": 0xE308, "M=0": 0xEA88, "D=A": 0xEC10, "D=M": 0xFC10,
+    "M=M+1": 0xFDC8, "M=M-1": 0xFC88, "D=M+1": 0xFDD0, "D=M-D": 0xF1D0,
+    "D=D-A": 0xE4D0, "D=D+A": 0xE090, "A=D-A": 0xE4E0, "A=D+A": 0xE0A0,
+    "M=D+M": 0xF088, "M=M-D": 0xF1C8, "M=D&M": 0xF008, "M=D|M": 0xF548,
+    "M=-M": 0xFCC8, "M=!M": 0xFC48,
+    "0;JMP": 0xEA87, "D;JEQ": 0xE302, "D;JGT": 0xE301, "D;JLT": 0xE304, "D;JNE": 0xE305,
+}
+
+# Wildcard tokens in patterns
+ANY = "@?"           # Any A-instruction, its value is captured
+BINARY_OPS = ("M=D+M", "M=M-D", "M=D&M", "M=D|M")
+UNARY_OPS = ("M=-M", "M=!M")
+COMPARE_JUMPS = ("D;JEQ", "D;JGT", "D;JLT")
+
+
+def _push_d():
+    return ["@0", "A=M", "M=D", "@0", "M=M+1"]
+
+
+def _pop_d():
+    return ["@0", "M=M-1", "A=M", "D=M"]
+
+
+def _call():
+    pattern = [ANY, "D=A"] + _push_d()
+    for segment in ("@1", "@2", "@3", "@4"):
+        pattern += [segment, "D=M"] + _push_d()
+    pattern += ["@0", "D=M", ANY, "D=D-A", "@2", "M=D",
+                "@0", "D=M", "@1", "M=D", ANY, "0;JMP"]
+    return pattern
+
+
+def _return():
+    pattern = ["@1", "D=M", "@13", "M=D", "@5", "A=D-A", "D=M", "@14", "M=D"]
+    pattern += _pop_d() + ["@2", "A=M", "M=D"]
+    pattern += ["@2", "D=M+1", "@0", "M=D"]
+    for offset, segment in ((1, 4), (2, 3), (3, 2), (4, 1)):
+        pattern += ["@13", "D=M", f"@{offset}", "A=D-A", "D=M", f"@{segment}", "M=D"]
+    pattern += ["@14", "A=M", "0;JMP"]
+    return pattern
+
+
+# ===== Native implementations =====
+# Each factory receives the memory accessors, the address just past the
+# sequence and the captured words, and returns
+# function(A, D, M) -> (A, D, next_pc), the same signature as JIT blocks.
+# M is RAM's backing array; addresses 0-15 are always plain RAM (idioms
+# are disabled for smaller RAMs and for devices mapped that low).
+
+class Accessors:
+    """
+    read/write/push/pop for one memory map.
+
+    Addresses below the read/write limits index M directly; the rest go
+    through load(address) / store(address, value) (CPU.load/CPU.store
+    when devices are mapped).
+    """
+
+    def __init__(self, read_limit, write_limit, load, store):
+        def read(M, address):
+            return M[address] if address < read_limit else load(address)
+
+        def write(M, address, value):
+            if address < write_limit:
+                M[address] = value
+            else:
+                store(address, value)
+
+        def push(M, value):
+            """@SP A=M M=D @SP M=M+1 with D = value"""
+            write(M, M[0], value)
+            M[0] = (M[0] + 1) & MASK
+
+        def pop(M):
+            """@SP M=M-1 A=M D=M; returns (A, D)"""
+            sp = M[0] = (M[0] - 1) & MASK
+            return sp, read(M, sp)
+
+        self.read = read
+        self.write = write
+        self.push = push
+        self.pop = pop
+
+
+def plain_accessors(ram_size):
+    """Accessors for RAM alone: reads past the end give 0, writes are dropped"""
+    return Accessors(ram_size, ram_size, lambda address: 0, lambda address, value: None)
+
+
+def push_d(mem, next_pc):
+    push = mem.push
+
+    def run(A, D, M):
+        push(M, D & MASK)
+        return 0, D, next_pc
+    return run
+
+
+def push_zero(mem, next_pc):
+    push = mem.push
+
+    def run(A, D, M):
+        push(M, 0)
+        return 0, D, next_pc
+    return run
+
+
+def push_constant(mem, next_pc, value):
+    push = mem.push
+
+    def run(A, D, M):
+        push(M, value)
+        return 0, value, next_pc
+    return run
+
+
+def push_direct(mem, next_pc, address):
+    read, push = mem.read, mem.push
+
+    def run(A, D, M):
+        value = read(M, address)
+        push(M, value)
+        return 0, value, next_pc
+    return run
+
+
+def push_segment(mem, next_pc, pointer, index):
+    read, push = mem.read, mem.push
+
+    def run(A, D, M):
+        value = read(M, (read(M, pointer) + index) & MASK)
+        push(M, value)
+        return 0, value, next_pc
+    return run
+
+
+def pop_d(mem, next_pc):
+    pop = mem.pop
+
+    def run(A, D, M):
+        sp, value = pop(M)
+        return sp, value, next_pc
+    return run
+
+
+def pop_direct(mem, next_pc, address):
+    pop, write = mem.pop, mem.write
+
+    def run(A, D, M):
+        _, value = pop(M)
+        write(M, address, value)
+        return address, value, next_pc
+    return run
+
+
+def pop_segment(mem, next_pc, pointer, index):
+    read, pop, write = mem.read, mem.pop, mem.write
+
+    def run(A, D, M):
+        M[13] = (read(M, pointer) + index) & MASK
+        _, value = pop(M)
+        address = M[13]
+        write(M, address, value)
+        return address, value, next_pc
+    return run
+
+
+def binary(mem, next_pc, op_word):
+    operation = OPERATIONS[(op_word >> 6) & 0x3F]
+    read, pop, write = mem.read, mem.pop, mem.write
+
+    def run(A, D, M):
+        _, y = pop(M)
+        sp = M[0] = (M[0] - 1) & MASK
+        write(M, sp, operation(y, read(M, sp)))
+        M[0] = (M[0] + 1) & MASK
+        return 0, y, next_pc
+    return run
+
+
+def unary(mem, next_pc, op_word):
+    operation = OPERATIONS[(op_word >> 6) & 0x3F]
+    read, write = mem.read, mem.write
+
+    def run(A, D, M):
+        sp = M[0] = (M[0] - 1) & MASK
+        write(M, sp, operation(D & MASK, read(M, sp)))
+        M[0] = (M[0] + 1) & MASK
+        return 0, D, next_pc
+    return run
+
+
+def compare(mem, next_pc, target, jump_word):
+    predicate = JUMP_PREDICATES[jump_word & 0x7]
+    read, pop = mem.read, mem.pop
+
+    def run(A, D, M):
+        _, y = pop(M)
+        sp = M[0] = (M[0] - 1) & MASK
+        difference = (read(M, sp) - y) & MASK
+        return target, difference, target if predicate(difference) else next_pc
+    return run
+
+
+def if_goto(mem, next_pc, target):
+    pop = mem.pop
+
+    def run(A, D, M):
+        _, value = pop(M)
+        return target, value, target if value else next_pc
+    return run
+
+
+def call(mem, next_pc, return_address, frame_size, function):
+    push = mem.push
+
+    def run(A, D, M):
+        push(M, return_address)
+        for segment in (1, 2, 3, 4):
+            push(M, M[segment])
+        M[2] = (M[0] - frame_size) & MASK
+        M[1] = sp = M[0]
+        return function, sp, function
+    return run
+
+
+def return_(mem, next_pc):
+    read, pop, write = mem.read, mem.pop, mem.write
+
+    def run(A, D, M):
+        frame = M[13] = M[1]
+        M[14] = read(M, (frame - 5) & MASK)
+        _, value = pop(M)
+        write(M, M[2], value)
+        M[0] = (M[2] + 1) & MASK
+        for offset, segment in ((1, 4), (2, 3), (3, 2), (4, 1)):
+            value = M[segment] = read(M, (M[13] - offset) & MASK)
+        target = M[14]
+        return target, value, target
+    return run
+
+
+# (name, pattern, factory); longest patterns first so they win
+IDIOMS = [
+    ("return", _return(), return_),
+    ("call", _call(), call),
+    ("pop_segment", [ANY, "D=M", ANY, "D=D+A", "@13", "M=D"] + _pop_d() + ["@13", "A=M", "M=D"],
+     pop_segment),
+    ("push_segment", [ANY, "D=M", ANY, "A=D+A", "D=M"] + _push_d(), push_segment),
+    ("binary", _pop_d() + ["@0", "M=M-1", "A=M", BINARY_OPS, "@0", "M=M+1"], binary),
+    ("compare", _pop_d() + ["@0", "M=M-1", "A=M", "D=M-D", ANY, COMPARE_JUMPS], compare),
+    ("push_constant", [ANY, "D=A"] + _push_d(), push_constant),
+    ("push_direct", [ANY, "D=M"] + _push_d(), push_direct),
+    ("unary", ["@0", "M=M-1", "A=M", UNARY_OPS, "@0", "M=M+1"], unary),
+    ("if_goto", _pop_d() + [ANY, "D;JNE"], if_goto),
+    ("pop_direct", _pop_d() + [ANY, "M=D"], pop_direct),
+    ("push_zero", ["@0", "A=M", "M=0", "@0", "M=M+1"], push_zero),
+    ("push_d", _push_d(), push_d),
+    ("pop_d", _pop_d(), pop_d),
+]
+
+def _encode(text):
+    """Encode one pattern instruction (@number or a C_WORDS entry)"""
+    if text.startswith("@"):
+        return int(text[1:])
+    return C_WORDS[text]
+
+
+def _compile_token(token):
+    """Pattern token -> (kind, payload): exact word, any A, or a word set"""
+    if token == ANY:
+        return ("any", None)
+    if isinstance(token, tuple):
+        return ("one_of", frozenset(_encode(t) for t in token))
+    return ("exact", _encode(token))
+
+
+def _compile_patterns():
+    return [(name, [_compile_token(t) for t in pattern], factory)
+            for name, pattern, factory in IDIOMS]
+
+
+COMPILED_IDIOMS = _compile_patterns()
+
+
+def match(words, pc):
+    """
+    Find the longest idiom starting at pc.
+
+    Returns:
+        Tuple (name, length, captures) or None
+    """
+    for name, tokens, _ in COMPILED_IDIOMS:
+        end = pc + len(tokens)
+        if end > len(words):
+            continue
+        captures = []
+        for (kind, payload), word in zip(tokens, words[pc:end]):
+            if kind == "exact":
+                if word != payload:
+                    break
+            elif kind == "any":
+                if word & 0x8000:
+                    break
+                captures.append(word)
+            elif word in payload:
+                captures.append(word)
+            else:
+                break
+        else:
+            return name, len(tokens), captures
+    return None
+
+
+def _program_end(words):
+    """Index just past the last non-zero ROM word"""
+    end = len(words)
+    while end and not words[end - 1]:
+        end -= 1
+    return end
+
+
+def fuse(code, words, ram_size, read_limit=None, write_limit=None, load=None, store=None):
+    """
+    Overlay superinstructions on a predecoded program.
+
+    Args:
+        code: Predecoded entries (CPU.code)
+        words: Raw ROM words
+        ram_size: RAM size; idioms address registers 0-15 directly
+        read_limit, write_limit: Lowest addresses that need load/store
+                                 (default: ram_size, no devices)
+        load, store: Slow-path accessors (CPU.load/CPU.store)
+
+    Returns:
+        Tuple (fused, counts): fused is a copy of code with superinstruction
+        entries at every address where an idiom starts, counts maps idiom
+        name -> number of sites
+    """
+    fused = list(code)
+    counts = {}
+    if load is None:
+        mem = plain_accessors(ram_size)
+        read_limit = write_limit = ram_size
+    else:
+        read_limit = ram_size if read_limit is None else read_limit
+        write_limit = ram_size if write_limit is None else write_limit
+        mem = Accessors(read_limit, write_limit, load, store)
+    if min(ram_size, read_limit, write_limit) < 16:
+        return fused, counts
+
+    factories = {name: factory for name, _, factory in COMPILED_IDIOMS}
+    end = _program_end(words)
+    # Every idiom starts with an A-instruction; most ROM words are not
+    starts = [pc for pc in range(end) if words[pc] < 0x8000]
+    for pc in starts:
+        found = match(words, pc)
+        if found is None:
+            continue
+        name, length, captures = found
+        function = factories[name](mem, pc + length, *captures)
+        fused[pc] = (SUPERINSTRUCTION, function, length, name)
+        counts[name] = counts.get(name, 0) + 1
+    return fused, counts
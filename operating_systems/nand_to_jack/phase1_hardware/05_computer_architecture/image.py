@@ -0,0 +1,164 @@
+"""
+Image - Packed binary ROM images
+
+A text .hack file spends most of its loading time in int(line, 2), once
+per word. A binary image stores the words ready to copy: load_image()
+maps the file with mmap and fills an array('H') with a single
+frombytes call, and ROM.load_program_binary / CPU.load_program_binary
+take the words (or the mapped buffer itself) directly.
+
+File format, header integers big-endian:
+
+    b"HACKROM\\0" version:u16 words:u32 symbols:u32 sections:u32 reserved:u16
+    words x u16, little-endian           (starts at byte 24)
+    symbols x (address:u16 length:u16 name:utf-8)
+    sections x (start:u16 words:u16 length:u16 name:utf-8)
+
+Symbols are the assembler's labels (name -> ROM address), so the
+profiler and debugger can be given an image instead of the .asm.
+Sections name ranges of ROM; images made from an .asm get one per VM
+function.
+
+Usage:
+    python image.py Prog.asm Prog.rom       # assemble, with symbols and sections
+    python image.py Prog.hack Prog.rom      # text -> image
+    python image.py Prog.rom Prog.hack      # image -> text
+
+    image = load_image("Prog.rom")
+    cpu.load_program_binary(image.words)
+"""
+
+import argparse
+import mmap
+import struct
+import sys
+from array import array
+
+from snapshot import to_little_endian, from_little_endian
+from symbols import assemble_with_labels, is_function_label
+
+MAGIC = b"HACKROM\0"
+FORMAT_VERSION = 1
+HEADER = struct.Struct(">8sHIIIH")
+SYMBOL = struct.Struct(">HH")
+SECTION = struct.Struct(">HHH")
+
+
+class HackImage:
+    """ROM words plus optional symbols and sections"""
+
+    def __init__(self, words, symbols=None, sections=None):
+        self.words = words                  # array('H')
+        self.symbols = symbols or {}        # Label -> ROM address
+        self.sections = sections or []      # (name, start, words)
+
+    def to_bytes(self):
+        parts = [HEADER.pack(MAGIC, FORMAT_VERSION, len(self.words),
+                             len(self.symbols), len(self.sections), 0),
+                 to_little_endian(self.words)]
+        for name, address in self.symbols.items():
+            encoded = name.encode()
+            parts.append(SYMBOL.pack(address, len(encoded)) + encoded)
+        for name, start, length in self.sections:
+            encoded = name.encode()
+            parts.append(SECTION.pack(start, length, len(encoded)) + encoded)
+        return b"".join(parts)
+
+    @classmethod
+    def from_buffer(cls, data):
+        """Parse an image from bytes, a memoryview or an mmap"""
+        magic, version, count, symbols, sections, _ = HEADER.unpack_from(data)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError("Not a Hack ROM image (or an unsupported version)")
+        offset = HEADER.size + 2 * count
+        if len(data) < offset:
+            raise ValueError("Truncated Hack ROM image")
+        with memoryview(data) as view:
+            words = from_little_endian(view[HEADER.size:offset])
+
+        image = cls(words)
+        for _ in range(symbols):
+            address, length = SYMBOL.unpack_from(data, offset)
+            offset += SYMBOL.size
+            image.symbols[bytes(data[offset:offset + length]).decode()] = address
+            offset += length
+        for _ in range(sections):
+            start, size, length = SECTION.unpack_from(data, offset)
+            offset += SECTION.size
+            image.sections.append((bytes(data[offset:offset + length]).decode(), start, size))
+            offset += length
+        return image
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            f.write(self.to_bytes())
+
+    def to_hack(self):
+        """The words as .hack text (one 16-character binary word per line)"""
+        return "".join(f"{word:016b}\n" for word in self.words)
+
+
+def is_image(path):
+    """True if path starts with the image magic"""
+    with open(path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def load_image(path):
+    """Read an image through mmap"""
+    with open(path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            return HackImage.from_buffer(mapped)
+
+
+def read_hack_text(path):
+    """A text .hack file as an image (no symbols)"""
+    with open(path) as f:
+        return HackImage(array('H', [int(line.strip(), 2) for line in f if line.strip()]))
+
+
+def read_program(path):
+    """
+    Read a program in any form: binary image, .asm or text .hack.
+
+    Returns:
+        HackImage (with symbols and VM function sections for .asm)
+    """
+    path = str(path)
+    if is_image(path):
+        return load_image(path)
+    if path.endswith(".asm"):
+        binary, labels = assemble_with_labels(path)
+        return HackImage(array('H', [int(word, 2) for word in binary]), labels,
+                         function_sections(labels, len(binary)))
+    return read_hack_text(path)
+
+
+def function_sections(labels, size):
+    """(name, start, words) per VM function, each running to the next one"""
+    entries = sorted((address, name) for name, address in labels.items() if is_function_label(name))
+    ends = [address for address, _ in entries[1:]] + [size]
+    return [(name, start, end - start) for (start, name), end in zip(entries, ends)]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert between .asm/.hack text and binary ROM images")
+    parser.add_argument("source", help=".asm, text .hack or binary image")
+    parser.add_argument("target", help="output: a binary image, or .hack text when source is an image")
+    args = parser.parse_args(argv)
+
+    to_text = is_image(args.source)
+    image = read_program(args.source)
+    if to_text:
+        with open(args.target, "w") as f:
+            f.write(image.to_hack())
+        print(f"Wrote {len(image.words)} words to {args.target}")
+    else:
+        image.save(args.target)
+        print(f"Wrote {len(image.words)} words, {len(image.symbols)} symbols, "
+              f"{len(image.sections)} sections to {args.target}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,318 @@
+"""
+Intrinsics - Python implementations of hot Jack OS routines
+
+Math.multiply runs a 16-step shift-and-add loop that calls Math.bit at
+every step, Math.divide recurses through Math.divideHelper with two
+multiplications per level, Math.sqrt multiplies and divides at every
+binary-search step and Memory.alloc walks the free list. An intrinsic
+replaces one such VM function, found by its label in the assembler's
+symbol table: an INTRINSIC entry (see decoder.py) is placed over the
+function's entry point, and when the run loop reaches it the Python
+implementation
+
+1. reads the arguments at ARG (the VM calling convention, see
+   08_vm_part2: SP = RAM[0], LCL = RAM[1], ARG = RAM[2], THIS = RAM[3],
+   THAT = RAM[4], with the caller's frame saved at LCL-5 .. LCL-1),
+2. computes the result and the RAM writes the routine would make (the
+   heap for Memory.alloc and Memory.deAlloc), applied only once the
+   call is known to fit the cycle budget,
+3. returns exactly like the VM translator's return sequence: the
+   result at RAM[ARG], SP = ARG + 1, THAT/THIS/ARG/LCL restored from the
+   frame, R13 = the frame, R14 = the return address, and A, D and PC
+   as the final jump leaves them.
+
+The implementations follow 12_operating_system's Math.jack and
+Memory.jack step for step in 16-bit arithmetic, with < and > as the 08
+translator compiles them (the sign of x - y), so results match the
+compiled routines including overflow. The words the routine would have
+pushed above SP are not written. An intrinsic can decline (division by
+zero, a negative sqrt, a full heap, a call that does not match the
+calling convention); the function's own code then runs, including its
+Sys.error call.
+
+Cycle accounting (cycles=):
+- "native":    each call costs NATIVE_CYCLES, as if the CPU had the
+               routine as an instruction
+- "estimated": each call costs what the 12_operating_system routine,
+               compiled to VM code and translated by 08, takes for
+               those arguments: a count of its loop steps, recursion
+               levels and free blocks visited, weighted by measured
+               costs (within a few percent; other implementations of
+               the same function cost what they cost, not this)
+
+Only the interpreter's run() uses intrinsics (breakpoints inside a
+replaced function are then never reached); step(), the profiler, the
+debugger's watchpoints and the JIT run the function's own code.
+
+Estimated costs can run past a check point (hooks then run late) but
+never past run()'s max_cycles: a call that does not fit the budget runs
+the function's own code.
+
+Entry layout:
+
+    (INTRINSIC, function, 1, name)
+
+    function(pc, A, D, budget) -> (A, D, pc, cycles)
+
+Usage:
+    binary, labels, variables = assemble_with_symbols("Prog.asm")
+    cpu.load_program(binary)
+    intrinsics = Intrinsics(cpu, {**labels, **variables}, cycles="estimated")
+    intrinsics.register_os()
+    cpu.use_intrinsics(intrinsics)
+"""
+
+from decoder import INTRINSIC
+
+MASK = 0xFFFF
+SP, LCL, ARG, THIS, THAT = 0, 1, 2, 3, 4
+R13, R14 = 13, 14
+
+NATIVE_CYCLES = 1
+CYCLE_MODES = ("native", "estimated")
+
+FREE_LIST = "Memory.1"      # Memory.jack's second static (freeList)
+
+# Cycles of the 12_operating_system routines compiled to VM code and
+# translated by 08, fitted to measured runs
+MULTIPLY_CYCLES = 5994      # 16 loop steps, each calling Math.bit
+MULTIPLY_BIT_CYCLES = 44    # Per 1 bit in |y|: sum = sum + shiftedX
+DIVIDE_CYCLES = 475         # Math.divide and the divideHelper level that returns 0
+DIVIDE_LEVEL_CYCLES = 354   # Per divideHelper level that recurses (plus its two multiplies)
+SQRT_SMALL_CYCLES = 215     # Math.sqrt of 0 or 1
+SQRT_CYCLES = 483
+SQRT_STEP_CYCLES = 207      # Per binary-search step (plus its divide and multiply)
+ALLOC_CYCLES = 588          # Memory.alloc when the first free block fits
+ALLOC_BLOCK_CYCLES = 259    # Per free block skipped
+DEALLOC_CYCLES = 172
+
+
+def _less(x, y):
+    """x < y as the 08 translator compiles lt: the sign of x - y (which can overflow)"""
+    return (x - y) & MASK >= 0x8000
+
+
+def _greater(x, y):
+    """x > y as the 08 translator compiles gt"""
+    return 0 < (x - y) & MASK < 0x8000
+
+
+def _negate(value):
+    return -value & MASK
+
+
+def _multiply_cycles(y):
+    return MULTIPLY_CYCLES + MULTIPLY_BIT_CYCLES * bin(_negate(y) if y & 0x8000 else y).count("1")
+
+
+# ===== Math =====
+
+def multiply(memory, x, y):
+    """Math.multiply: x * y modulo 2^16"""
+    return (x * y) & MASK, _multiply_cycles(y)
+
+
+def _divide(x, y):
+    """Math.divide's result and estimated cycles (y != 0)"""
+    negative = False
+    if x & 0x8000:
+        x, negative = _negate(x), not negative
+    if y & 0x8000:
+        y, negative = _negate(y), not negative
+
+    # divideHelper(x, y) calls divideHelper(x, y + y) until y > x or y
+    # overflows; then each level doubles q, adding 1 if the rest allows
+    divisors = []
+    while not (_greater(y, x) or _less(y, 0)):
+        divisors.append(y)
+        y = (y + y) & MASK
+    cycles = DIVIDE_CYCLES
+    q = 0
+    for y in reversed(divisors):
+        cycles += DIVIDE_LEVEL_CYCLES + _multiply_cycles(q) + _multiply_cycles(y)
+        q2 = (q + q) & MASK
+        q = q2 if _less((x - q2 * y) & MASK, y) else (q2 + 1) & MASK
+    return (_negate(q) if negative else q), cycles
+
+
+def divide(memory, x, y):
+    """Math.divide: x / y rounded toward zero (declines y = 0: Sys.error)"""
+    if y == 0:
+        return None
+    return _divide(x, y)
+
+
+def sqrt(memory, x):
+    """Math.sqrt: integer square root by binary search (declines x < 0: Sys.error)"""
+    if _less(x, 0):
+        return None
+    if x <= 1:
+        return x, SQRT_SMALL_CYCLES
+    low, high = 0, x
+    cycles = SQRT_CYCLES
+    while _less(low, (high - 1) & MASK):
+        mid, divide_cycles = _divide((low + high) & MASK, 2)
+        square = (mid * mid) & MASK
+        cycles += SQRT_STEP_CYCLES + divide_cycles + _multiply_cycles(mid)
+        if _greater(square, x):
+            high = mid
+        else:
+            low = mid
+    return low, cycles
+
+
+# ===== Memory =====
+
+def _read(memory, address):
+    """RAM[address] as the CPU reads it: 0 past the end of RAM"""
+    return memory[address] if address < len(memory) else 0
+
+
+def alloc_from(free_list):
+    """Memory.alloc for the heap whose freeList static is at RAM[free_list]"""
+
+    def alloc(memory, size):
+        """First fit; declines when no block fits (Sys.error)"""
+        block = memory[free_list]
+        previous = 0
+        cycles = ALLOC_CYCLES
+        for _ in range(len(memory)):
+            if block == 0:
+                return None
+            block_size = _read(memory, block)
+            next_block = _read(memory, (block + 1) & MASK)
+            if not _less(block_size, (size + 1) & MASK):
+                if _greater(block_size, (size + 3) & MASK):
+                    # Split: the allocation comes off the end of the block
+                    result = (block + block_size - size) & MASK
+                    return result, cycles, (((result - 1) & MASK, (size + 1) & MASK),
+                                            (block, (block_size - size - 1) & MASK))
+                if block == memory[free_list]:
+                    return (block + 1) & MASK, cycles, ((free_list, next_block),)
+                return (block + 1) & MASK, cycles, (((previous + 1) & MASK, next_block),)
+            previous, block = block, next_block
+            cycles += ALLOC_BLOCK_CYCLES
+        return None  # The free list has a cycle: let the routine deal with it
+
+    return alloc
+
+
+def dealloc_to(free_list):
+    """Memory.deAlloc for the heap whose freeList static is at RAM[free_list]"""
+
+    def dealloc(memory, address):
+        """Put the block back at the front of the free list"""
+        block = (address - 1) & MASK
+        return 0, DEALLOC_CYCLES, (((block + 1) & MASK, memory[free_list]), (free_list, block))
+
+    return dealloc
+
+
+class Intrinsics:
+    """
+    Registry of Python implementations of VM functions, by label.
+
+    Attributes:
+        registered: Entry address -> (name, argument count, function)
+        calls: Function name -> calls run natively
+        declined: Function name -> calls that ran the ROM code instead
+    """
+
+    def __init__(self, cpu, symbols, cycles="estimated"):
+        """
+        Args:
+            cpu: CPU to run on (attach with cpu.use_intrinsics)
+            symbols: Labels (name -> ROM address), plus the static
+                     variables (e.g. Memory.1 -> RAM address) for Memory.*
+            cycles: "native" or "estimated" (see the module docstring)
+        """
+        if cycles not in CYCLE_MODES:
+            raise ValueError(f"cycles must be one of {CYCLE_MODES}, not {cycles!r}")
+        self.cpu = cpu
+        self.symbols = dict(symbols)
+        self.native = cycles == "native"
+        self.registered = {}
+        self.calls = {}
+        self.declined = {}
+
+    def register(self, name, function, arguments):
+        """
+        Run function instead of the VM function at label name.
+
+        function(memory, *args) returns (result, estimated cycles), or
+        None to run the ROM code for this call. It must not change
+        memory: RAM writes are returned as a third element, a sequence
+        of (address, value) pairs applied in order, as CPU.execute
+        stores M, once the call is known to fit the budget.
+
+        Returns:
+            True if the label exists
+        """
+        if name not in self.symbols:
+            return False
+        self.registered[self.symbols[name]] = (name, arguments, function)
+        self.calls.setdefault(name, 0)
+        self.declined.setdefault(name, 0)
+        return True
+
+    def register_os(self):
+        """
+        Register the 12_operating_system routines present in the symbols
+        (Memory.alloc and Memory.deAlloc need the freeList static).
+
+        Returns:
+            Names registered
+        """
+        table = {"Math.multiply": (multiply, 2), "Math.divide": (divide, 2), "Math.sqrt": (sqrt, 1)}
+        if FREE_LIST in self.symbols:
+            table["Memory.alloc"] = (alloc_from(self.symbols[FREE_LIST]), 1)
+            table["Memory.deAlloc"] = (dealloc_to(self.symbols[FREE_LIST]), 1)
+        return [name for name, (function, arguments) in table.items()
+                if self.register(name, function, arguments)]
+
+    def install(self, code, fused):
+        """Put INTRINSIC entries over the registered entry points in fused"""
+        for address, (name, _, _) in self.registered.items():
+            if address < len(code):
+                fused[address] = (INTRINSIC, self.call, 1, name)
+
+    def call(self, pc, A, D, budget):
+        """
+        Run the intrinsic at pc and return to the caller, or execute the
+        first instruction of the function if it declines.
+
+        Returns:
+            (A, D, pc, cycles)
+        """
+        name, arguments, function = self.registered[pc]
+        cpu = self.cpu
+        memory = cpu.ram.memory
+        frame, arg = memory[LCL], memory[ARG]
+        if 5 <= frame < cpu.write_limit and arg + arguments == frame - 5:
+            outcome = function(memory, *memory[arg:frame - 5])
+            if outcome is not None:
+                result, estimate, *writes = outcome
+                cycles = NATIVE_CYCLES if self.native else estimate
+                if cycles <= budget:
+                    self.calls[name] += 1
+                    write_limit = cpu.write_limit
+                    for address, value in (writes[0] if writes else ()):
+                        if address < write_limit:
+                            memory[address] = value
+                        else:
+                            cpu.store(address, value)
+                    return_address = memory[frame - 5]
+                    memory[arg] = result
+                    memory[SP] = arg + 1
+                    memory[R13] = frame
+                    memory[R14] = return_address
+                    memory[THAT] = memory[frame - 1]
+                    memory[THIS] = memory[frame - 2]
+                    memory[ARG] = memory[frame - 3]
+                    memory[LCL] = D = memory[frame - 4]
+                    return return_address, D, return_address, cycles
+
+        self.declined[name] += 1
+        cpu.A, cpu.D, cpu.PC = A, D, pc
+        cpu.execute(cpu.code[pc])
+        return cpu.A, cpu.D, cpu.PC, 1
@@ -0,0 +1,307 @@
+"""
+JIT - Translates Hack basic blocks into generated Python functions
+
+The interpreter pays one Python call and one tuple unpack per instruction.
+The JIT instead compiles each basic block into a straight-line Python
+function with A and D held in locals, so a whole block costs one call.
+
+A block starts at an entry PC and runs until:
+- a C-instruction with a jump (the block's only exit with two successors)
+- HALT or an unused comp encoding (left to the interpreter)
+- the end of ROM, or MAX_BLOCK_LENGTH instructions
+
+Unconditional jumps whose target is known at compile time (@LABEL then
+0;JMP, the common Hack idiom) are chained: the target's instructions are
+compiled into the same function instead of ending the block.
+
+Every path through a block executes the same number of instructions, so
+the block's length is its exact cycle cost. When the remaining budget of
+run(max_cycles) is smaller than the next block, the tail is interpreted
+one instruction at a time, so max_cycles and HALT keep their meaning.
+
+Generated function signature:
+
+    block(A, D, M) -> (A, D, next_pc)
+
+where M is the RAM's backing list. Reads past the end of RAM give 0 and
+writes there are dropped, exactly as RAM.read/RAM.write do. Accesses at
+or above the CPU's read_limit/write_limit (memory-mapped devices) call
+the CPU's load/store instead of indexing M.
+
+Usage:
+    cpu = CPU(jit=True)
+    cpu.load_program(binary)
+    halted, cycles = cpu.run(max_cycles=10_000_000)
+"""
+
+from decoder import A_INSTRUCTION, C_INSTRUCTION
+
+MAX_BLOCK_LENGTH = 256
+
+# comp bits -> Python expression over D and {y} (A, a constant or M[...])
+EXPRESSIONS = {
+    0b101010: "0",
+    0b111111: "1",
+    0b111010: "65535",
+    0b001100: "D",
+    0b110000: "{y}",
+    0b001101: "D ^ 65535",
+    0b110001: "{y} ^ 65535",
+    0b001111: "-D & 65535",
+    0b110011: "-{y} & 65535",
+    0b011111: "(D + 1) & 65535",
+    0b110111: "({y} + 1) & 65535",
+    0b001110: "(D - 1) & 65535",
+    0b110010: "({y} - 1) & 65535",
+    0b000010: "(D + {y}) & 65535",
+    0b010011: "(D - {y}) & 65535",
+    0b000111: "({y} - D) & 65535",
+    0b000000: "D & {y}",
+    0b010101: "D | {y}",
+}
+
+# Extended ISA (see alu.EXTENDED_OPERATIONS)
+EXTENDED_EXPRESSIONS = {
+    0b000001: "(D * {y}) & 65535",
+    0b000011: "(D << ({y} & 15)) & 65535",
+    0b000100: "D >> ({y} & 15)",
+}
+ALL_EXPRESSIONS = {**EXPRESSIONS, **EXTENDED_EXPRESSIONS}
+
+# jump bits -> Python condition on the result r (None: no jump)
+CONDITIONS = (
+    None,
+    "0 < r < 32768",        # JGT
+    "r == 0",               # JEQ
+    "r < 32768",            # JGE
+    "r >= 32768",           # JLT
+    "r != 0",               # JNE
+    "r == 0 or r >= 32768", # JLE
+    "True",                 # JMP
+)
+
+
+def _compilable(entry, word, expressions=EXPRESSIONS):
+    """True if the instruction can be placed inside a block"""
+    kind = entry[0]
+    if kind == A_INSTRUCTION:
+        return True
+    return kind == C_INSTRUCTION and (word >> 6) & 0x3F in expressions
+
+
+def generate_block(code, words, pc, ram_size, rom_size, read_limit=None, write_limit=None,
+                   extended=False):
+    """
+    Generate the Python source of the block entered at pc.
+
+    Args:
+        code: Predecoded entries (CPU.code)
+        words: Raw ROM words (ROM.memory)
+        pc: Entry address
+        ram_size: RAM size, for bounds checks
+        rom_size: ROM size, blocks never run past it
+        read_limit, write_limit: Lowest addresses that go through
+                                 load()/store() (default: ram_size)
+        extended: Compile the extended ISA's comps (CPU(extended_isa=True))
+
+    Returns:
+        Tuple (source, length); length 0 means the instruction at pc
+        has to be interpreted (HALT or an unused comp encoding)
+    """
+    read_limit = ram_size if read_limit is None else read_limit
+    write_limit = ram_size if write_limit is None else write_limit
+    devices = read_limit < ram_size or write_limit < ram_size
+    expressions = ALL_EXPRESSIONS if extended else EXPRESSIONS
+    lines = []
+    emit = lines.append
+    length = 0
+    known_a = None  # Value of A if fixed at compile time
+    visited = set()
+
+    def m_read():
+        """Expression reading M[A]"""
+        if known_a is None:
+            fallback = "load(A)" if devices else "0"
+            return f"(M[A] if A < {read_limit} else {fallback})"
+        if known_a < read_limit:
+            return f"M[{known_a}]"
+        return f"load({known_a})" if devices else "0"
+
+    def m_write(value):
+        """Statement writing value to M[A], or None if it is dropped"""
+        if known_a is None:
+            if devices:
+                return f"if A < {write_limit}: M[A] = {value}\nelse: store(A, {value})"
+            return f"if A < {write_limit}: M[A] = {value}"
+        if known_a < write_limit:
+            return f"M[{known_a}] = {value}"
+        return f"store({known_a}, {value})" if devices else None
+
+    while True:
+        if pc >= rom_size or length >= MAX_BLOCK_LENGTH or pc in visited:
+            emit(f"return A, D, {pc}")
+            break
+        entry = code[pc]
+        word = words[pc]
+        if not _compilable(entry, word, expressions):
+            emit(f"return A, D, {pc}")
+            break
+        visited.add(pc)
+        length += 1
+
+        if entry[0] == A_INSTRUCTION:
+            known_a = entry[1]
+            emit(f"A = {known_a}")
+            pc += 1
+            continue
+
+        _, _, use_m, dest, _ = entry
+        if use_m:
+            y = m_read()
+        else:
+            y = "A" if known_a is None else str(known_a)
+        expression = expressions[(word >> 6) & 0x3F].format(y=y)
+        condition = CONDITIONS[word & 0x7]
+
+        targets = []
+        if dest & 0x4:
+            targets.append("A")
+        if dest & 0x2:
+            targets.append("D")
+
+        if dest & 0x1 or len(targets) > 1 or condition is not None:
+            emit(f"r = {expression}")
+            for register in targets:
+                emit(f"{register} = r")
+            value = "r"
+        elif targets:
+            emit(f"{targets[0]} = {expression}")
+        # No destination and no jump: the result is discarded
+
+        if dest & 0x4:
+            known_a = None
+        if dest & 0x1:
+            statement = m_write(value)
+            if statement is not None:
+                for line in statement.split("\n"):
+                    emit(line)
+
+        if condition is None:
+            pc += 1
+        elif condition == "True" and known_a is not None:
+            pc = known_a  # Chain into the statically known target
+        elif condition == "True":
+            emit("return A, D, A")
+            break
+        else:
+            emit(f"return A, D, (A if {condition} else {pc + 1})")
+            break
+
+    body = "\n".join("    " + line for line in lines)
+    return f"def block(A, D, M):\n{body}\n", length
+
+
+class JIT:
+    """
+    Basic-block compiler and dispatcher for a CPU.
+
+    Compiled blocks are cached in a table indexed by entry PC. The table
+    is thrown away whenever the ROM version changes (the same signal the
+    CPU's predecoded entries use) or a device is mapped.
+    """
+
+    def __init__(self, cpu):
+        self.cpu = cpu
+        self.blocks = []
+        self.sources = {}   # Entry PC -> generated source, for inspection
+        self.version = -1
+        self.blocks_compiled = 0
+
+    def sync(self):
+        """Drop compiled blocks if the ROM changed"""
+        cpu = self.cpu
+        cpu.ensure_decoded()
+        version = (cpu.rom.version, cpu.memory_map_version)
+        if self.version != version:
+            self.blocks = [None] * cpu.rom.size
+            self.sources = {}
+            self.version = version
+
+    def compile(self, pc):
+        """Compile the block entered at pc and cache it; returns (function, length)"""
+        cpu = self.cpu
+        source, length = generate_block(cpu.code, cpu.rom.memory, pc, cpu.ram.size,
+                                        cpu.rom.size, cpu.read_limit, cpu.write_limit,
+                                        cpu.extended_isa)
+        function = None
+        if length:
+            namespace = {"load": cpu.load, "store": cpu.store}
+            exec(compile(source, f"<hack block {pc}>", "exec"), namespace)
+            function = namespace["block"]
+            self.sources[pc] = source
+            self.blocks_compiled += 1
+        block = self.blocks[pc] = (function, length)
+        return block
+
+    def run(self, max_cycles=1000):
+        """
+        Run the CPU through compiled blocks (same contract as CPU.run,
+        including the check hooks, called between blocks).
+
+        Returns:
+            Tuple (halted, cycles_executed)
+        """
+        self.sync()
+        cpu = self.cpu
+        blocks = self.blocks
+        compile_block = self.compile
+        code = cpu.code
+        execute = cpu.execute
+        memory = cpu.ram.memory
+        size = cpu.rom.size
+
+        hooks = cpu.check_hooks
+        interval = max(1, cpu.check_interval)
+
+        A, D, pc = cpu.A, cpu.D, cpu.PC
+        start_cycles = cpu.cycles
+        cycles = 0
+        next_check = interval
+        halted = False
+        try:
+            while cycles < max_cycles:
+                if pc >= size:
+                    break  # Stopped: PC beyond ROM
+
+                if cycles >= next_check:
+                    next_check = cycles + interval
+                    if hooks:
+                        cpu.A, cpu.D, cpu.PC = A, D, pc
+                        cpu.cycles = start_cycles + cycles
+                        stop = cpu.run_check_hooks()
+                        A, D, pc = cpu.A, cpu.D, cpu.PC
+                        if stop:
+                            break
+                        continue
+
+                block = blocks[pc] or compile_block(pc)
+                function, length = block
+                if function is not None and cycles + length <= max_cycles:
+                    A, D, pc = function(A, D, memory)
+                    cycles += length
+                    continue
+
+                # HALT, unused comp, or not enough budget left for the block
+                cpu.A, cpu.D, cpu.PC = A, D, pc
+                cpu.cycles = start_cycles + cycles
+                running = execute(code[pc])
+                A, D, pc = cpu.A, cpu.D, cpu.PC
+                cycles += 1
+                if not running:
+                    halted = True
+                    break
+        finally:
+            cpu.A, cpu.D, cpu.PC = A, D, pc
+            cpu.cycles = start_cycles + cycles
+
+        return (halted, cycles)
@@ -0,0 +1,280 @@
+"""
+Lockstep - One ROM over many RAM states at once, with NumPy
+
+LockstepCPU runs K independent Hack machines ("lanes") that share a ROM.
+A, D and PC are vectors of K values and RAM is a K x ram_size uint16
+matrix, so every instruction is applied to a whole group of lanes with
+a handful of NumPy operations instead of K trips through the
+interpreter.
+
+Scheduling is min-PC: the lanes at the lowest PC form the group that
+runs, the others are masked off and wait. The group keeps executing
+with a single scalar PC until
+- a jump sends its lanes to different places (they split),
+- it reaches the PC of a waiting lane (they merge on the next round),
+- HALT, the end of ROM, or a lane's cycle budget.
+Lanes that took different sides of an if therefore regroup where the
+branches join, and data-parallel code runs with every lane together.
+
+Each lane behaves exactly like CPU.run on that lane's state: the same
+registers, RAM, halted flag and cycle count, including reads past the
+end of RAM giving 0, dropped writes there, and M using the new A.
+
+NumPy is optional for the rest of the package; creating a LockstepCPU
+without it raises ImportError.
+
+Usage:
+    machines = LockstepCPU(lanes=4096, ram_size=1024)
+    machines.load_program(binary)
+    machines.ram[:, 0] = inputs
+    halted, cycles = machines.run(max_cycles=100_000)
+    outputs = machines.ram[:, 2]
+"""
+
+try:
+    import numpy as np
+except ImportError:  # Optional dependency
+    np = None
+
+from decoder import decode, A_INSTRUCTION, C_INSTRUCTION, HALT
+from rom import ROM
+
+MASK = 0xFFFF
+
+
+def _vector_operations():
+    """comp bits -> f(d, y) over arrays (the ALU's 18 functions)"""
+    return {
+        0b101010: lambda d, y: np.zeros_like(d),
+        0b111111: lambda d, y: np.ones_like(d),
+        0b111010: lambda d, y: np.full_like(d, MASK),
+        0b001100: lambda d, y: d,
+        0b110000: lambda d, y: y,
+        0b001101: lambda d, y: d ^ MASK,
+        0b110001: lambda d, y: y ^ MASK,
+        0b001111: lambda d, y: -d & MASK,
+        0b110011: lambda d, y: -y & MASK,
+        0b011111: lambda d, y: (d + 1) & MASK,
+        0b110111: lambda d, y: (y + 1) & MASK,
+        0b001110: lambda d, y: (d - 1) & MASK,
+        0b110010: lambda d, y: (y - 1) & MASK,
+        0b000010: lambda d, y: (d + y) & MASK,
+        0b010011: lambda d, y: (d - y) & MASK,
+        0b000111: lambda d, y: (y - d) & MASK,
+        0b000000: lambda d, y: d & y,
+        0b010101: lambda d, y: d | y,
+    }
+
+
+def _vector_extended_operations():
+    """comp bits -> f(d, y) for the extended ISA (see alu.EXTENDED_OPERATIONS)"""
+    return {
+        0b000001: lambda d, y: (d * y) & MASK,
+        0b000011: lambda d, y: (d << (y & 15)) & MASK,
+        0b000100: lambda d, y: d >> (y & 15),
+    }
+
+
+def _vector_conditions():
+    """jump bits -> f(r) -> bool array (None: no jump)"""
+    return (
+        None,
+        lambda r: (r != 0) & (r < 32768),   # JGT
+        lambda r: r == 0,                   # JEQ
+        lambda r: r < 32768,                # JGE
+        lambda r: r >= 32768,               # JLT
+        lambda r: r != 0,                   # JNE
+        lambda r: (r == 0) | (r >= 32768),  # JLE
+        None,                               # JMP (handled without a test)
+    )
+
+
+class LockstepCPU:
+    """
+    K Hack machines sharing one ROM, executed in lockstep.
+
+    Attributes:
+        A, D, PC: int64 vectors, one value per lane
+        ram: uint16 matrix, lanes x ram_size
+        rom: The shared ROM
+    """
+
+    def __init__(self, lanes, rom_size=32768, ram_size=32768, extended_isa=False):
+        if np is None:
+            raise ImportError("LockstepCPU needs NumPy (pip install numpy)")
+        self.lanes = lanes
+        self.ram_size = ram_size
+        self.rom = ROM(rom_size)
+        self.ram = np.zeros((lanes, ram_size), dtype=np.uint16)
+        self.A = np.zeros(lanes, dtype=np.int64)
+        self.D = np.zeros(lanes, dtype=np.int64)
+        self.PC = np.zeros(lanes, dtype=np.int64)
+        self.operations = _vector_operations()
+        if extended_isa:
+            self.operations.update(_vector_extended_operations())
+        self.conditions = _vector_conditions()
+        self.code = []
+        self.code_version = -1
+        self.groups_run = 0  # Lockstep groups scheduled (a measure of divergence)
+
+    def load_program(self, binary_instructions):
+        """Load the shared program (list of 16-bit binary strings)"""
+        self.rom.load_program(binary_instructions)
+        self.predecode()
+
+    def predecode(self):
+        """Decode ROM into (kind, value, use_m, dest, comp, jump) per word"""
+        code = []
+        for word in self.rom.memory:
+            kind = decode(word)[0]
+            if kind == A_INSTRUCTION:
+                code.append((kind, word, False, 0, 0, 0))
+            elif kind == C_INSTRUCTION:
+                code.append((kind, 0, bool(word & 0x1000), (word >> 3) & 0x7, (word >> 6) & 0x3F, word & 0x7))
+            else:
+                code.append((HALT, 0, False, 0, 0, 0))
+        self.code = code
+        self.code_version = self.rom.version
+
+    def reset(self):
+        """Zero every lane's registers and RAM"""
+        self.A[:] = 0
+        self.D[:] = 0
+        self.PC[:] = 0
+        self.ram[:] = 0
+
+    def run(self, max_cycles=1000):
+        """
+        Run every lane until it halts, leaves ROM or uses max_cycles.
+
+        Returns:
+            Tuple (halted, cycles) of per-lane arrays, with the meaning
+            CPU.run gives its (halted, cycles_executed)
+        """
+        if self.code_version != self.rom.version:
+            self.predecode()
+        rom_size = self.rom.size
+        halted = np.zeros(self.lanes, dtype=bool)
+        executed = np.zeros(self.lanes, dtype=np.int64)
+        stopped = self.PC >= rom_size
+
+        while True:
+            live = np.flatnonzero(~stopped)
+            if live.size == 0:
+                break
+            pcs = self.PC[live]
+            pc = int(pcs.min())
+            at_pc = pcs == pc
+            group = live[at_pc]
+            waiting = pcs[~at_pc]
+            stop_at = int(waiting.min()) if waiting.size else rom_size
+            budget = max_cycles - int(executed[group].max())
+
+            steps, halt = self._run_group(group, pc, stop_at, budget)
+            self.groups_run += 1
+            executed[group] += steps
+            if halt:
+                halted[group] = True
+                stopped[group] = True
+            stopped[group] |= (self.PC[group] >= rom_size) | (executed[group] >= max_cycles)
+
+        return halted, executed
+
+    def _run_group(self, group, pc, stop_at, budget):
+        """
+        Execute lanes `group` (all at pc) together.
+
+        Stops when they split, reach stop_at (a waiting lane's PC) or
+        later, leave ROM, halt, or after budget instructions. Writes the
+        lanes' PCs back.
+
+        Returns:
+            Tuple (instructions executed, halted)
+        """
+        code = self.code
+        ram = self.ram
+        ram_size = self.ram_size
+        rom_size = self.rom.size
+        operations = self.operations
+        conditions = self.conditions
+        A, D, PC = self.A, self.D, self.PC
+
+        if group.size == self.lanes:
+            lanes = slice(None)     # Views instead of gathers
+            rows = np.arange(self.lanes)
+        else:
+            lanes = rows = group
+
+        a_const = None  # A's value when every lane in the group has the same one
+        steps = 0
+        while steps < budget:
+            kind, value, use_m, dest, comp, jump = code[pc]
+            if kind == A_INSTRUCTION:
+                A[lanes] = value
+                a_const = value
+                steps += 1
+                pc += 1
+            elif kind == HALT:
+                PC[lanes] = pc
+                return steps + 1, True
+            else:
+                d = D[lanes]
+                if not use_m:
+                    y = A[lanes]
+                elif a_const is not None:
+                    y = ram[lanes, a_const] if a_const < ram_size else np.zeros_like(d)
+                else:
+                    y = self._gather(rows, A[lanes])
+                result = operations[comp](d, y)
+
+                if dest & 0x4:
+                    A[lanes] = result
+                    a_const = None
+                if dest & 0x2:
+                    D[lanes] = result
+                if dest & 0x1:
+                    if a_const is not None:
+                        if a_const < ram_size:
+                            ram[lanes, a_const] = result
+                    else:
+                        self._scatter(rows, A[lanes], result)
+                steps += 1
+
+                if jump == 0:
+                    pc += 1
+                else:
+                    if jump == 7:
+                        taken = None
+                    else:
+                        taken = conditions[jump](np.broadcast_to(result, d.shape))
+                    if a_const is not None and taken is None:
+                        pc = a_const
+                    else:
+                        targets = A[lanes] if taken is None else np.where(taken, A[lanes], pc + 1)
+                        first = int(targets[0])
+                        if not (targets == first).all():
+                            PC[lanes] = targets  # Lanes split
+                            return steps, False
+                        pc = first
+            if pc >= stop_at or pc >= rom_size:
+                break
+        PC[lanes] = pc
+        return steps, False
+
+    def _gather(self, rows, addresses):
+        """RAM[row, address] per lane, 0 past the end of RAM"""
+        if int(addresses.max()) < self.ram_size:
+            return self.ram[rows, addresses]
+        inside = addresses < self.ram_size
+        values = np.zeros(addresses.shape, dtype=np.uint16)
+        values[inside] = self.ram[rows[inside], addresses[inside]]
+        return values
+
+    def _scatter(self, rows, addresses, values):
+        """RAM[row, address] = value per lane, dropped past the end of RAM"""
+        values = np.broadcast_to(values, addresses.shape)
+        if int(addresses.max()) < self.ram_size:
+            self.ram[rows, addresses] = values
+            return
+        inside = addresses < self.ram_size
+        self.ram[rows[inside], addresses[inside]] = values[inside]
@@ -0,0 +1,377 @@
+"""
+Pipeline - Cycle-level timing model of a pipelined Hack CPU
+
+CPU is functional: every instruction takes one cycle. PipelineModel
+estimates what the same program would take on an in-order pipeline
+with configurable stages and forwarding. It drives the CPU through its
+own run loop (like stats.py), executing the predecoded entries exactly
+as CPU.step does, and times each instruction from values the
+functional core already produced: the A it used as an address, the
+destinations it wrote and whether its jump was taken. Nothing about
+the pipeline's datapath is simulated, so the model runs at about half
+the speed of the plain interpreter (around a million instructions per
+second).
+
+Timing (the default "classic" pipeline, IF ID MEM EX WB):
+- IF fetches, ID decodes (an A-instruction's value is known here),
+  MEM reads RAM[A] for comps using M, EX runs the ALU and resolves
+  jumps, WB writes A, D and M.
+- An instruction starts one cycle after the previous one, or later if
+  a value it needs is not ready by the stage that uses it; the
+  difference is a stall, charged to the stalled instruction's address:
+  - data:     D or A as an ALU operand or jump target (needed in EX)
+  - address:  A as the address of an M read (needed in MEM), e.g.
+              A=M or AM=M-1 followed by D=M
+  - memory:   M written by an earlier instruction and read again
+              before the write completes
+- With forwarding, an ALU result is usable the cycle after EX (an
+  immediate the cycle after ID) and a stored M can be read the cycle
+  after EX. Without it, registers are read in ID once the producer
+  has reached WB, and M reads wait for the write.
+- Jumps are predicted not taken, or by a predictors.BranchPredictor
+  passed as predictor: a mispredicted jump flushes the instructions
+  fetched behind it, costing one cycle per stage before the branch
+  stage, charged to the jump's address.
+
+cycles = instructions + stalls + branch penalties + the cycles to
+drain the pipeline after the last instruction. Superinstructions,
+fast-forwarded loops and intrinsics are not used (their instructions
+run one by one); the functional result is the same.
+
+Usage:
+    python pipeline.py program.asm --pipeline classic --predictor gshare
+
+    model = PipelineModel(cpu, PIPELINES["classic"], labels, BranchPredictor(cpu, "gshare"))
+    model.run(max_cycles=1_000_000)
+    print(model.report())
+"""
+
+import argparse
+import sys
+
+from cpu import CPU
+from decoder import A_INSTRUCTION, C_INSTRUCTION
+from image import read_program
+from predictors import BranchPredictor, PREDICTORS
+from reports import JSONReport, zeros
+from stats import c_mnemonic
+from symbols import LabelIndex
+
+CAUSES = ("data", "address", "memory", "branch")
+
+
+class PipelineConfig:
+    """
+    Stages and forwarding of a modelled pipeline.
+
+    The roles (decode, memory_read, execute, writeback, branch) name the
+    stage where that work happens; they must be in pipeline order, with
+    jumps resolved no earlier than the ALU.
+    """
+
+    def __init__(self, stages=("IF", "ID", "MEM", "EX", "WB"), decode="ID", memory_read="MEM",
+                 execute="EX", writeback="WB", branch="EX", forwarding=True, memory_forwarding=True):
+        self.stages = tuple(stages)
+        index = {name: position for position, name in enumerate(self.stages)}
+        try:
+            self.decode, self.memory_read, self.execute, self.writeback, self.branch = (
+                index[name] for name in (decode, memory_read, execute, writeback, branch))
+        except KeyError as error:
+            raise ValueError(f"Unknown stage {error.args[0]!r}, stages are {self.stages}") from None
+        if not self.decode < self.memory_read < self.execute <= self.writeback:
+            raise ValueError("Stages must run decode < memory_read < execute <= writeback")
+        if not self.execute <= self.branch <= self.writeback:
+            raise ValueError("Jumps resolve between execute and writeback")
+        self.forwarding = forwarding
+        self.memory_forwarding = memory_forwarding
+
+    @property
+    def depth(self):
+        return len(self.stages)
+
+    def describe(self):
+        return {"stages": list(self.stages), "forwarding": self.forwarding,
+                "memory_forwarding": self.memory_forwarding, "branch_penalty": self.branch}
+
+
+PIPELINES = {
+    "classic": PipelineConfig(),
+    "no-forwarding": PipelineConfig(forwarding=False, memory_forwarding=False),
+    "deep": PipelineConfig(stages=("IF1", "IF2", "ID", "AG", "MEM", "EX", "WB")),
+}
+
+
+def _operands(word):
+    """
+    Registers a C-instruction reads before EX: 1 for D, 2 for A (as an
+    ALU operand or jump target). The ALU's zx and zy bits zero x = D
+    and y = A/M.
+    """
+    return (0 if word & 0x800 else 1) | (2 if word & 0x7 or not word & 0x1200 else 0)
+
+
+class PipelineModel(JSONReport):
+    """
+    Times a CPU's execution on a modelled pipeline (jumps predicted
+    not taken, or by predictor, a predictors.BranchPredictor).
+
+    Attributes:
+        config: The PipelineConfig
+        instructions: Instructions timed
+        counts: array('Q'), instructions executed at each address
+        stalls: Per cause (CAUSES), array('Q') of stall cycles at each address
+        taken: array('Q'), taken jumps at each address
+    """
+
+    def __init__(self, cpu, config=None, labels=None, predictor=None):
+        self.cpu = cpu
+        self.config = config or PIPELINES["classic"]
+        self.predictor = predictor
+        self.index = LabelIndex(labels or {})
+        self.operands = None
+        self.operands_version = None
+        self.reset()
+
+    def reset(self):
+        """Clear counts and the pipeline state"""
+        size = self.cpu.rom.size
+        self.counts = zeros(size)
+        self.stalls = [zeros(size) for _ in CAUSES]
+        self.taken = zeros(size)
+        self.instructions = 0
+        self.fetch = 0            # Cycle the next instruction can start
+        self.ready_a = self.ready_d = 0
+        self.memory_ready = {}    # RAM address -> cycle a read of it can start MEM
+
+    @property
+    def cycles(self):
+        """Pipeline cycles for the instructions timed, including the drain"""
+        return self.fetch + self.config.depth - 1 if self.instructions else 0
+
+    def cpi(self):
+        return self.cycles / self.instructions if self.instructions else 0.0
+
+    def run(self, max_cycles=1000):
+        """
+        Run and time the CPU for up to max_cycles instructions (same
+        contract as CPU.run, including check hooks).
+
+        Returns:
+            Tuple (halted, instructions_executed)
+        """
+        cpu = self.cpu
+        cpu.ensure_decoded()
+        if self.operands_version != cpu.code_version:
+            self.operands = [_operands(word) for word in cpu.rom.memory]
+            self.operands_version = cpu.code_version
+        operands = self.operands
+        observe = None
+        if self.predictor is not None:
+            self.predictor.prepare()
+            observe = self.predictor.observe
+        config = self.config
+        code = cpu.code
+        memory = cpu.ram.memory
+        read_limit, write_limit = cpu.read_limit, cpu.write_limit
+        load, store = cpu.load, cpu.store
+        counts, taken = self.counts, self.taken
+        data_stalls, address_stalls, memory_stalls, branch_stalls = self.stalls
+        memory_ready = self.memory_ready
+        rom_size = cpu.rom.size
+        interval = max(1, cpu.check_interval)
+        next_check = interval
+        start_cycles = cpu.cycles
+
+        # Stage offsets: a value produced at start + produce is usable by
+        # an instruction whose consuming stage is at start' + use >= it
+        if config.forwarding:
+            operand_use, address_use = config.execute, config.memory_read
+            immediate_ready, alu_ready = config.decode + 1, config.execute + 1
+        else:
+            operand_use = address_use = config.decode
+            immediate_ready = alu_ready = config.writeback
+        memory_use = config.memory_read
+        stored_ready = config.execute + 1 if config.memory_forwarding else config.writeback + 1
+        penalty = config.branch
+
+        A, D, pc = cpu.A, cpu.D, cpu.PC
+        fetch, ready_a, ready_d = self.fetch, self.ready_a, self.ready_d
+        cycle = 0
+        halted = False
+        try:
+            while cycle < max_cycles:
+                if pc >= rom_size:
+                    break
+                if cycle >= next_check:
+                    next_check = cycle + interval
+                    if cpu.check_hooks:
+                        cpu.A, cpu.D, cpu.PC = A, D, pc
+                        cpu.cycles = start_cycles + cycle
+                        stop = cpu.run_check_hooks()
+                        A, D, pc = cpu.A, cpu.D, cpu.PC
+                        if stop:
+                            break
+                        continue
+
+                kind, operation, use_m, dest, jump = code[pc]
+                counts[pc] += 1
+                cycle += 1
+                if kind == C_INSTRUCTION:
+                    start = fetch
+                    cause = None
+                    # Operands and the jump target, then the M read
+                    needs = operands[pc]
+                    operand = (ready_d if needs == 1 else ready_a if needs == 2 else
+                               max(ready_d, ready_a) if needs else 0) - operand_use
+                    if operand > start:
+                        start, cause = operand, data_stalls
+                    if use_m:
+                        address = ready_a - address_use
+                        if address > start:
+                            start, cause = address, address_stalls
+                        stored = memory_ready.get(A, 0) - memory_use
+                        if stored > start:
+                            start, cause = stored, memory_stalls
+                        result = operation(D, memory[A] if A < read_limit else load(A))
+                    else:
+                        result = operation(D, A)
+                    if cause is not None:
+                        cause[pc] += start - fetch
+
+                    if dest & 0x4:
+                        A = result
+                        ready_a = start + alu_ready
+                    if dest & 0x2:
+                        D = result
+                        ready_d = start + alu_ready
+                    if dest & 0x1:
+                        memory_ready[A] = start + stored_ready
+                        if A < write_limit:
+                            memory[A] = result
+                        else:
+                            store(A, result)
+                    if jump is not None:
+                        target = A if jump(result) else pc + 1
+                        if target != pc + 1:
+                            taken[pc] += 1
+                        if observe(pc, A, target) if observe else target == pc + 1:
+                            fetch = start + 1
+                        else:
+                            branch_stalls[pc] += penalty
+                            fetch = start + penalty + 1
+                        pc = target
+                    else:
+                        fetch = start + 1
+                        pc += 1
+                elif kind == A_INSTRUCTION:
+                    A = operation
+                    ready_a = fetch + immediate_ready
+                    fetch += 1
+                    pc += 1
+                else:
+                    halted = True  # HALT
+                    fetch += 1
+                    break
+        finally:
+            cpu.A, cpu.D, cpu.PC = A, D, pc
+            cpu.cycles = start_cycles + cycle
+            self.fetch, self.ready_a, self.ready_d = fetch, ready_a, ready_d
+            self.instructions += cycle
+        return (halted, cycle)
+
+    # ===== Reading the results =====
+
+    def stall_totals(self):
+        """Stall cycles per cause"""
+        return {name: sum(stalls) for name, stalls in zip(CAUSES, self.stalls)}
+
+    def hot_spots(self, limit=20):
+        """
+        Addresses with the most stall cycles.
+
+        Returns:
+            List of dicts: pc, label, instruction, executed, stalls per
+            cause, total stall cycles and the address's CPI
+        """
+        words = self.cpu.rom.memory
+        code = self.cpu.code
+        totals = [sum(column) for column in zip(*self.stalls)]
+        ranked = sorted((pc for pc, total in enumerate(totals) if total), key=lambda pc: (-totals[pc], pc))
+        spots = []
+        for pc in ranked[:limit]:
+            executed = self.counts[pc]
+            spots.append({
+                "pc": pc,
+                "label": self.index.label_of(pc),
+                "instruction": c_mnemonic(words[pc]) if code[pc][0] == C_INSTRUCTION else f"@{words[pc]}",
+                "executed": executed,
+                "stalls": {name: stalls[pc] for name, stalls in zip(CAUSES, self.stalls) if stalls[pc]},
+                "total": totals[pc],
+                "cpi": (executed + totals[pc]) / executed if executed else 0.0,
+            })
+        return spots
+
+    def summary(self, limit=20):
+        """The timing results as a JSON-ready dict"""
+        stalls = self.stall_totals()
+        return {
+            "pipeline": self.config.describe(),
+            "predictor": self.predictor.direction.name if self.predictor else "not taken",
+            "instructions": self.instructions,
+            "cycles": self.cycles,
+            "cpi": self.cpi(),
+            "stalls": stalls,
+            "stall_cycles": sum(stalls.values()),
+            "taken_jumps": sum(self.taken),
+            "hot_spots": self.hot_spots(limit),
+        }
+
+    def report(self, limit=20):
+        """Readable summary: CPI, stalls by cause and the worst addresses"""
+        summary = self.summary(limit)
+        instructions = max(summary["instructions"], 1)
+        pipeline = summary["pipeline"]
+        lines = [f"Pipeline: {' '.join(pipeline['stages'])}  forwarding "
+                 f"{'on' if pipeline['forwarding'] else 'off'}, memory forwarding "
+                 f"{'on' if pipeline['memory_forwarding'] else 'off'}, predictor: "
+                 f"{summary['predictor']}",
+                 f"Instructions: {summary['instructions']:,}  cycles: {summary['cycles']:,}  "
+                 f"CPI: {summary['cpi']:.3f}",
+                 "",
+                 f"{'stall':<12} {'cycles':>12} {'per instr':>10}"]
+        for name, cycles in summary["stalls"].items():
+            lines.append(f"{name:<12} {cycles:>12,} {cycles / instructions:>10.3f}")
+        lines.append("")
+        lines.append(f"{'pc':>6}  {'label':<28} {'instruction':<12} {'executed':>10} {'stalls':>10} {'CPI':>6}  causes")
+        for spot in summary["hot_spots"]:
+            causes = ", ".join(f"{name} {cycles:,}" for name, cycles in spot["stalls"].items())
+            lines.append(f"{spot['pc']:>6}  {spot['label'][:28]:<28} {spot['instruction']:<12} "
+                         f"{spot['executed']:>10,} {spot['total']:>10,} {spot['cpi']:>6.2f}  {causes}")
+        return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pipeline timing (CPI, stalls, hazard hot spots) of a Hack program")
+    parser.add_argument("program", help=".asm, text .hack or binary image")
+    parser.add_argument("--pipeline", choices=sorted(PIPELINES), default="classic", help="pipeline to model")
+    parser.add_argument("--predictor", choices=sorted(PREDICTORS), help="branch predictor (default: not taken)")
+    parser.add_argument("--cycles", type=int, default=1_000_000, help="instructions to run")
+    parser.add_argument("--top", type=int, default=20, help="hot spots to list")
+    parser.add_argument("--json", metavar="FILE", help="write the results as JSON")
+    args = parser.parse_args(argv)
+
+    image = read_program(args.program)
+    cpu = CPU()
+    cpu.load_program_binary(image.words)
+    predictor = BranchPredictor(cpu, args.predictor) if args.predictor else None
+    model = PipelineModel(cpu, PIPELINES[args.pipeline], image.symbols, predictor)
+    model.run(max_cycles=args.cycles)
+    print(model.report(args.top))
+    if args.json:
+        model.save_json(args.json, args.top)
+        print(f"\nWrote timing results to {args.json}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,446 @@
+"""
+Predictors - Branch prediction measured on live Hack execution
+
+Jack code compiled by the 07/08 VM translator jumps constantly: D;JNE
+for if-goto, D;JEQ/JGT/JLT for comparisons, 0;JMP for goto, call and
+return. A BranchPredictor attached to a CPU (cpu.use_branch_predictor)
+sees every jump CPU.run executes and scores a direction predictor, a
+branch target buffer and a return-address stack against it.
+
+Jump sites are classified from the ROM words:
+- conditional:  any jump condition but JMP; the direction predictor
+                guesses taken/not taken, the BTB supplies the target
+- jump:         unconditional JMP; only the target is predicted (BTB)
+- call:         the 0;JMP ending the 08 call sequence (@LCL, M=D,
+                @function, 0;JMP); predicted by the BTB, and pushes the
+                return address (the next instruction) on the stack
+- return:       the 0;JMP ending the 08 return sequence (@R14, A=M,
+                0;JMP); predicted by popping the return-address stack
+
+A prediction is correct when the direction is right and, for a taken
+jump, the predicted target is the address jumped to. A jump to the next
+address counts as not taken (the fetch stream is the same).
+
+Direction predictors (PREDICTORS) share predict(pc, target) and
+update(pc, target, taken):
+- btfn:        static, backward taken / forward not taken
+- bimodal:     2-bit saturating counters indexed by PC
+- gshare:      2-bit counters indexed by PC xor the global history
+- tournament:  bimodal and gshare, with 2-bit choosers per PC
+
+Nothing is checked while no predictor is attached. Attaching one
+replaces the fused entries (see decoder.py) at jump sites with
+superinstructions that execute the jump and then call observe(), and
+wraps superinstructions whose last instruction jumps (see idioms.py)
+the same way. Loops are not fast-forwarded while a predictor is
+attached (every iteration's jump is seen, and stop_when_idle has no
+effect); intrinsics still run, and calls to them do not push a return
+address. step() and the JIT do not report jumps.
+
+Usage:
+    python predictors.py program.asm --predictor all --cycles 1000000
+
+    predictor = BranchPredictor(cpu, "gshare", labels=labels)
+    cpu.use_branch_predictor(predictor)
+    cpu.run(max_cycles=1_000_000)
+    print(predictor.report())
+"""
+
+import argparse
+import json
+import sys
+from collections import deque
+
+from cpu import CPU
+from decoder import C_INSTRUCTION, SUPERINSTRUCTION, INTRINSIC
+from image import read_program
+from reports import JSONReport, zeros
+from stats import c_mnemonic
+from symbols import LabelIndex
+
+SITE_KINDS = (None, "conditional", "jump", "call", "return")
+CONDITIONAL, JUMP, CALL, RETURN = range(1, 5)
+
+JMP = 0b1110101010000111    # 0;JMP
+A_EQUALS_M = 0b1111110000100000
+M_EQUALS_D = 0b1110001100001000
+LCL, R14 = 1, 14
+
+
+def classify(words, pc):
+    """Site kind of the jump at pc (CONDITIONAL, JUMP, CALL or RETURN)"""
+    word = words[pc]
+    if word & 0x7 != 0x7:
+        return CONDITIONAL
+    if word == JMP and pc >= 3:
+        if words[pc - 1] == A_EQUALS_M and words[pc - 2] == R14:
+            return RETURN
+        if words[pc - 1] < 0x8000 and words[pc - 2] == M_EQUALS_D and words[pc - 3] == LCL:
+            return CALL
+    return JUMP
+
+
+# ===== Direction predictors =====
+
+class StaticBTFN:
+    """Backward jumps (loops) taken, forward jumps not taken"""
+
+    name = "btfn"
+
+    def predict(self, pc, target):
+        return target <= pc
+
+    def update(self, pc, target, taken):
+        pass
+
+
+class Bimodal:
+    """2-bit saturating counters indexed by the low PC bits"""
+
+    name = "bimodal"
+
+    def __init__(self, bits=10):
+        self.mask = (1 << bits) - 1
+        self.counters = bytearray([1]) * (1 << bits)  # Weakly not taken
+
+    def predict(self, pc, target):
+        return self.counters[pc & self.mask] >= 2
+
+    def update(self, pc, target, taken):
+        index = pc & self.mask
+        counter = self.counters[index]
+        if taken:
+            if counter < 3:
+                self.counters[index] = counter + 1
+        elif counter:
+            self.counters[index] = counter - 1
+
+
+class GShare(Bimodal):
+    """2-bit counters indexed by the PC xor the last `bits` outcomes"""
+
+    name = "gshare"
+
+    def __init__(self, bits=12):
+        super().__init__(bits)
+        self.history = 0
+
+    def predict(self, pc, target):
+        return self.counters[(pc ^ self.history) & self.mask] >= 2
+
+    def update(self, pc, target, taken):
+        Bimodal.update(self, pc ^ self.history, target, taken)
+        self.history = ((self.history << 1) | taken) & self.mask
+
+
+class Tournament:
+    """Bimodal and gshare, picked per PC by 2-bit choosers (>= 2: gshare)"""
+
+    name = "tournament"
+
+    def __init__(self, bits=12):
+        self.bimodal = Bimodal(bits)
+        self.gshare = GShare(bits)
+        self.mask = (1 << bits) - 1
+        self.choosers = bytearray([1]) * (1 << bits)
+
+    def predict(self, pc, target):
+        if self.choosers[pc & self.mask] >= 2:
+            return self.gshare.predict(pc, target)
+        return self.bimodal.predict(pc, target)
+
+    def update(self, pc, target, taken):
+        bimodal_right = self.bimodal.predict(pc, target) == taken
+        gshare_right = self.gshare.predict(pc, target) == taken
+        if bimodal_right != gshare_right:
+            index = pc & self.mask
+            chooser = self.choosers[index]
+            if gshare_right and chooser < 3:
+                self.choosers[index] = chooser + 1
+            elif bimodal_right and chooser:
+                self.choosers[index] = chooser - 1
+        self.bimodal.update(pc, target, taken)
+        self.gshare.update(pc, target, taken)
+
+
+PREDICTORS = {"btfn": StaticBTFN, "bimodal": Bimodal, "gshare": GShare, "tournament": Tournament}
+
+
+# ===== Targets =====
+
+class BranchTargetBuffer:
+    """Direct-mapped PC -> last taken target"""
+
+    def __init__(self, entries=256):
+        self.entries = entries
+        self.tags = [-1] * entries
+        self.targets = [0] * entries
+
+    def lookup(self, pc):
+        """Predicted target, or None on a miss"""
+        index = pc % self.entries
+        return self.targets[index] if self.tags[index] == pc else None
+
+    def update(self, pc, target):
+        index = pc % self.entries
+        self.tags[index] = pc
+        self.targets[index] = target
+
+
+class ReturnStack:
+    """Return-address stack of fixed depth (the oldest entries are lost)"""
+
+    def __init__(self, depth=16):
+        self.stack = deque(maxlen=depth)
+
+    def push(self, address):
+        self.stack.append(address)
+
+    def pop(self):
+        return self.stack.pop() if self.stack else None
+
+
+# ===== Attaching to a CPU =====
+
+class BranchPredictor(JSONReport):
+    """
+    Scores a direction predictor, BTB and return-address stack on the
+    jumps a CPU executes.
+
+    Attributes:
+        direction: The direction predictor (PREDICTORS)
+        btb: BranchTargetBuffer
+        returns: ReturnStack
+        executed, taken, mispredicted: array('Q') per ROM address
+    """
+
+    def __init__(self, cpu, direction="gshare", btb_entries=256, ras_depth=16, labels=None):
+        """
+        Args:
+            cpu: CPU to observe (attach with cpu.use_branch_predictor)
+            direction: A PREDICTORS name or a predictor object
+            btb_entries: Branch target buffer size
+            ras_depth: Return-address stack depth
+            labels: Label -> ROM address, for reports per label
+        """
+        self.cpu = cpu
+        self.direction = PREDICTORS[direction]() if isinstance(direction, str) else direction
+        self.btb = BranchTargetBuffer(btb_entries)
+        self.returns = ReturnStack(ras_depth)
+        self.index = LabelIndex(labels or {})
+        self.kinds = bytearray()
+        self.kinds_version = None
+        self.fused = []
+        self.reset()
+
+    def reset(self):
+        """Clear the counts (the predictors keep their state)"""
+        size = self.cpu.rom.size
+        self.executed = zeros(size)
+        self.taken = zeros(size)
+        self.mispredicted = zeros(size)
+
+    def prepare(self):
+        """Classify the jump sites in ROM (once per program)"""
+        cpu = self.cpu
+        if self.kinds_version != cpu.rom.version:
+            words = cpu.rom.memory
+            kinds = bytearray(len(words))
+            for pc, word in enumerate(words):
+                if word >> 13 == 0b111 and word & 0x7 and word != 0xFFFF:
+                    kinds[pc] = classify(words, pc)
+            self.kinds = kinds
+            self.kinds_version = cpu.rom.version
+
+    def observe(self, pc, address, target):
+        """
+        Score the jump at pc, which went to target (pc + 1: not taken)
+        with A = address, and train the predictors.
+
+        Returns:
+            True if it was predicted correctly
+        """
+        kind = self.kinds[pc]
+        taken = target != pc + 1
+        self.executed[pc] += 1
+        if kind == RETURN:
+            correct = self.returns.pop() == target
+        else:
+            if kind == CONDITIONAL:
+                direction = self.direction
+                guess = direction.predict(pc, address)
+                direction.update(pc, address, taken)
+                correct = guess == taken and (not taken or self.btb.lookup(pc) == target)
+            else:
+                correct = self.btb.lookup(pc) == target
+                if kind == CALL and not (target < len(self.fused) and self.fused[target][0] == INTRINSIC):
+                    self.returns.push(pc + 1)
+            if taken:
+                self.btb.update(pc, target)
+        if taken:
+            self.taken[pc] += 1
+        if not correct:
+            self.mispredicted[pc] += 1
+        return correct
+
+    def install(self, code, fused):
+        """Wrap the fused entries that jump so they report to observe()"""
+        self.prepare()
+        self.fused = fused
+        kinds = self.kinds
+        for pc in range(len(code)):
+            entry = fused[pc]
+            if entry[0] == C_INSTRUCTION and kinds[pc]:
+                fused[pc] = (SUPERINSTRUCTION, self._jump(pc, entry), 1, "branch")
+            elif entry[0] == SUPERINSTRUCTION and kinds[pc + entry[2] - 1]:
+                fused[pc] = (SUPERINSTRUCTION, self._sequence(pc + entry[2] - 1, entry[1]),
+                             entry[2], entry[3])
+
+    def _jump(self, pc, entry):
+        """A jump instruction as a one-instruction superinstruction"""
+        _, operation, use_m, dest, jump = entry
+        cpu = self.cpu
+        read_limit, write_limit, load, store = cpu.read_limit, cpu.write_limit, cpu.load, cpu.store
+        observe = self.observe
+        following = pc + 1
+
+        def run(A, D, M):
+            if use_m:
+                result = operation(D, M[A] if A < read_limit else load(A))
+            else:
+                result = operation(D, A)
+            if dest & 0x4:
+                A = result
+            if dest & 0x2:
+                D = result
+            if dest & 0x1:
+                if A < write_limit:
+                    M[A] = result
+                else:
+                    store(A, result)
+            target = A if jump(result) else following
+            observe(pc, A, target)
+            return A, D, target
+        return run
+
+    def _sequence(self, last, function):
+        """A superinstruction whose last instruction (at last) jumps"""
+        observe = self.observe
+
+        def run(A, D, M):
+            A, D, target = function(A, D, M)
+            observe(last, A, target)
+            return A, D, target
+        return run
+
+    # ===== Reading the results =====
+
+    def totals(self):
+        """Executed and mispredicted jumps per site kind, plus "all" """
+        totals = {name: {"executed": 0, "mispredicted": 0} for name in SITE_KINDS[1:]}
+        for pc, executed in enumerate(self.executed):
+            if executed:
+                row = totals[SITE_KINDS[self.kinds[pc]]]
+                row["executed"] += executed
+                row["mispredicted"] += self.mispredicted[pc]
+        executed = sum(row["executed"] for row in totals.values())
+        mispredicted = sum(row["mispredicted"] for row in totals.values())
+        totals["all"] = {"executed": executed, "mispredicted": mispredicted}
+        for row in totals.values():
+            row["accuracy"] = 1 - row["mispredicted"] / row["executed"] if row["executed"] else 1.0
+        return totals
+
+    def sites(self, limit=20):
+        """Jump sites with the most mispredictions, as dicts"""
+        words = self.cpu.rom.memory
+        ranked = sorted((pc for pc, executed in enumerate(self.executed) if executed),
+                        key=lambda pc: (-self.mispredicted[pc], -self.executed[pc], pc))
+        return [{"pc": pc, "label": self.index.label_of(pc), "instruction": c_mnemonic(words[pc]),
+                 "kind": SITE_KINDS[self.kinds[pc]], "executed": self.executed[pc],
+                 "taken": self.taken[pc], "mispredicted": self.mispredicted[pc],
+                 "accuracy": 1 - self.mispredicted[pc] / self.executed[pc]}
+                for pc in ranked[:limit]]
+
+    def labels(self, limit=20):
+        """Jumps and mispredictions summed per label, most mispredictions first"""
+        rows = {}
+        for pc, executed in enumerate(self.executed):
+            if executed:
+                row = rows.setdefault(self.index.label_of(pc), [0, 0])
+                row[0] += executed
+                row[1] += self.mispredicted[pc]
+        ranked = sorted(rows.items(), key=lambda item: (-item[1][1], -item[1][0], item[0]))
+        return [{"label": label, "executed": executed, "mispredicted": mispredicted,
+                 "accuracy": 1 - mispredicted / executed}
+                for label, (executed, mispredicted) in ranked[:limit]]
+
+    def summary(self, limit=20):
+        """The results as a JSON-ready dict"""
+        return {
+            "predictor": self.direction.name,
+            "btb_entries": self.btb.entries,
+            "ras_depth": self.returns.stack.maxlen,
+            "jumps": self.totals(),
+            "sites": self.sites(limit),
+            "labels": self.labels(limit),
+        }
+
+    def report(self, limit=20):
+        """Readable summary: accuracy per site kind, worst sites and labels"""
+        summary = self.summary(limit)
+        lines = [f"Predictor: {summary['predictor']}  BTB {summary['btb_entries']} entries, "
+                 f"return stack {summary['ras_depth']}",
+                 "",
+                 f"{'jumps':<12} {'executed':>12} {'mispredicted':>13} {'accuracy':>9}"]
+        for name, row in summary["jumps"].items():
+            lines.append(f"{name:<12} {row['executed']:>12,} {row['mispredicted']:>13,} "
+                         f"{100 * row['accuracy']:>8.1f}%")
+        lines.append("")
+        lines.append(f"{'pc':>6}  {'label':<28} {'instruction':<10} {'kind':<12} {'executed':>10} "
+                     f"{'taken':>7} {'accuracy':>9}")
+        for site in summary["sites"]:
+            lines.append(f"{site['pc']:>6}  {site['label'][:28]:<28} {site['instruction']:<10} "
+                         f"{site['kind']:<12} {site['executed']:>10,} "
+                         f"{100 * site['taken'] / site['executed']:>6.1f}% {100 * site['accuracy']:>8.1f}%")
+        lines.append("")
+        lines.append(f"{'label':<36} {'executed':>10} {'mispredicted':>13} {'accuracy':>9}")
+        for row in summary["labels"]:
+            lines.append(f"{row['label'][:36]:<36} {row['executed']:>10,} {row['mispredicted']:>13,} "
+                         f"{100 * row['accuracy']:>8.1f}%")
+        return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Branch predictor accuracy on a Hack program")
+    parser.add_argument("program", help=".asm, text .hack or binary image")
+    parser.add_argument("--predictor", choices=sorted(PREDICTORS) + ["all"], default="all",
+                        help="direction predictor (all: compare every predictor)")
+    parser.add_argument("--cycles", type=int, default=1_000_000, help="cycles to run")
+    parser.add_argument("--btb", type=int, default=256, help="branch target buffer entries")
+    parser.add_argument("--ras", type=int, default=16, help="return-address stack depth")
+    parser.add_argument("--top", type=int, default=20, help="rows per table")
+    parser.add_argument("--json", metavar="FILE", help="write the results as JSON")
+    args = parser.parse_args(argv)
+
+    image = read_program(args.program)
+    names = sorted(PREDICTORS) if args.predictor == "all" else [args.predictor]
+    results = {}
+    for index, name in enumerate(names):
+        cpu = CPU()
+        cpu.load_program_binary(image.words)
+        predictor = BranchPredictor(cpu, name, args.btb, args.ras, image.symbols)
+        cpu.use_branch_predictor(predictor)
+        cpu.run(max_cycles=args.cycles)
+        if index:
+            print()
+        print(predictor.report(args.top))
+        results[name] = predictor.summary(args.top)
+    if args.json:
+        with open(args.json, "w") as f:
+            f.write(json.dumps(results, indent=2) + "\n")
+        print(f"\nWrote predictor results to {args.json}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
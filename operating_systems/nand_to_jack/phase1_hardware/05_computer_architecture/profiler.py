@@ -0,0 +1,189 @@
+"""
+Profiler - Per-PC execution counts and label/function hotspot reports
+
+The profiler counts with counting.py's ExecutionCounter, which drives
+a CPU through its own run loop, so CPU.run keeps its speed and nothing
+is counted unless a profiler is used. Counts go into a preallocated
+array with one slot per ROM address. A superinstruction (see
+idioms.py) is counted once, at its start, and spread over the
+instructions it stands for when counts are read.
+
+Labels come from the 06 assembler's symbol table (SymbolTable.labels):
+- label level:    each PC belongs to the nearest label at or before it
+- function level: the nearest VM function entry (a label with a dot and
+                  no '$', e.g. Foo.bar), so Foo.bar$loop, the
+                  comparison labels and return points inside Foo.bar
+                  all count towards Foo.bar
+
+For flamegraphs the profiler keeps a shadow call stack: a jump to a
+function entry pushes it, and a jump back to the address just after
+that jump (where the VM translator puts the return label) with SP
+below its value after the call pops it. (SP tells the two apart when
+a return point is also the next function's entry.)
+collapsed() gives one "outer;inner;leaf cycles" line per stack, the
+format flamegraph.pl, speedscope and inferno read.
+
+Usage:
+    python profiler.py program.asm --cycles 1000000 --collapsed out.folded
+
+    binary, labels = assemble_with_labels("Prog.asm")
+    cpu = CPU()
+    cpu.load_program(binary)
+    profiler = Profiler(cpu, labels)
+    profiler.run(max_cycles=1_000_000)
+    print(profiler.report())
+"""
+
+import argparse
+import sys
+
+from cpu import CPU
+from counting import ExecutionCounter
+from symbols import LabelIndex, assemble_with_labels
+
+class Profiler(ExecutionCounter):
+    """
+    Counts instructions executed per ROM address while running a CPU
+    (see counting.py) and follows calls and returns for flamegraphs.
+
+    Attributes:
+        stacks: Shadow call stack (tuple of function names) -> cycles
+        stack: The current shadow call stack
+    """
+
+    def __init__(self, cpu, labels=None):
+        self.set_labels(labels or {})
+        super().__init__(cpu)
+        self.jumped = self._jumped
+
+    def set_labels(self, labels):
+        """Use labels (name -> ROM address) for aggregation and call tracking"""
+        self.index = LabelIndex(labels)
+        self.labels = self.index.labels
+        self.entries = self.index.entries
+
+    def reset(self):
+        """Clear all counts"""
+        super().reset()
+        self.stacks = {}
+        self.stack = (self.function_of(self.cpu.PC),)
+        self.return_points = []  # (address after the call, SP after it), innermost last
+        self.stack_start = 0     # Cycle of the current run the stack was entered at
+
+    def run(self, max_cycles=1000):
+        """
+        Run the CPU while counting and tracking the call stack (same
+        contract as CPU.run, including superinstructions and check hooks).
+
+        Returns:
+            Tuple (halted, cycles_executed)
+        """
+        self.stack_start = 0
+        before = self.cycles
+        try:
+            return super().run(max_cycles)
+        finally:
+            self._charge(self.cycles - before)
+
+    def _charge(self, cycle):
+        """Add the cycles since the stack was entered to the current stack"""
+        if cycle > self.stack_start:
+            self.stacks[self.stack] = self.stacks.get(self.stack, 0) + cycle - self.stack_start
+        self.stack_start = cycle
+
+    def _jumped(self, next_pc, target, cycle):
+        return_points = self.return_points
+        sp = self.cpu.ram.memory[0]
+        if return_points and target == return_points[-1][0] and sp < return_points[-1][1]:
+            self._charge(cycle)
+            return_points.pop()
+            self.stack = self.stack[:-1]
+        elif target in self.entries:
+            self._charge(cycle)
+            return_points.append((next_pc, sp))
+            self.stack = self.stack + (self.entries[target],)
+
+    # ===== Reading the counts =====
+
+    def label_of(self, pc):
+        return self.index.label_of(pc)
+
+    def function_of(self, pc):
+        return self.index.function_of(pc)
+
+    def _aggregate(self, key):
+        totals = {}
+        for pc, count in enumerate(self.instruction_counts()):
+            if count:
+                name = key(pc)
+                totals[name] = totals.get(name, 0) + count
+        return sorted(totals.items(), key=lambda item: (-item[1], item[0]))
+
+    def by_label(self):
+        """List of (label, cycles), most expensive first"""
+        return self._aggregate(self.label_of)
+
+    def by_function(self):
+        """List of (function, cycles), most expensive first"""
+        return self._aggregate(self.function_of)
+
+    def hotspots(self, limit=20):
+        """List of (pc, count, label) for the most executed addresses"""
+        counts = self.instruction_counts()
+        top = sorted((pc for pc in range(len(counts)) if counts[pc]),
+                     key=lambda pc: (-counts[pc], pc))[:limit]
+        return [(pc, counts[pc], self.label_of(pc)) for pc in top]
+
+    def collapsed(self):
+        """Collapsed stacks, one "frame;frame;frame cycles" line per stack"""
+        return [f"{';'.join(stack)} {cycles}"
+                for stack, cycles in sorted(self.stacks.items(), key=lambda item: -item[1])]
+
+    def save_collapsed(self, path):
+        with open(path, "w") as f:
+            f.write("\n".join(self.collapsed()) + "\n")
+
+    def report(self, limit=20):
+        """Hotspot report as text: functions, labels and single addresses"""
+        total = max(self.cycles, 1)
+        lines = [f"Profiled cycles: {self.cycles:,}"]
+        for title, rows in (("Function", self.by_function()), ("Label", self.by_label())):
+            lines.append("")
+            lines.append(f"{title:<40} {'cycles':>12} {'%':>6}")
+            for name, cycles in rows[:limit]:
+                lines.append(f"{name:<40} {cycles:>12,} {100 * cycles / total:>5.1f}%")
+        lines.append("")
+        lines.append(f"{'PC':>6} {'count':>12}  label")
+        for pc, count, label in self.hotspots(limit):
+            offset = pc - self.labels[label] if label in self.labels else pc
+            lines.append(f"{pc:>6} {count:>12,}  {label}+{offset}")
+        return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Profile a Hack program")
+    parser.add_argument("program", help=".asm file (labels are read from it) or .hack file")
+    parser.add_argument("--cycles", type=int, default=1_000_000, help="cycles to run")
+    parser.add_argument("--top", type=int, default=20, help="rows per table")
+    parser.add_argument("--collapsed", metavar="FILE", help="write collapsed stacks for flamegraphs")
+    args = parser.parse_args(argv)
+
+    if args.program.endswith(".asm"):
+        binary, labels = assemble_with_labels(args.program)
+    else:
+        with open(args.program) as f:
+            binary, labels = [line.strip() for line in f if line.strip()], {}
+
+    cpu = CPU()
+    cpu.load_program(binary)
+    profiler = Profiler(cpu, labels)
+    profiler.run(max_cycles=args.cycles)
+    print(profiler.report(args.top))
+    if args.collapsed:
+        profiler.save_collapsed(args.collapsed)
+        print(f"\nWrote collapsed stacks to {args.collapsed}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
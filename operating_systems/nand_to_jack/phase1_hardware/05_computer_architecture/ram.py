@@ -2,12 +2,19 @@
 RAM (Random Access Memory) - Data storage
 """
 
+from array import array
+
+
 class RAM:
     """
     Random Access Memory for the Hack computer.
 
     Provides addressable storage for data during program execution.
     Supports read and write operations at any valid address.
+
+    Words live in an array('H') (unsigned 16-bit), so `memory` can be
+    indexed directly by code that has already checked the address (the
+    CPU's run loops) and copied in bulk with slices or buffers.
     """
 
     def __init__(self, size=32768):
@@ -18,7 +25,7 @@ class RAM:
             size: Number of 16-bit words (default: 32768 = 32K)
         """
         self.size = size
-        self.memory = [0] * size
+        self.memory = array('H', bytes(2 * size))
 
     def read(self, address):
         """
@@ -53,6 +60,49 @@ class RAM:
         """Allow array-style assignment: ram[address] = value"""
         self.write(address, value)
 
+    def _clip(self, start, end):
+        """Clamp [start, end) to the valid address range"""
+        start = max(start, 0)
+        end = self.size if end is None else min(end, self.size)
+        return start, max(start, end)
+
+    def load_range(self, start, values):
+        """
+        Copy a block of words into memory starting at start.
+
+        Args:
+            start: First address to write
+            values: array('H') (copied as is) or any iterable of ints
+                    (masked to 16 bits); words past the end are dropped
+
+        Returns:
+            Number of words written
+        """
+        if not (isinstance(values, array) and values.typecode == 'H'):
+            values = array('H', [value & 0xFFFF for value in values])
+        start, end = self._clip(start, start + len(values))
+        self.memory[start:end] = values[:end - start]
+        return end - start
+
+    def dump_range(self, start=0, length=None):
+        """
+        Copy a block of words out of memory.
+
+        Args:
+            start: First address to read
+            length: Number of words (default: up to the end of RAM)
+
+        Returns:
+            array('H') with the words (shorter if it runs past the end)
+        """
+        start, end = self._clip(start, None if length is None else start + length)
+        return self.memory[start:end]
+
+    def fill(self, value=0, start=0, end=None):
+        """Set every word in [start, end) to value"""
+        start, end = self._clip(start, end)
+        self.memory[start:end] = array('H', [value & 0xFFFF]) * (end - start)
+
     def reset(self):
-        """Clear all memory to zero"""
-        self.memory = [0] * self.size
+        """Clear all memory to zero (in place, so `memory` stays the same object)"""
+        self.fill(0)
@@ -0,0 +1,362 @@
+"""
+Replay - Deterministic record/replay of Hack runs
+
+The keyboard is a Hack program's only non-deterministic input. A
+Recorder sits between the CPU and the Keyboard and logs every KBD read
+whose value differs from the read before it, as (read ordinal, cycle,
+value). Replaying hands the same values to the same reads, so the
+replayed run matches the recorded one instruction for instruction,
+whatever the wall clock did.
+
+Every checkpoint_interval cycles the recorder also keeps a compressed
+snapshot (see snapshot.py) and the number of KBD reads so far.
+Replayer.seek(cycle) restores the last checkpoint at or before cycle
+and re-executes from there, so any moment of a long session is at most
+one interval of execution away. Replayer.bisect() builds on seek to
+find the first cycle at which a condition holds.
+
+Checkpoints are taken by a check hook (see CPU.add_check_hook), so they
+land on check points and recording adds nothing to the run loop. The
+cycle stamp of a KBD read is exact when tracing and otherwise the cycle
+of the last check point before it; replay matches reads by ordinal, so
+this does not affect determinism.
+
+With trace=True, Recorder.run() executes one instruction at a time and
+appends each one to a trace of little-endian u16 words:
+
+    PC                            no RAM write
+    PC | 0x8000, address, value   wrote value to RAM[address]
+
+File format (see Recording.save/load), header integers big-endian:
+
+    b"HACKRPLY" version:u16 start:u64 end:u64
+    events:u32 checkpoints:u32 trace_length:u32
+    events x (read:u32 cycle:u64 value:u16)
+    checkpoints x (cycle:u64 reads:u32 length:u32 snapshot bytes)
+    zlib(trace words)
+
+Usage:
+    recorder = Recorder(cpu, keyboard, checkpoint_interval=1_000_000)
+    cpu.run(...)                            # or recorder.run(...) to trace
+    recorder.stop().save("session.rec")
+
+    replayer = Replayer(Recording.load("session.rec"))
+    replayer.seek(123_456_789)
+    first = replayer.bisect(lambda cpu: cpu.ram[16] > 100)
+
+    python replay.py session.rec --seek 1000000 --trace 20
+"""
+
+import argparse
+import bisect
+import struct
+import sys
+import zlib
+from array import array
+
+from cpu import CPU
+from decoder import C_INSTRUCTION
+from devices import KBD_ADDRESS
+from snapshot import Snapshot, to_little_endian, from_little_endian
+
+MAGIC = b"HACKRPLY"
+FORMAT_VERSION = 1
+HEADER = struct.Struct(">8sHQQIII")
+EVENT = struct.Struct(">IQH")
+CHECKPOINT = struct.Struct(">QII")
+WRITE_FLAG = 0x8000
+
+
+class Recording:
+    """KBD inputs, checkpoints and (optionally) the trace of one run"""
+
+    def __init__(self, start=0, end=0, events=None, checkpoints=None, trace=None):
+        self.start = start                  # cpu.cycles when recording started
+        self.end = end                      # cpu.cycles when it stopped
+        self.events = events or []          # (read ordinal, cycle, value), one per change
+        self.checkpoints = checkpoints or []  # (cycle, reads, Snapshot bytes), by cycle
+        self.trace = trace                  # array('H') (see module docstring) or None
+
+    def trace_records(self):
+        """
+        Decode the trace.
+
+        Yields:
+            (cycle, pc, address, value) per instruction; address and
+            value are None if it did not write RAM
+        """
+        trace = self.trace or ()
+        cycle = self.start
+        i = 0
+        while i < len(trace):
+            word = trace[i]
+            if word & WRITE_FLAG:
+                yield cycle, word & ~WRITE_FLAG, trace[i + 1], trace[i + 2]
+                i += 3
+            else:
+                yield cycle, word, None, None
+                i += 1
+            cycle += 1
+
+    def to_bytes(self):
+        trace = zlib.compress(to_little_endian(self.trace)) if self.trace is not None else b""
+        parts = [HEADER.pack(MAGIC, FORMAT_VERSION, self.start, self.end,
+                             len(self.events), len(self.checkpoints), len(trace))]
+        parts.extend(EVENT.pack(*event) for event in self.events)
+        for cycle, reads, data in self.checkpoints:
+            parts.append(CHECKPOINT.pack(cycle, reads, len(data)))
+            parts.append(data)
+        parts.append(trace)
+        return b"".join(parts)
+
+    @classmethod
+    def from_bytes(cls, data):
+        magic, version, start, end, events, checkpoints, trace_length = HEADER.unpack_from(data)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError("Not a Hack recording (or an unsupported version)")
+        offset = HEADER.size
+        recording = cls(start, end)
+        for _ in range(events):
+            recording.events.append(EVENT.unpack_from(data, offset))
+            offset += EVENT.size
+        for _ in range(checkpoints):
+            cycle, reads, length = CHECKPOINT.unpack_from(data, offset)
+            offset += CHECKPOINT.size
+            recording.checkpoints.append((cycle, reads, bytes(data[offset:offset + length])))
+            offset += length
+        if trace_length:
+            recording.trace = from_little_endian(zlib.decompress(data[offset:offset + trace_length]))
+        return recording
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            f.write(self.to_bytes())
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            return cls.from_bytes(f.read())
+
+
+class Recorder:
+    """
+    Records a CPU's KBD reads and checkpoints while it runs.
+
+    Takes the keyboard's place in cpu.devices (same base, so the fast
+    paths are unchanged) until stop().
+    """
+
+    READS = True
+    WRITES = False
+
+    def __init__(self, cpu, keyboard, checkpoint_interval=1_000_000, trace=False):
+        self.cpu = cpu
+        self.keyboard = keyboard
+        self.base = keyboard.base
+        self.size = keyboard.size
+        self.checkpoint_interval = checkpoint_interval
+        self.recording = Recording(start=cpu.cycles, trace=array('H') if trace else None)
+        self.reads = 0
+        self.last = 0  # Value of the previous read (a replay starts from 0 too)
+
+        cpu.devices[cpu.devices.index(keyboard)] = self
+        self._checkpoint()
+        cpu.add_check_hook(self._check)
+
+    # ===== Device interface =====
+
+    def read(self, address):
+        value = self.keyboard.read(address)
+        if value != self.last:
+            self.recording.events.append((self.reads, self.cpu.cycles, value))
+            self.last = value
+        self.reads += 1
+        return value
+
+    def reset(self):
+        self.keyboard.reset()
+
+    # ===== Recording =====
+
+    def _checkpoint(self):
+        cpu = self.cpu
+        self.recording.checkpoints.append((cpu.cycles, self.reads, cpu.snapshot().to_bytes()))
+        self.next_checkpoint = cpu.cycles + self.checkpoint_interval
+
+    def _check(self, cpu):
+        if cpu.cycles >= self.next_checkpoint:
+            self._checkpoint()
+        return False
+
+    def run(self, max_cycles=1000):
+        """CPU.run, or with trace=True an instruction-at-a-time run that fills the trace"""
+        if self.recording.trace is None:
+            return self.cpu.run(max_cycles=max_cycles)
+
+        cpu = self.cpu
+        cpu.ensure_decoded()
+        code = cpu.code
+        memory = cpu.ram.memory
+        ram_size = cpu.ram.size
+        rom_size = cpu.rom.size
+        trace = self.recording.trace
+        execute = cpu.execute
+        for cycle in range(max_cycles):
+            pc = cpu.PC
+            if pc >= rom_size:
+                return (False, cycle)
+            if cpu.cycles >= self.next_checkpoint:
+                self._checkpoint()
+            entry = code[pc]
+            running = execute(entry)  # cpu.cycles is still this instruction's cycle
+            cpu.cycles += 1
+            if entry[0] == C_INSTRUCTION and entry[3] & 0x1 and cpu.A < ram_size:
+                trace.extend((pc | WRITE_FLAG, cpu.A, memory[cpu.A]))
+            else:
+                trace.append(pc)
+            if not running:
+                return (True, cycle + 1)
+        return (False, max_cycles)
+
+    def stop(self):
+        """Stop recording and give the keyboard back; returns the Recording"""
+        cpu = self.cpu
+        cpu.remove_check_hook(self._check)
+        cpu.devices[cpu.devices.index(self)] = self.keyboard
+        self.recording.end = cpu.cycles
+        return self.recording
+
+
+class InputPlayer:
+    """KBD device that gives each read its recorded value"""
+
+    READS = True
+    WRITES = False
+
+    def __init__(self, events, base=KBD_ADDRESS):
+        self.events = events
+        self.ordinals = [read for read, _, _ in events]
+        self.base = base
+        self.size = 1
+        self.seek(0)
+
+    def seek(self, reads):
+        """Continue as if reads reads had been made"""
+        self.next = bisect.bisect_left(self.ordinals, reads)
+        self.current = self.events[self.next - 1][2] if self.next else 0
+        self.reads = reads
+
+    def read(self, address):
+        if self.next < len(self.ordinals) and self.ordinals[self.next] == self.reads:
+            self.current = self.events[self.next][2]
+            self.next += 1
+        self.reads += 1
+        return self.current
+
+    def reset(self):
+        self.seek(0)
+
+
+class Replayer:
+    """
+    Re-executes a Recording on a CPU, with random access by cycle.
+
+    The CPU's keyboard (any reading device at the KBD address) is
+    replaced by an InputPlayer; without a CPU, one matching the
+    recording's memory sizes is created.
+    """
+
+    def __init__(self, recording, cpu=None, jit=False):
+        if not recording.checkpoints:
+            raise ValueError("Recording has no checkpoints")
+        self.recording = recording
+        self.checkpoint_cycles = [cycle for cycle, _, _ in recording.checkpoints]
+        self.cached = (None, None)  # (checkpoint index, decoded Snapshot)
+        first = self._snapshot(0)
+        self.cpu = cpu or CPU(rom_size=len(first.rom), ram_size=len(first.ram), jit=jit)
+        self.player = InputPlayer(recording.events)
+        for i, device in enumerate(self.cpu.devices):
+            if device.READS and device.base == self.player.base:
+                self.cpu.devices[i] = self.player
+                break
+        else:
+            self.cpu.map_device(self.player)
+        self.position = None  # Cycle the CPU was last brought to by seek()
+
+    def _snapshot(self, index):
+        if self.cached[0] != index:
+            self.cached = (index, Snapshot.from_bytes(self.recording.checkpoints[index][2]))
+        return self.cached[1]
+
+    def seek(self, cycle):
+        """
+        Bring the CPU to its recorded state at cycle (clamped to the
+        recording). Runs forward from the current state when that is
+        closer than the nearest checkpoint.
+
+        Returns:
+            Cycles re-executed
+        """
+        cpu = self.cpu
+        cycle = max(self.recording.start, min(cycle, self.recording.end))
+        index = bisect.bisect_right(self.checkpoint_cycles, cycle) - 1
+        checkpoint_cycle, reads, _ = self.recording.checkpoints[index]
+        if not (self.position is not None and cpu.cycles == self.position
+                and checkpoint_cycle <= self.position <= cycle):
+            cpu.restore(self._snapshot(index))
+            self.player.seek(reads)
+        executed = 0
+        if cycle > cpu.cycles:
+            _, executed = cpu.run(max_cycles=cycle - cpu.cycles)
+        self.position = cpu.cycles
+        return executed
+
+    def bisect(self, predicate, low=None, high=None):
+        """
+        First cycle in [low, high] at which predicate(cpu) holds,
+        assuming it stays true once it does; None if it never holds.
+        Leaves the CPU at that cycle.
+        """
+        low = self.recording.start if low is None else low
+        high = self.recording.end if high is None else high
+        self.seek(high)
+        if not predicate(self.cpu):
+            return None
+        while low < high:
+            middle = (low + high) // 2
+            self.seek(middle)
+            if predicate(self.cpu):
+                high = middle
+            else:
+                low = middle + 1
+        self.seek(low)
+        return low
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect and replay a recorded Hack run")
+    parser.add_argument("recording", help="file written by Recording.save")
+    parser.add_argument("--seek", type=int, metavar="CYCLE", help="replay to CYCLE and print the registers")
+    parser.add_argument("--trace", type=int, metavar="N", help="print the first N trace records")
+    args = parser.parse_args(argv)
+
+    recording = Recording.load(args.recording)
+    print(f"Cycles {recording.start:,} - {recording.end:,}, {len(recording.events)} KBD changes, "
+          f"{len(recording.checkpoints)} checkpoints, "
+          f"trace: {'none' if recording.trace is None else f'{len(recording.trace):,} words'}")
+    if args.trace:
+        for n, (cycle, pc, address, value) in enumerate(recording.trace_records()):
+            if n >= args.trace:
+                break
+            write = f"  RAM[{address}] = {value}" if address is not None else ""
+            print(f"{cycle:>12}  PC {pc:>5}{write}")
+    if args.seek is not None:
+        replayer = Replayer(recording)
+        executed = replayer.seek(args.seek)
+        cpu = replayer.cpu
+        print(f"At cycle {cpu.cycles:,} ({executed:,} re-executed): A={cpu.A} D={cpu.D} PC={cpu.PC}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,26 @@
+"""
+Reports - Helpers shared by the measurement modules
+
+stats.py, pipeline.py and predictors.py keep per-ROM-address counters
+in flat array('Q') tables (zeros) and export their summary() dicts as
+JSON (JSONReport).
+"""
+
+import json
+from array import array
+
+
+def zeros(size):
+    """array('Q') of size zeros"""
+    return array('Q', bytes(8 * size))
+
+
+class JSONReport:
+    """to_json and save_json for a class with summary(limit) -> JSON-ready dict"""
+
+    def to_json(self, limit=20):
+        return json.dumps(self.summary(limit), indent=2)
+
+    def save_json(self, path, limit=20):
+        with open(path, "w") as f:
+            f.write(self.to_json(limit) + "\n")
@@ -2,6 +2,10 @@
 ROM (Read-Only Memory) - Instruction storage
 """
 
+import sys
+from array import array
+
+
 class ROM:
     """
     Read-Only Memory for the Hack computer.
@@ -9,6 +13,8 @@ class ROM:
     Stores program instructions loaded at initialization.
     In real hardware, ROM cannot be modified during execution,
     but we allow loading programs for simulation purposes.
+
+    Words live in an array('H'), filled with slice copies.
     """
 
     def __init__(self, size=32768):
@@ -19,7 +25,8 @@ class ROM:
             size: Number of 16-bit instruction words (default: 32768 = 32K)
         """
         self.size = size
-        self.memory = [0] * size
+        self.memory = array('H', bytes(2 * size))
+        self.version = 0  # Bumped on every change so decoded copies can be invalidated
 
     def load_program(self, binary_instructions):
         """
@@ -28,22 +35,58 @@ class ROM:
         Args:
             binary_instructions: List of 16-bit binary strings (e.g., ["0000000000000000", "1110110000010000"])
         """
-        for i, instruction in enumerate(binary_instructions):
-            if i >= self.size:
-                break
-            self.memory[i] = int(instruction, 2)
+        words = array('H', [int(instruction, 2) for instruction in binary_instructions[:self.size]])
+        self.load_range(0, words)
 
     def load_program_binary(self, instructions):
         """
-        Load program into ROM from integer values.
+        Load program into ROM from integer values or a buffer.
 
         Args:
-            instructions: List of 16-bit integers
+            instructions: List of 16-bit integers, an array('H'), or any
+                          buffer (bytes, memoryview, mmap) of
+                          little-endian 16-bit words, which is copied in
+                          with one frombytes call
         """
-        for i, instruction in enumerate(instructions):
-            if i >= self.size:
-                break
-            self.memory[i] = instruction & 0xFFFF
+        if not isinstance(instructions, (array, list, tuple)):
+            try:
+                view = memoryview(instructions)
+            except TypeError:
+                pass
+            else:
+                words = array('H')
+                with view:
+                    words.frombytes(view.cast('B'))
+                if sys.byteorder == "big":
+                    words.byteswap()
+                instructions = words
+        self.load_range(0, instructions)
+
+    def load_range(self, start, values):
+        """
+        Copy a block of instruction words into ROM starting at start.
+
+        Args:
+            start: First address to write
+            values: array('H') (copied as is) or any iterable of ints
+                    (masked to 16 bits); words past the end are dropped
+
+        Returns:
+            Number of words written
+        """
+        if not (isinstance(values, array) and values.typecode == 'H'):
+            values = array('H', [value & 0xFFFF for value in values])
+        start = max(start, 0)
+        end = max(start, min(start + len(values), self.size))
+        self.memory[start:end] = values[:end - start]
+        self.version += 1
+        return end - start
+
+    def dump_range(self, start=0, length=None):
+        """Copy a block of instruction words out of ROM as an array('H')"""
+        start = max(start, 0)
+        end = self.size if length is None else min(start + length, self.size)
+        return self.memory[start:max(start, end)]
 
     def fetch(self, address):
         """
@@ -64,5 +107,6 @@ class ROM:
         return self.fetch(address)
 
     def reset(self):
-        """Clear all instructions to zero"""
-        self.memory = [0] * self.size
+        """Clear all instructions to zero (in place)"""
+        self.memory[:] = array('H', bytes(2 * self.size))
+        self.version += 1
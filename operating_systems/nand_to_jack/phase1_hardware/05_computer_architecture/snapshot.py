@@ -0,0 +1,149 @@
+"""
+Snapshot - Saved CPU state for fast restore
+
+A snapshot holds the registers, the cycle counter and copies of RAM and
+ROM. Restoring is page-granular: RAM is compared with the snapshot one
+PAGE_WORDS page at a time (a C-level bytes comparison) and only the
+pages that differ are copied back. A test that touches a few stack and
+heap pages after booting restores in microseconds instead of
+rebuilding a CPU and re-running the boot code.
+
+ROM is only reloaded (and re-predecoded) when its contents differ, so
+restoring into a CPU running the same program keeps its decoded entries,
+superinstructions and JIT blocks.
+
+Devices are not part of a snapshot. Writing devices are told about
+restored pages in their address range with invalidate(start, end) (the
+Screen then redraws those words).
+
+File format (see save/load), all integers big-endian:
+
+    b"HACKSNAP" version:u16 A:u16 D:u16 PC:u16 cycles:u64
+    ram_words:u32 rom_words:u32 ram_length:u32 rom_length:u32
+    zlib(RAM words, little-endian) zlib(ROM words, little-endian)
+
+Usage:
+    cpu.load_program(binary)
+    cpu.run(max_cycles=boot_cycles)
+    booted = cpu.snapshot()
+    for case in cases:
+        cpu.restore(booted)
+        ...
+    booted.save("booted.snap")
+"""
+
+import struct
+import sys
+import zlib
+from array import array
+
+PAGE_WORDS = 256
+MAGIC = b"HACKSNAP"
+FORMAT_VERSION = 1
+HEADER = struct.Struct(">8sHHHHQIIII")
+
+
+def to_little_endian(words):
+    """Bytes of an array('H') in little-endian order"""
+    if sys.byteorder == "big":
+        words = array('H', words)
+        words.byteswap()
+    return words.tobytes()
+
+
+def from_little_endian(data):
+    words = array('H')
+    words.frombytes(data)
+    if sys.byteorder == "big":
+        words.byteswap()
+    return words
+
+
+class Snapshot:
+    """Registers, cycle count, RAM and ROM of a CPU at one moment"""
+
+    def __init__(self, A, D, PC, cycles, ram, rom):
+        """
+        Args:
+            A, D, PC: Register values
+            cycles: CPU.cycles at the time of the snapshot
+            ram, rom: array('H') copies of the memories
+        """
+        self.A = A
+        self.D = D
+        self.PC = PC
+        self.cycles = cycles
+        self.ram = ram
+        self.rom = rom
+        self._ram_bytes = ram.tobytes()  # Native order, compared against on restore
+
+    @classmethod
+    def capture(cls, cpu):
+        return cls(cpu.A, cpu.D, cpu.PC, cpu.cycles,
+                   array('H', cpu.ram.memory), array('H', cpu.rom.memory))
+
+    def restore(self, cpu):
+        """
+        Put cpu back into this state.
+
+        Returns:
+            Number of RAM pages that had to be copied
+        """
+        if len(self.ram) != cpu.ram.size or len(self.rom) != cpu.rom.size:
+            raise ValueError(f"Snapshot is for RAM {len(self.ram)} / ROM {len(self.rom)} words, "
+                             f"CPU has RAM {cpu.ram.size} / ROM {cpu.rom.size}")
+
+        current = memoryview(cpu.ram.memory).cast('B')
+        saved = self._ram_bytes
+        page_bytes = 2 * PAGE_WORDS
+        restored = []
+        for start in range(0, len(saved), page_bytes):
+            end = start + page_bytes
+            if current[start:end].tobytes() != saved[start:end]:
+                current[start:end] = saved[start:end]
+                restored.append((start // 2, min(end, len(saved)) // 2))
+        current.release()
+
+        if cpu.rom.memory != self.rom:
+            cpu.rom.load_range(0, self.rom)
+
+        cpu.A, cpu.D, cpu.PC = self.A, self.D, self.PC
+        cpu.cycles = self.cycles
+
+        for device in cpu.devices:
+            if device.WRITES:
+                for start, end in restored:
+                    if start < device.base + device.size and device.base < end:
+                        device.invalidate(start, end)
+        return len(restored)
+
+    def to_bytes(self):
+        """Compact serialized form (see module docstring)"""
+        ram = zlib.compress(to_little_endian(self.ram))
+        rom = zlib.compress(to_little_endian(self.rom))
+        header = HEADER.pack(MAGIC, FORMAT_VERSION, self.A, self.D, self.PC, self.cycles,
+                             len(self.ram), len(self.rom), len(ram), len(rom))
+        return header + ram + rom
+
+    @classmethod
+    def from_bytes(cls, data):
+        magic, version, A, D, PC, cycles, ram_words, rom_words, ram_length, rom_length = \
+            HEADER.unpack_from(data)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError("Not a Hack CPU snapshot (or an unsupported version)")
+        offset = HEADER.size
+        ram = from_little_endian(zlib.decompress(data[offset:offset + ram_length]))
+        offset += ram_length
+        rom = from_little_endian(zlib.decompress(data[offset:offset + rom_length]))
+        if len(ram) != ram_words or len(rom) != rom_words:
+            raise ValueError("Corrupt snapshot: memory sizes do not match the header")
+        return cls(A, D, PC, cycles, ram, rom)
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            f.write(self.to_bytes())
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            return cls.from_bytes(f.read())
@@ -0,0 +1,418 @@
+"""
+Spin loops - Fast-forwarding idle and counting loops
+
+Programs spend a lot of cycles in loops that do nothing but count:
+`(END) @END 0;JMP` at the end of every program, Sys.halt's endless
+while, Sys.wait's countdowns. SpinLoops finds the heads of short
+backward loops when ROM is decoded and puts a LOOP entry (see
+decoder.py) over each one. When the run loop reaches it:
+
+1. One iteration is executed for real while every value is tracked
+   symbolically as "constant" or "variable + constant", where the
+   variables are A, D and the RAM words read at the start of the
+   iteration.
+2. If every register and written word ends the iteration as a
+   constant, itself plus a step, or another such variable plus a
+   constant, then iteration n is a linear function of n. The loop is
+   collapsed when, in addition, every RAM address and taken jump target
+   stays the same from one iteration to the next, no device is
+   touched (only addresses below read_limit/write_limit), and the path
+   is a simple one through the loop's ROM range.
+3. Each jump's condition is then "variable + constant" too, so the
+   number of iterations before any jump changes direction (the loop
+   exits) is computed arithmetically, and that many iterations are
+   applied at once to the registers, RAM and cycle count, within the
+   run's cycle budget (or up to the next check point when there are
+   check hooks).
+
+The result is exactly what running the iterations one by one gives, so
+cycle counts, budgets and check hooks keep their meaning. Loops that do
+not qualify, or that rarely run long enough to pay for the traced
+iteration, have their original entry put back.
+
+A loop that can never exit and whose state never changes is idle. With
+CPU.stop_when_idle set, run() treats reaching one like HALT.
+
+Entry layout:
+
+    (LOOP, function, length, name)
+
+    function(pc, A, D, budget) -> (A, D, pc, cycles, idle); length is
+    the loop's ROM range, so the debugger can unfuse it
+"""
+
+from decoder import A_INSTRUCTION, C_INSTRUCTION, LOOP
+
+MASK = 0xFFFF
+MAX_BODY = 64               # Longest loop range considered, in instructions
+MIN_ATTEMPTS = 8            # Attempts before a loop's payoff is judged
+MIN_ITERATIONS_SKIPPED = 32  # Per attempt, on average, to keep the loop
+
+# Unsigned ranges where each jump condition holds, by jump bits
+TAKEN = {
+    1: ((1, 0x7FFF),),
+    2: ((0, 0),),
+    3: ((0, 0x7FFF),),
+    4: ((0x8000, MASK),),
+    5: ((1, MASK),),
+    6: ((0, 0), (0x8000, MASK)),
+    7: ((0, MASK),),
+}
+NOT_TAKEN = {
+    1: ((0, 0), (0x8000, MASK)),
+    2: ((1, MASK),),
+    3: ((0x8000, MASK),),
+    4: ((0, 0x7FFF),),
+    5: ((0, 0),),
+    6: ((1, 0x7FFF),),
+    7: (),
+}
+
+# Symbolic values: None (unknown) or (variable, offset), with variable
+# None for a constant, "A"/"D" for the registers or a RAM address
+
+CONSTANT_OPERATIONS = (0b101010, 0b111111, 0b111010)
+D_ONLY = (0b001101, 0b001111)         # !D, -D
+Y_ONLY = (0b110001, 0b110011)         # !y, -y
+OFFSETS = {0b011111: ("d", 1), 0b001110: ("d", -1), 0b110111: ("y", 1), 0b110010: ("y", -1)}
+
+
+def _shift(value, offset):
+    return None if value is None else (value[0], (value[1] + offset) & MASK)
+
+
+def _is_constant(value):
+    return value is not None and value[0] is None
+
+
+def _symbolic(comp, d, y, result):
+    """Symbolic ALU output for comp bits, given the operands' symbolic values"""
+    if comp in CONSTANT_OPERATIONS:
+        return (None, result)
+    if comp == 0b001100:
+        return d
+    if comp == 0b110000:
+        return y
+    if comp in OFFSETS:
+        operand, offset = OFFSETS[comp]
+        return _shift(d if operand == "d" else y, offset)
+    if comp == 0b000010:                                  # D+y
+        if _is_constant(d):
+            return _shift(y, d[1])
+        if _is_constant(y):
+            return _shift(d, y[1])
+        return None
+    if comp == 0b010011:                                  # D-y
+        return _shift(d, -y[1]) if _is_constant(y) else None
+    if comp == 0b000111:                                  # y-D
+        return _shift(y, -d[1]) if _is_constant(d) else None
+    if comp in D_ONLY:
+        return (None, result) if _is_constant(d) else None
+    if comp in Y_ONLY:
+        return (None, result) if _is_constant(y) else None
+    return (None, result) if _is_constant(d) and _is_constant(y) else None
+
+
+def _first_change(base, rate, bits, taken, limit):
+    """
+    First i in [0, limit) at which jump condition `bits` on
+    (base + i * rate) & MASK no longer gives `taken`; limit if none.
+    """
+    ranges = NOT_TAKEN[bits] if taken else TAKEN[bits]
+    if not ranges:
+        return limit
+    if rate == 0:
+        return 0 if any(low <= base <= high for low, high in ranges) else limit
+    if rate == 1:
+        return min(min(0 if low <= base <= high else (low - base) & MASK for low, high in ranges), limit)
+    if rate == MASK:
+        return min(min(0 if low <= base <= high else (base - high) & MASK for low, high in ranges), limit)
+    value = base
+    for i in range(min(limit, MASK + 1)):
+        if any(low <= value <= high for low, high in ranges):
+            return i
+        value = (value + rate) & MASK
+    return limit
+
+
+class _Rejected(Exception):
+    """The traced iteration cannot be collapsed; permanent says never retry"""
+
+    def __init__(self, permanent):
+        super().__init__()
+        self.permanent = permanent
+
+
+class SpinLoops:
+    """Finds loop heads in a CPU's ROM and fast-forwards them"""
+
+    def __init__(self, cpu):
+        self.cpu = cpu
+        self.ranges = {}          # Head -> last address of the loop's ROM range
+        self.originals = {}       # Head -> fused entry the LOOP entry replaced
+        self.attempts = {}        # Head -> fast-forward attempts
+        self.skipped = {}         # Head -> iterations skipped
+        self.fused = None
+
+    def install(self, code, fused):
+        """Put LOOP entries over the loop heads in fused (same indices as code)"""
+        self.fused = fused
+        self.ranges = find_loops(code)
+        self.originals = {}
+        self.attempts = dict.fromkeys(self.ranges, 0)
+        self.skipped = dict.fromkeys(self.ranges, 0)
+        for head, end in self.ranges.items():
+            self.originals[head] = fused[head]
+            fused[head] = (LOOP, self.fast_forward, end - head + 1, "loop")
+
+    def _remove(self, head):
+        """Stop fast-forwarding head (its plain entries run from now on)"""
+        if self.fused is self.cpu.fused_code and self.fused[head][0] == LOOP:
+            self.fused[head] = self.originals[head]
+
+    def fast_forward(self, head, A, D, budget):
+        """
+        Run the loop at head: one traced iteration, then as many whole
+        iterations as are provably the same and fit in budget (> 0).
+
+        Returns:
+            (A, D, pc, cycles, idle): new registers and PC, cycles
+            executed, and True if the loop is idle and
+            cpu.stop_when_idle is set (the state is then at the head)
+        """
+        cpu = self.cpu
+        memory = cpu.ram.memory
+        try:
+            A, D, pc, length, model = self._trace(head, A, D, budget)
+        except _Stopped as stopped:
+            self._count(head, 0, stopped.permanent)
+            return stopped.A, stopped.D, stopped.pc, stopped.cycles, False
+
+        state, rates, jumps = model
+        limit = (budget - length) // length
+        iterations = limit
+        for base, rate, bits, taken in jumps:
+            iterations = min(iterations, _first_change(base, rate, bits, taken, limit))
+            if iterations == 0:
+                break
+
+        if cpu.stop_when_idle and not any(rates.values()) and \
+                all(_first_change(base, 0, bits, taken, 1) for base, _, bits, taken in jumps):
+            self._count(head, limit, False)
+            return A, D, pc, length, True
+
+        if iterations:
+            for variable, rate in rates.items():
+                if rate:
+                    value = (state[variable] + iterations * rate) & MASK
+                    if variable == "A":
+                        A = value
+                    elif variable == "D":
+                        D = value
+                    else:
+                        memory[variable] = value
+        self._count(head, iterations, False)
+        return A, D, pc, length * (iterations + 1), False
+
+    def _count(self, head, iterations, permanent):
+        attempts = self.attempts[head] = self.attempts[head] + 1
+        skipped = self.skipped[head] = self.skipped[head] + iterations
+        if permanent or (attempts >= MIN_ATTEMPTS and skipped < MIN_ITERATIONS_SKIPPED * attempts):
+            self._remove(head)
+
+    def _trace(self, head, A, D, budget):
+        """
+        Execute one iteration from head, tracking symbolic values.
+
+        Returns:
+            (A, D, pc, length, (state, rates, jumps)) after returning to
+            head, where state holds the variables' values, rates their
+            step per iteration and jumps (base, rate, bits, taken) per
+            jump on the path
+
+        Raises:
+            _Stopped: with the state reached, if the iteration cannot
+            be collapsed (at least one instruction has been executed)
+        """
+        cpu = self.cpu
+        code = cpu.code
+        words = cpu.rom.memory
+        memory = cpu.ram.memory
+        read_limit, write_limit = cpu.read_limit, cpu.write_limit
+        end = self.ranges[head]
+
+        symbolic_a, symbolic_d = ("A", 0), ("D", 0)
+        initial = {"A": A, "D": D}      # Values of the variables at the head
+        cells = {}                      # Address -> symbolic value
+        invariant = []                  # Symbolic values that must not change between iterations
+        jumps = []                      # (symbolic condition, bits, taken)
+        visited = set()
+        pc = head
+        length = 0
+        problem = None                  # None, or True/False: permanent or not
+
+        while True:
+            if length >= budget:
+                raise _Stopped(A, D, pc, length, False)
+            kind, argument, use_m, dest, jump = code[pc]
+            visited.add(pc)
+            length += 1
+            if kind == A_INSTRUCTION:
+                A = argument
+                symbolic_a = (None, argument)
+                pc += 1
+            elif kind == C_INSTRUCTION:
+                word = words[pc]
+                if use_m:
+                    if A >= read_limit:
+                        problem = True
+                        y = cpu.load(A)
+                        symbolic_y = None
+                    else:
+                        y = memory[A]
+                        invariant.append(symbolic_a)
+                        if A not in cells:
+                            cells[A] = (A, 0)
+                            initial[A] = y
+                        symbolic_y = cells[A]
+                else:
+                    y, symbolic_y = A, symbolic_a
+                result = argument(D, y)
+                symbolic = _symbolic((word >> 6) & 0x3F, symbolic_d, symbolic_y, result)
+                if dest & 0x4:
+                    A, symbolic_a = result, symbolic
+                if dest & 0x2:
+                    D, symbolic_d = result, symbolic
+                if dest & 0x1:
+                    if A >= write_limit:
+                        problem = True
+                        cpu.store(A, result)
+                    else:
+                        invariant.append(symbolic_a)
+                        if A not in cells:
+                            initial[A] = memory[A]
+                        memory[A] = result
+                        cells[A] = symbolic
+                if jump is not None:
+                    taken = jump(result)
+                    jumps.append((symbolic, word & 0x7, taken))
+                    if taken:
+                        invariant.append(symbolic_a)
+                        pc = A
+                    else:
+                        pc += 1
+                else:
+                    pc += 1
+            else:
+                raise _Stopped(A, D, pc, length - 1, True)  # Not reached: ranges hold no HALT
+
+            if problem is not None:
+                raise _Stopped(A, D, pc, length, problem)
+            if pc == head:
+                break
+            if not head <= pc <= end or pc in visited:
+                # Left the loop (its exit), or an inner loop
+                raise _Stopped(A, D, pc, length, pc in visited)
+
+        final = {"A": symbolic_a, "D": symbolic_d}
+        final.update(cells)
+        current = {"A": A, "D": D}
+        current.update((address, memory[address]) for address in cells)
+        try:
+            rates = _rates(final, initial, current)
+            for value in invariant:
+                if value is None:
+                    raise _Rejected(True)
+                variable = value[0]
+                if variable is not None and (rates[variable] or current[variable] != initial[variable]):
+                    raise _Rejected(rates[variable] != 0)
+            conditions = []
+            for symbolic, bits, taken in jumps:
+                if symbolic is None:
+                    raise _Rejected(True)
+                variable, offset = symbolic
+                if variable is None:
+                    conditions.append((offset, 0, bits, taken))
+                else:
+                    conditions.append(((current[variable] + offset) & MASK, rates[variable], bits, taken))
+        except _Rejected as rejected:
+            raise _Stopped(A, D, pc, length, rejected.permanent)
+        return A, D, pc, length, (current, rates, conditions)
+
+
+class _Stopped(Exception):
+    """Tracing ended early; carries the state reached"""
+
+    def __init__(self, A, D, pc, cycles, permanent):
+        super().__init__()
+        self.A, self.D, self.pc, self.cycles, self.permanent = A, D, pc, cycles, permanent
+
+
+def _rates(final, initial, current):
+    """
+    Step per iteration of every variable, for iterations after the
+    traced one.
+
+    Args:
+        final: Variable -> symbolic value at the end of the iteration
+        initial: Variable -> value at its start
+        current: Variable -> value at its end
+
+    Raises:
+        _Rejected: if some variable does not change linearly
+    """
+    rates = {}
+    for variable, value in final.items():
+        if value is None:
+            raise _Rejected(True)
+        source, offset = value
+        if source is None:
+            rates[variable] = 0                     # Constant after one iteration
+        elif source == variable:
+            rates[variable] = offset                # Steps by offset
+        else:
+            origin = final.get(source, (source, 0))
+            if origin is None:
+                raise _Rejected(True)
+            if origin[0] == source:
+                rates[variable] = origin[1]         # Follows a stepping variable
+            elif origin[0] is None:
+                # Follows a variable that is constant from now on
+                if current[variable] != (origin[1] + offset) & MASK:
+                    raise _Rejected(False)
+                rates[variable] = 0
+            else:
+                raise _Rejected(True)
+    for variable in initial:
+        rates.setdefault(variable, 0)               # Read, never written
+    return rates
+
+
+def find_loops(code):
+    """
+    Loop heads in predecoded code.
+
+    A head is the constant target (the last @value before the jump) of a
+    backward jump at most MAX_BODY instructions away, with only A- and
+    C-instructions in between.
+
+    Returns:
+        Dict head -> address of the last backward jump to it
+    """
+    loops = {}
+    for pc, entry in enumerate(code):
+        if entry[0] != C_INSTRUCTION or entry[4] is None or entry[3] & 0x4:
+            continue
+        target = None
+        for previous in range(pc - 1, max(-1, pc - MAX_BODY), -1):
+            kind, argument, _, dest, _ = code[previous]
+            if kind == A_INSTRUCTION:
+                target = argument
+                break
+            if kind != C_INSTRUCTION or dest & 0x4:
+                break
+        if target is None or not pc - MAX_BODY < target <= pc:
+            continue
+        if all(code[address][0] in (A_INSTRUCTION, C_INSTRUCTION) for address in range(target, pc)):
+            loops[target] = max(loops.get(target, pc), pc)
+    return loops
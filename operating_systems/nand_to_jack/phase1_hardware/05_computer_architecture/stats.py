@@ -0,0 +1,188 @@
+"""
+Stats - Instruction mix and memory traffic of a running program
+
+Like the profiler, InstructionStats counts with counting.py's
+ExecutionCounter: one increment per instruction into a flat array('Q')
+indexed by ROM address, plus one per taken jump, from a run loop of its
+own, so CPU.run keeps its speed and nothing is counted unless stats are
+used.
+
+Everything else is derived from those counts and the predecoded
+fields of each ROM word when the statistics are read (mix()):
+- kinds:        A-instructions, C-instructions, HALT
+- comp:         executions per a-bit + comp field (128 slots)
+- dest, jump:   executions per dest / jump field (8 slots each), and
+                jumps taken per jump field
+- memory:       M reads (a-bit set) and M writes (dest includes M)
+
+summary() turns the arrays into a JSON-ready dict keyed by mnemonic and
+report() into text.
+
+Usage:
+    python stats.py program.asm --cycles 1000000 --json mix.json
+
+    stats = InstructionStats(cpu)
+    stats.run(max_cycles=1_000_000)
+    print(stats.report())
+"""
+
+import argparse
+import sys
+
+from assembler import Assembler
+from counting import ExecutionCounter
+from cpu import CPU
+from decoder import A_INSTRUCTION, C_INSTRUCTION, HALT
+from image import read_program
+from reports import JSONReport, zeros
+
+_TABLES = Assembler(extended=True)
+COMP_NAMES = {int(bits, 2): name for name, bits in _TABLES.comp_table.items()}
+DEST_NAMES = {int(bits, 2): name or "null" for name, bits in _TABLES.dest_table.items()}
+JUMP_NAMES = {int(bits, 2): name or "null" for name, bits in _TABLES.jump_table.items()}
+KIND_NAMES = {A_INSTRUCTION: "A", C_INSTRUCTION: "C", HALT: "HALT"}
+
+UNCONDITIONAL = 0b111
+
+
+def comp_name(comp):
+    """Mnemonic of a 7-bit a + comp field"""
+    return COMP_NAMES.get(comp, f"comp {comp:07b}")
+
+
+def c_mnemonic(word):
+    """dest=comp;jump text of a C-instruction word"""
+    dest, jump = (word >> 3) & 0x7, word & 0x7
+    text = comp_name((word >> 6) & 0x7F)
+    if dest:
+        text = f"{DEST_NAMES[dest]}={text}"
+    if jump:
+        text = f"{text};{JUMP_NAMES[jump]}"
+    return text
+
+
+class InstructionStats(ExecutionCounter, JSONReport):
+    """
+    Counts instructions and taken jumps per ROM address while running a
+    CPU (see counting.py) and derives the instruction mix from them.
+    """
+
+    def mix(self):
+        """
+        Counts by predecoded field.
+
+        Returns:
+            Dict of arrays: kinds (indexed by decoder kind), comp (a-bit
+            + comp, 128), dest (8), jump (8), jump_taken (8), and the
+            ints memory_reads, memory_writes
+        """
+        code = self.cpu.code
+        words = self.cpu.rom.memory
+        kinds, comp = zeros(3), zeros(128)
+        dest, jump, jump_taken = zeros(8), zeros(8), zeros(8)
+        reads = writes = 0
+        for pc, count in enumerate(self.instruction_counts()):
+            if not count:
+                continue
+            kind = code[pc][0]
+            kinds[kind] += count
+            if kind == C_INSTRUCTION:
+                word = words[pc]
+                comp[(word >> 6) & 0x7F] += count
+                dest[(word >> 3) & 0x7] += count
+                jump[word & 0x7] += count
+                jump_taken[word & 0x7] += self.taken[pc]
+                if word & 0x1000:
+                    reads += count
+                if word & 0x8:
+                    writes += count
+        return {"kinds": kinds, "comp": comp, "dest": dest, "jump": jump, "jump_taken": jump_taken,
+                "memory_reads": reads, "memory_writes": writes}
+
+    def top_instructions(self, limit=20):
+        """List of (mnemonic, count) for the most executed instruction texts"""
+        code = self.cpu.code
+        words = self.cpu.rom.memory
+        totals = {}
+        for pc, count in enumerate(self.instruction_counts()):
+            if count:
+                kind = code[pc][0]
+                text = c_mnemonic(words[pc]) if kind == C_INSTRUCTION else \
+                    f"@{words[pc]}" if kind == A_INSTRUCTION else "HALT"
+                totals[text] = totals.get(text, 0) + count
+        return sorted(totals.items(), key=lambda item: (-item[1], item[0]))[:limit]
+
+    def summary(self, limit=20):
+        """The statistics as a JSON-ready dict"""
+        mix = self.mix()
+        named = lambda counts, names: {names(index): count for index, count in
+                                       sorted(enumerate(counts), key=lambda item: -item[1]) if count}
+        conditional = sum(mix["jump"][1:UNCONDITIONAL])
+        conditional_taken = sum(mix["jump_taken"][1:UNCONDITIONAL])
+        return {
+            "cycles": self.cycles,
+            "instructions": {KIND_NAMES[kind]: mix["kinds"][kind] for kind in KIND_NAMES},
+            "comp": named(mix["comp"], comp_name),
+            "dest": named(mix["dest"], DEST_NAMES.get),
+            "jump": {JUMP_NAMES[bits]: {"executed": mix["jump"][bits], "taken": mix["jump_taken"][bits]}
+                     for bits in range(1, 8) if mix["jump"][bits]},
+            "memory": {"reads": mix["memory_reads"], "writes": mix["memory_writes"]},
+            "branches": {
+                "conditional": conditional,
+                "conditional_taken": conditional_taken,
+                "taken_ratio": conditional_taken / conditional if conditional else 0.0,
+                "unconditional": mix["jump"][UNCONDITIONAL],
+            },
+            "top": [[text, count] for text, count in self.top_instructions(limit)],
+        }
+
+    def report(self, limit=20):
+        """Readable summary: instruction kinds, memory traffic, branches, comp/dest/jump mix"""
+        summary = self.summary(limit)
+        total = max(sum(summary["instructions"].values()), 1)
+        kinds = summary["instructions"]
+        branches = summary["branches"]
+        memory = summary["memory"]
+        lines = [f"Instructions: {total:,}  A {100 * kinds['A'] / total:.1f}%  "
+                 f"C {100 * kinds['C'] / total:.1f}%  HALT {kinds['HALT']:,}",
+                 f"Memory: {memory['reads']:,} M reads, {memory['writes']:,} M writes "
+                 f"({(memory['reads'] + memory['writes']) / total:.2f} per instruction)",
+                 f"Branches: {branches['conditional']:,} conditional, "
+                 f"{100 * branches['taken_ratio']:.1f}% taken; {branches['unconditional']:,} unconditional"]
+        for title, rows in (("comp", summary["comp"]), ("dest", summary["dest"])):
+            lines.append("")
+            lines.append(f"{title:<12} {'count':>12} {'%':>6}")
+            for name, count in list(rows.items())[:limit]:
+                lines.append(f"{name:<12} {count:>12,} {100 * count / total:>5.1f}%")
+        lines.append("")
+        lines.append(f"{'jump':<12} {'count':>12} {'taken':>7}")
+        for name, counts in summary["jump"].items():
+            lines.append(f"{name:<12} {counts['executed']:>12,} {100 * counts['taken'] / counts['executed']:>6.1f}%")
+        lines.append("")
+        lines.append(f"{'instruction':<16} {'count':>12}")
+        for text, count in summary["top"]:
+            lines.append(f"{text:<16} {count:>12,}")
+        return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Instruction mix and memory traffic of a Hack program")
+    parser.add_argument("program", help=".asm, text .hack or binary image")
+    parser.add_argument("--cycles", type=int, default=1_000_000, help="cycles to run")
+    parser.add_argument("--top", type=int, default=20, help="rows per table")
+    parser.add_argument("--json", metavar="FILE", help="write the statistics as JSON")
+    args = parser.parse_args(argv)
+
+    cpu = CPU()
+    cpu.load_program_binary(read_program(args.program).words)
+    stats = InstructionStats(cpu)
+    stats.run(max_cycles=args.cycles)
+    print(stats.report(args.top))
+    if args.json:
+        stats.save_json(args.json, args.top)
+        print(f"\nWrote statistics to {args.json}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
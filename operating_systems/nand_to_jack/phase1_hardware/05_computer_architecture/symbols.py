@@ -0,0 +1,97 @@
+"""
+Symbols - Assembling .asm files with their labels and variables
+
+The 06 assembler keeps a symbol table (SymbolTable.labels and
+.variables); the tools that report by label (profiler, debugger,
+pipeline, predictors) and the image writer read it from here:
+- assemble_with_labels / assemble_with_symbols: binary plus symbols
+- LabelIndex: ROM address -> nearest label and VM function entry
+
+A VM function entry is a label with a dot and no '$' (Foo.bar), so
+Foo.bar$loop, the comparison labels and return points inside Foo.bar
+all belong to Foo.bar.
+
+Usage:
+    binary, labels = assemble_with_labels("Prog.asm")
+    index = LabelIndex(labels)
+    index.function_of(pc)
+"""
+
+import bisect
+import contextlib
+import importlib.util
+import io
+import os
+import tempfile
+from pathlib import Path
+
+SOFTWARE_DIR = Path(__file__).resolve().parent.parent.parent / 'phase2_software'
+ASSEMBLER_DIR = SOFTWARE_DIR / '06_assembler'
+
+TOP = "(top)"  # Frame/label for code before the first label
+
+
+def load_symbolic_assembler():
+    """Import the 06 assembler under its own name (05 has an assembler.py too)"""
+    spec = importlib.util.spec_from_file_location("hack_assembler", ASSEMBLER_DIR / 'assembler.py')
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.Assembler
+
+
+def assemble_with_labels(asm_path, extended=False):
+    """
+    Assemble a symbolic .asm file with the 06 assembler (extended: accept
+    the extended ISA's multiply and shift instructions).
+
+    Returns:
+        Tuple (binary_instructions, labels) with labels mapping name ->
+        ROM address
+    """
+    binary, labels, _ = assemble_with_symbols(asm_path, extended)
+    return binary, labels
+
+
+def assemble_with_symbols(asm_path, extended=False):
+    """
+    Like assemble_with_labels, also returning the variables.
+
+    Returns:
+        Tuple (binary_instructions, labels, variables) with variables
+        mapping name (e.g. the VM's static Foo.0) -> RAM address
+    """
+    assembler = load_symbolic_assembler()(extended=extended)
+    with tempfile.TemporaryDirectory() as scratch:
+        with contextlib.redirect_stdout(io.StringIO()):
+            binary = assembler.assemble(str(asm_path), os.path.join(scratch, "out.hack"))
+    table = assembler.symbol_table
+    return binary, dict(table.labels), dict(table.variables)
+
+
+def is_function_label(label):
+    """True for VM function entry labels (Foo.bar)"""
+    return "." in label and "$" not in label
+
+
+class LabelIndex:
+    """Maps ROM addresses to the nearest label and VM function before them"""
+
+    def __init__(self, labels):
+        self.labels = dict(labels)
+        ordered = sorted((address, name) for name, address in self.labels.items())
+        self.label_addresses = [address for address, _ in ordered]
+        self.label_names = [name for _, name in ordered]
+        functions = [(address, name) for address, name in ordered if is_function_label(name)]
+        self.function_addresses = [address for address, _ in functions]
+        self.function_names = [name for _, name in functions]
+        self.entries = dict(functions)  # Entry address -> function name
+
+    def label_of(self, pc):
+        """Nearest label at or before pc"""
+        index = bisect.bisect_right(self.label_addresses, pc) - 1
+        return self.label_names[index] if index >= 0 else TOP
+
+    def function_of(self, pc):
+        """Nearest function entry at or before pc"""
+        index = bisect.bisect_right(self.function_addresses, pc) - 1
+        return self.function_names[index] if index >= 0 else TOP
@@ -0,0 +1,344 @@
+"""
+Terminal - Real-time text rendering of the Hack screen
+
+Draws the 512 x 256 screen with Unicode cells:
+- braille: 2 x 4 pixels per cell, 256 x 64 cells
+- half:    1 x 2 pixels per cell (upper/lower half blocks), 512 x 128 cells
+
+Only cells covered by screen words written since the last frame are
+recomputed (from the Screen's dirty set), and of those only the ones
+whose glyph actually changed are sent, as runs behind ANSI cursor moves.
+A frame in which a snake moves one square costs a few dozen bytes.
+
+run_in_terminal() paces the CPU to a target frame rate. With a fixed
+instructions-per-frame budget it runs that many cycles and sleeps for
+the rest of the frame; without one it runs the CPU flat out for the
+whole frame and only stops to draw, so rendering never throttles the
+emulator below its full speed.
+
+Keys typed in the terminal are read in raw mode and fed to the
+Keyboard. Terminals report presses but not releases, so each key is
+held for `hold` seconds.
+
+Usage:
+    python terminal.py program.hack
+    python terminal.py program.hack --fps 60 --mode half
+    python terminal.py program.hack --instructions-per-frame 100000
+    python terminal.py program.hack --record session.rec
+"""
+
+import argparse
+import os
+import select
+import sys
+import time
+
+try:
+    import termios
+    import tty
+except ImportError:  # Not available on Windows; key capture is disabled
+    termios = None
+    tty = None
+
+from cpu import CPU
+from devices import SCREEN_WIDTH, SCREEN_HEIGHT, WORDS_PER_ROW, attach_io
+from image import read_program
+from replay import Recorder
+
+# mode -> (pixels per cell across, pixels per cell down)
+MODES = {"braille": (2, 4), "half": (1, 2)}
+
+# BRAILLE_DOTS[row][pair]: dot bits for two horizontal pixels (bit 0 =
+# left) on pixel row 0-3 of a braille cell
+_DOT_BITS = ((0x01, 0x08), (0x02, 0x10), (0x04, 0x20), (0x40, 0x80))
+BRAILLE_DOTS = tuple(
+    tuple((left if pair & 1 else 0) | (right if pair & 2 else 0) for pair in range(4))
+    for left, right in _DOT_BITS
+)
+HALF_BLOCKS = (" ", "▀", "▄", "█")  # (top, bottom) = 00, 10, 01, 11
+
+# Escape sequences sent by common terminals -> devices.KEY_CODES names
+ESCAPE_KEYS = {
+    "\x1b[A": "up", "\x1b[B": "down", "\x1b[C": "right", "\x1b[D": "left",
+    "\x1b[H": "home", "\x1b[F": "end", "\x1b[2~": "insert", "\x1b[3~": "delete",
+    "\x1b[5~": "page_up", "\x1b[6~": "page_down",
+    "\x1bOP": "f1", "\x1bOQ": "f2", "\x1bOR": "f3", "\x1bOS": "f4",
+}
+
+HIDE_CURSOR = "\x1b[?25l"
+SHOW_CURSOR = "\x1b[?25h"
+CLEAR = "\x1b[2J"
+
+
+def decode_keys(data):
+    """
+    Split raw terminal input into keys.
+
+    Returns:
+        List of characters and KEY_CODES names ("up", "escape", ...)
+    """
+    keys = []
+    i = 0
+    while i < len(data):
+        if data[i] == "\x1b":
+            for sequence, name in ESCAPE_KEYS.items():
+                if data.startswith(sequence, i):
+                    keys.append(name)
+                    i += len(sequence)
+                    break
+            else:
+                keys.append("escape")
+                i += 1
+        elif data[i] in "\r\n":
+            keys.append("newline")
+            i += 1
+        elif data[i] == "\x7f":
+            keys.append("backspace")
+            i += 1
+        else:
+            keys.append(data[i])
+            i += 1
+    return keys
+
+
+class TerminalRenderer:
+    """
+    Incremental text renderer for a devices.Screen.
+
+    `cells` holds the glyphs currently on the terminal; draw() recomputes
+    the cells under dirty screen words and writes only the ones that
+    differ.
+    """
+
+    def __init__(self, screen, mode="braille", stream=None, top=1, left=1):
+        if mode not in MODES:
+            raise ValueError(f"Unknown mode {mode!r} (expected one of {', '.join(MODES)})")
+        self.screen = screen
+        self.mode = mode
+        self.stream = sys.stdout if stream is None else stream
+        self.top = top
+        self.left = left
+        self.cell_width, self.cell_height = MODES[mode]
+        self.columns = SCREEN_WIDTH // self.cell_width
+        self.rows = SCREEN_HEIGHT // self.cell_height
+        self.cells = [[" "] * self.columns for _ in range(self.rows)]
+        self.cells_written = 0
+        self.bytes_written = 0
+        self.full_redraw = True
+
+    def _glyphs(self, cell_row, word):
+        """The 16 / cell_width glyphs of cell_row covered by one screen word"""
+        memory = self.screen.ram.memory
+        address = self.screen.base + cell_row * self.cell_height * WORDS_PER_ROW + word
+        size = len(memory)
+        values = [memory[a] if a < size else 0
+                  for a in range(address, address + self.cell_height * WORDS_PER_ROW, WORDS_PER_ROW)]
+        if self.mode == "braille":
+            glyphs = []
+            for shift in range(0, 16, 2):
+                dots = 0
+                for row, value in enumerate(values):
+                    dots |= BRAILLE_DOTS[row][(value >> shift) & 3]
+                glyphs.append(chr(0x2800 + dots))
+            return glyphs
+        top, bottom = values
+        return [HALF_BLOCKS[((top >> bit) & 1) | (((bottom >> bit) & 1) << 1)] for bit in range(16)]
+
+    def draw(self):
+        """
+        Bring the terminal up to date with the screen.
+
+        Returns:
+            Number of cells written
+        """
+        screen = self.screen
+        if self.full_redraw:
+            screen.invalidate()
+        per_word = 16 // self.cell_width
+        spans = {(offset // WORDS_PER_ROW // self.cell_height, offset % WORDS_PER_ROW)
+                 for offset in screen.dirty}
+        screen.render()  # Keeps the framebuffer (and its frame count) in step
+
+        changed = {}  # cell row -> {column: glyph}
+        for cell_row, word in spans:
+            current = self.cells[cell_row]
+            column = word * per_word
+            for glyph in self._glyphs(cell_row, word):
+                if self.full_redraw or current[column] != glyph:
+                    current[column] = glyph
+                    changed.setdefault(cell_row, {})[column] = glyph
+                column += 1
+        self.full_redraw = False
+
+        out = []
+        count = 0
+        for cell_row in sorted(changed):
+            row_changes = changed[cell_row]
+            columns = sorted(row_changes)
+            run_start = previous = None
+            for column in columns + [None]:
+                if column is not None and previous is not None and column == previous + 1:
+                    previous = column
+                    continue
+                if run_start is not None:
+                    out.append(f"\x1b[{self.top + cell_row};{self.left + run_start}H")
+                    out.append("".join(row_changes[c] for c in range(run_start, previous + 1)))
+                    count += previous + 1 - run_start
+                run_start = previous = column
+        if out:
+            text = "".join(out)
+            self.stream.write(text)
+            self.stream.flush()
+            self.bytes_written += len(text.encode())
+        self.cells_written += count
+        return count
+
+    def text(self):
+        """The terminal contents as plain lines (for snapshots and tests)"""
+        return "\n".join("".join(row) for row in self.cells)
+
+    def start(self):
+        """Clear the terminal, hide the cursor and force a full redraw"""
+        self.stream.write(CLEAR + HIDE_CURSOR)
+        self.full_redraw = True
+
+    def stop(self):
+        """Restore the cursor below the picture"""
+        self.stream.write(f"\x1b[{self.top + self.rows};1H" + SHOW_CURSOR + "\n")
+        self.stream.flush()
+
+
+class KeyReader:
+    """
+    Non-blocking raw-mode reader for a terminal's input.
+
+    Use as a context manager; the terminal mode is restored on exit.
+    When input is not a terminal (or termios is missing) no keys are
+    read.
+    """
+
+    def __init__(self, stream=None):
+        self.stream = sys.stdin if stream is None else stream
+        self.saved = None
+
+    def __enter__(self):
+        if termios is not None and self.stream.isatty():
+            fd = self.stream.fileno()
+            self.saved = termios.tcgetattr(fd)
+            tty.setcbreak(fd)
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.saved is not None:
+            termios.tcsetattr(self.stream.fileno(), termios.TCSADRAIN, self.saved)
+            self.saved = None
+
+    def read_keys(self):
+        """Keys typed since the last call (never blocks)"""
+        if self.saved is None:
+            return []
+        fd = self.stream.fileno()
+        data = b""
+        while select.select([fd], [], [], 0)[0]:
+            chunk = os.read(fd, 1024)
+            if not chunk:
+                break
+            data += chunk
+        return decode_keys(data.decode(errors="ignore"))
+
+
+def run_in_terminal(cpu, screen, keyboard, fps=30, instructions_per_frame=None,
+                    renderer=None, keys=None, max_frames=None, hold=0.15,
+                    slice_cycles=20_000, clock=time.monotonic, sleep=time.sleep):
+    """
+    Run the CPU, drawing the screen at a target frame rate.
+
+    Args:
+        cpu: CPU with the program loaded and screen/keyboard mapped
+        screen, keyboard: Devices from devices.attach_io
+        fps: Target frames per second
+        instructions_per_frame: Cycles per frame; None runs flat out
+                                until each frame's deadline
+        renderer: TerminalRenderer (default: braille on stdout)
+        keys: Zero-argument callable returning newly typed keys
+        max_frames: Stop after this many frames (default: until the
+                    program halts or runs off the end of ROM)
+        hold: Seconds each typed key stays pressed
+        slice_cycles: Cycles per cpu.run call when running flat out
+
+    Returns:
+        Dict with "frames", "cycles", "seconds", "fps" and "ips"
+    """
+    renderer = renderer or TerminalRenderer(screen)
+    period = 1.0 / fps
+    start = clock()
+    deadline = start
+    frames = cycles = 0
+    stopped = False
+    while not stopped and (max_frames is None or frames < max_frames):
+        deadline += period
+        for key in keys() if keys else ():
+            keyboard.press(key, duration=hold)
+
+        if instructions_per_frame is not None:
+            _, executed = cpu.run(max_cycles=instructions_per_frame)
+            cycles += executed
+            stopped = executed < instructions_per_frame
+        else:
+            while clock() < deadline:
+                _, executed = cpu.run(max_cycles=slice_cycles)
+                cycles += executed
+                if executed < slice_cycles:
+                    stopped = True  # HALT or PC beyond ROM
+                    break
+
+        renderer.draw()
+        frames += 1
+        remaining = deadline - clock()
+        if remaining > 0:
+            sleep(remaining)
+        else:
+            deadline = clock()  # Behind schedule: drop the lost time, don't catch up
+
+    seconds = max(clock() - start, 1e-9)
+    return {"frames": frames, "cycles": cycles, "seconds": seconds,
+            "fps": frames / seconds, "ips": cycles / seconds}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a Hack program with its screen in the terminal")
+    parser.add_argument("program", help=".hack file or binary image (see image.py)")
+    parser.add_argument("--fps", type=float, default=30, help="target frames per second")
+    parser.add_argument("--instructions-per-frame", type=int,
+                        help="cycles per frame (default: as many as fit in the frame)")
+    parser.add_argument("--mode", choices=list(MODES), default="braille", help="cell type")
+    parser.add_argument("--max-frames", type=int, help="stop after this many frames")
+    parser.add_argument("--jit", action="store_true", help="run through the JIT")
+    parser.add_argument("--record", metavar="FILE", help="record the session for replay.py")
+    args = parser.parse_args(argv)
+
+    cpu = CPU(jit=args.jit)
+    screen, keyboard = attach_io(cpu)
+    cpu.load_program_binary(read_program(args.program).words)
+    renderer = TerminalRenderer(screen, args.mode)
+    recorder = Recorder(cpu, keyboard) if args.record else None
+
+    with KeyReader() as reader:
+        renderer.start()
+        try:
+            stats = run_in_terminal(cpu, screen, keyboard, args.fps, args.instructions_per_frame,
+                                    renderer, reader.read_keys, args.max_frames)
+        except KeyboardInterrupt:
+            stats = None
+        finally:
+            renderer.stop()
+            if recorder:
+                recorder.stop().save(args.record)
+    if stats:
+        print(f"{stats['frames']} frames at {stats['fps']:.1f} fps, "
+              f"{stats['ips']:,.0f} instructions/second")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
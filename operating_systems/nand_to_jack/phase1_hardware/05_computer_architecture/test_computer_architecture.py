@@ -4,12 +4,36 @@ Unit tests for the Hack computer architecture components.
 Tests individual components (ALU, RAM, ROM, Assembler) and integration (CPU).
 """
 
+import io
+import json
+import os
+import tempfile
 import unittest
+from array import array
 from alu import ALU
 from ram import RAM
 from rom import ROM
 from assembler import Assembler
 from cpu import CPU
+from decoder import decode, A_INSTRUCTION, C_INSTRUCTION, HALT
+from jit import generate_block
+from idioms import match
+from benchmark import run_cycles, measure, VM_EXAMPLES_DIR
+from devices import Keyboard, attach_io, key_code
+from terminal import TerminalRenderer, decode_keys, run_in_terminal
+from snapshot import Snapshot, PAGE_WORDS
+from batch import Job, Case, load_manifest, run_batch
+from lockstep import LockstepCPU, np
+from profiler import Profiler
+from symbols import assemble_with_labels, assemble_with_symbols
+from debugger import Debugger
+from replay import Recorder, Recording, Replayer
+from image import HackImage, load_image, read_program
+from spinloops import find_loops
+from stats import InstructionStats
+from pipeline import PipelineModel, PipelineConfig, PIPELINES
+from predictors import BranchPredictor, PREDICTORS, CALL, RETURN
+from intrinsics import Intrinsics, multiply, divide, sqrt, alloc_from, dealloc_to
 
 
 class TestALU(unittest.TestCase):
@@ -104,6 +128,27 @@ class TestRAM(unittest.TestCase):
         self.assertEqual(self.ram[0], 0)
         self.assertEqual(self.ram[10], 0)
 
+    def test_reset_in_place(self):
+        """Reset zero-fills the existing array instead of replacing it"""
+        memory = self.ram.memory
+        self.ram[3] = 7
+        self.ram.reset()
+        self.assertIs(self.ram.memory, memory)
+        self.assertEqual(memory[3], 0)
+
+    def test_load_and_dump_range(self):
+        """Bulk copies mask values and stop at the end of RAM"""
+        self.assertEqual(self.ram.load_range(10, [1, 2, -1]), 3)
+        self.assertEqual(list(self.ram.dump_range(10, 3)), [1, 2, 0xFFFF])
+        self.assertEqual(self.ram.load_range(1022, [5, 6, 7]), 2)
+        self.assertEqual(list(self.ram.dump_range(1022)), [5, 6])
+        self.assertEqual(len(self.ram.memory), 1024)
+
+    def test_fill(self):
+        """Fill sets a range and leaves the rest alone"""
+        self.ram.fill(9, 4, 8)
+        self.assertEqual(list(self.ram.dump_range(3, 6)), [0, 9, 9, 9, 9, 0])
+
 
 class TestROM(unittest.TestCase):
     """Test ROM operations"""
@@ -143,6 +188,13 @@ class TestROM(unittest.TestCase):
         self.assertEqual(self.rom[0], 0)
         self.assertEqual(self.rom[1], 0)
 
+    def test_load_range(self):
+        """Bulk loads copy into place and bump the version"""
+        version = self.rom.version
+        self.rom.load_range(2, [7, 8])
+        self.assertEqual(list(self.rom.dump_range(0, 5)), [0, 0, 7, 8, 0])
+        self.assertGreater(self.rom.version, version)
+
 
 class TestAssembler(unittest.TestCase):
     """Test assembler functionality"""
@@ -411,5 +463,1198 @@ class TestCPU(unittest.TestCase):
         self.assertEqual(self.cpu.PC, 1)
 
 
+class TestPredecode(unittest.TestCase):
+    """Test predecoded instruction entries"""
+
+    def setUp(self):
+        self.cpu = CPU()
+        self.assembler = Assembler()
+
+    def test_decode_entries(self):
+        """A, C and HALT words decode to the documented tuple layout"""
+        self.assertEqual(decode(0b0000000000101010), (A_INSTRUCTION, 42, False, 0, None))
+        self.assertEqual(decode(0xFFFF)[0], HALT)
+
+        kind, operation, use_m, dest, jump = decode(int("1111110111011000", 2))  # MD=M+1
+        self.assertEqual(kind, C_INSTRUCTION)
+        self.assertTrue(use_m)
+        self.assertEqual(dest, 0b011)
+        self.assertIsNone(jump)
+        self.assertEqual(operation(0, 41), 42)
+
+    def test_unknown_comp_fails_only_when_executed(self):
+        """Unused comp encodings decode fine but raise when run"""
+        word = int("1110111110000000", 2)  # comp 111110 is unused
+        self.cpu.rom.load_program_binary([word])
+        self.cpu.ensure_decoded()
+        with self.assertRaises(KeyError):
+            self.cpu.step()
+
+    def test_reload_invalidates_entries(self):
+        """Reloading ROM (through CPU or ROM) replaces the decoded program"""
+        self.cpu.load_program(self.assembler.assemble(["@7", "D=A", "HALT"]))
+        self.cpu.run()
+        self.assertEqual(self.cpu.D, 7)
+
+        self.cpu.reset()
+        self.cpu.rom.load_program(self.assembler.assemble(["@9", "D=A", "HALT"]))
+        self.cpu.run()
+        self.assertEqual(self.cpu.D, 9)
+
+        self.cpu.reset()
+        self.cpu.rom.reset()
+        halted, cycles = self.cpu.run(max_cycles=5)
+        self.assertFalse(halted)
+        self.assertEqual(self.cpu.A, 0)
+
+    def test_step_matches_run(self):
+        """Stepping and running a loop end in the same state"""
+        program = ["@3", "D=A", "(LOOP)", "D=D-1", "@2", "D;JGT", "HALT"]
+        binary = self.assembler.assemble([line for line in program if not line.startswith("(")])
+        stepped = CPU()
+        stepped.load_program(binary)
+        for _ in range(8):
+            stepped.step()
+
+        ran = CPU()
+        ran.load_program(binary)
+        ran.run(max_cycles=8)
+        self.assertEqual((stepped.A, stepped.D, stepped.PC), (ran.A, ran.D, ran.PC))
+
+
+class TestJIT(unittest.TestCase):
+    """Test the basic-block JIT against the interpreter"""
+
+    # Sum 1..5 into RAM[16] using the usual @LABEL / jump idioms
+    PROGRAM = [
+        "@5", "D=A", "@17", "M=D",          # 0-3: n = 5
+        "@16", "M=0",                       # 4-5: sum = 0
+        "@17", "D=M", "@18", "D;JEQ",       # 6-9: LOOP: if n == 0 goto END
+        "@16", "M=D+M", "@17", "M=M-1",     # 10-13: sum += n; n--
+        "@6", "0;JMP",                      # 14-15: goto LOOP
+        "HALT",                             # 16 (unused)
+        "HALT",                             # 17 (unused)
+        "HALT",                             # 18: END
+    ]
+
+    def setUp(self):
+        self.binary = Assembler().assemble(self.PROGRAM)
+
+    def make_cpu(self, jit):
+        cpu = CPU(jit=jit)
+        cpu.load_program(self.binary)
+        return cpu
+
+    def test_matches_interpreter(self):
+        """Same result, cycle count and registers as the interpreter"""
+        interpreted = self.make_cpu(False)
+        compiled = self.make_cpu(True)
+        self.assertEqual(compiled.run(max_cycles=1000), interpreted.run(max_cycles=1000))
+        self.assertEqual(compiled.ram[16], 15)
+        self.assertEqual((compiled.A, compiled.D, compiled.PC),
+                         (interpreted.A, interpreted.D, interpreted.PC))
+
+    def test_exact_cycle_budget(self):
+        """max_cycles stops mid-block at exactly the same instruction"""
+        for budget in range(1, 40):
+            interpreted = self.make_cpu(False)
+            compiled = self.make_cpu(True)
+            self.assertEqual(compiled.run(max_cycles=budget), interpreted.run(max_cycles=budget))
+            self.assertEqual((compiled.A, compiled.D, compiled.PC),
+                             (interpreted.A, interpreted.D, interpreted.PC))
+            self.assertEqual(compiled.ram.memory[:20], interpreted.ram.memory[:20])
+
+    def test_unconditional_jump_is_chained(self):
+        """@LOOP / 0;JMP continues compiling at the target"""
+        cpu = self.make_cpu(True)
+        source, length = generate_block(cpu.code, cpu.rom.memory, 10, cpu.ram.size, cpu.rom.size)
+        # 10-15, then chained into 6-9 which ends at the conditional jump
+        self.assertEqual(length, 10)
+        self.assertIn("return A, D, (A if r == 0 else 10)", source)
+
+    def test_reload_recompiles(self):
+        """Loading a new program drops the compiled blocks"""
+        cpu = self.make_cpu(True)
+        cpu.run(max_cycles=1000)
+        cpu.reset()
+        cpu.load_program(Assembler().assemble(["@3", "D=A", "HALT"]))
+        self.assertEqual(cpu.run(max_cycles=1000), (True, 3))
+        self.assertEqual(cpu.D, 3)
+
+
+class TestIdioms(unittest.TestCase):
+    """Test superinstructions for VM-translator sequences"""
+
+    PUSH_D = ["@0", "A=M", "M=D", "@0", "M=M+1"]
+    POP_D = ["@0", "M=M-1", "A=M", "D=M"]
+
+    # push constant 7; push constant 5; add; pop temp 0; HALT
+    PROGRAM = (["@256", "D=A", "@0", "M=D"]
+               + ["@7", "D=A"] + PUSH_D
+               + ["@5", "D=A"] + PUSH_D
+               + POP_D + ["@0", "M=M-1", "A=M", "M=D+M", "@0", "M=M+1"]
+               + POP_D + ["@5", "M=D"]
+               + ["HALT"])
+
+    def setUp(self):
+        self.binary = Assembler().assemble(self.PROGRAM)
+
+    def make_cpu(self, idioms):
+        cpu = CPU(idioms=idioms)
+        cpu.load_program(self.binary)
+        return cpu
+
+    def test_sequences_are_matched(self):
+        """Push, add and pop are recognised at load time"""
+        cpu = self.make_cpu(True)
+        self.assertEqual(cpu.idiom_counts["push_constant"], 2)
+        self.assertEqual(cpu.idiom_counts["binary"], 1)
+        self.assertEqual(cpu.idiom_counts["pop_direct"], 1)
+        words = [int(word, 2) for word in self.binary]
+        self.assertEqual(match(words, 4), ("push_constant", 7, [7]))
+
+    def test_same_effect_as_interpreter(self):
+        """Fused and plain execution agree on RAM, registers and cycles"""
+        plain = self.make_cpu(False)
+        fused = self.make_cpu(True)
+        self.assertEqual(fused.run(), plain.run())
+        self.assertEqual(fused.ram[5], 12)
+        self.assertEqual((fused.A, fused.D, fused.PC), (plain.A, plain.D, plain.PC))
+        self.assertEqual(fused.ram.memory[:300], plain.ram.memory[:300])
+
+    def test_budget_tail_runs_plain_instructions(self):
+        """A budget ending inside a sequence stops at the same instruction"""
+        for budget in range(1, len(self.binary) + 1):
+            plain = self.make_cpu(False)
+            fused = self.make_cpu(True)
+            self.assertEqual(fused.run(max_cycles=budget), plain.run(max_cycles=budget))
+            self.assertEqual((fused.A, fused.D, fused.PC), (plain.A, plain.D, plain.PC))
+            self.assertEqual(fused.ram.memory[:300], plain.ram.memory[:300])
+
+    def test_stack_pointer_aliasing_registers(self):
+        """SP pointing at itself is handled like the real instructions"""
+        program = Assembler().assemble(["@9", "D=A"] + self.PUSH_D + ["HALT"])
+        results = []
+        for idioms in (False, True):
+            cpu = CPU(idioms=idioms)
+            cpu.load_program(program)
+            cpu.run()
+            results.append((cpu.ram[0], cpu.A, cpu.D))
+        self.assertEqual(results[0], results[1])
+        self.assertEqual(results[1][0], 10)  # RAM[0] = 9, then incremented
+
+
+class TestRunLoop(unittest.TestCase):
+    """Test the tight run loop's check interval and hooks"""
+
+    # Count down from 100 in D, forever
+    PROGRAM = ["@100", "D=A", "D=D-1", "@0", "D;JGT", "@2", "0;JMP"]
+
+    def setUp(self):
+        self.binary = Assembler().assemble(self.PROGRAM)
+
+    def make_cpu(self, **kwargs):
+        cpu = CPU(**kwargs)
+        cpu.load_program(self.binary)
+        return cpu
+
+    def test_interval_does_not_change_results(self):
+        """Any check interval gives the same final state"""
+        reference = self.make_cpu()
+        reference.run(max_cycles=1000)
+        for interval in (1, 7, 1000, 5000):
+            cpu = self.make_cpu()
+            cpu.check_interval = interval
+            cpu.add_check_hook(lambda cpu: False)
+            self.assertEqual(cpu.run(max_cycles=1000), (False, 1000))
+            self.assertEqual((cpu.A, cpu.D, cpu.PC), (reference.A, reference.D, reference.PC))
+
+    def test_hooks_see_synced_registers(self):
+        """Hooks run every check_interval cycles with registers written back"""
+        for jit in (False, True):
+            cpu = self.make_cpu(jit=jit)
+            cpu.check_interval = 50
+            seen = []
+            cpu.add_check_hook(lambda cpu: seen.append(cpu.D))
+            cpu.run(max_cycles=500)
+            self.assertGreaterEqual(len(seen), 8)
+            self.assertTrue(all(0 <= d <= 100 for d in seen))
+
+    def test_hook_can_stop_run(self):
+        """A hook returning True ends run() early without halting"""
+        for jit in (False, True):
+            cpu = self.make_cpu(jit=jit)
+            cpu.check_interval = 10
+            cpu.add_check_hook(lambda cpu: True)
+            halted, cycles = cpu.run(max_cycles=1000)
+            self.assertFalse(halted)
+            self.assertLess(cycles, 20)
+
+    def test_benchmark_restarts_halting_programs(self):
+        """run_cycles keeps going after HALT so every tier does the same work"""
+        cpu = CPU()
+        cpu.load_program(Assembler().assemble(["@1", "D=A", "HALT"]))
+        self.assertEqual(run_cycles(cpu, 10), 10)
+        self.assertGreater(measure(CPU, Assembler().assemble(["@1", "HALT"]), 100, repeat=1), 0)
+
+
+class TestDevices(unittest.TestCase):
+    """Test the memory-mapped screen and keyboard"""
+
+    PUSH_D = ["@0", "A=M", "M=D", "@0", "M=M+1"]
+    POP_D = ["@0", "M=M-1", "A=M", "D=M"]
+
+    # Draw the top-left pixel and the rightmost pixel of row 1
+    DRAW = ["@1", "D=A", "@16384", "M=D", "D=A", "D=D+A", "@16447", "M=D", "HALT"]
+
+    # push constant 3; pop that 5 (THAT = SCREEN); HALT
+    DRAW_VM = (["@256", "D=A", "@0", "M=D", "@16384", "D=A", "@4", "M=D"]
+               + ["@3", "D=A"] + PUSH_D
+               + ["@4", "D=M", "@5", "D=D+A", "@13", "M=D"] + POP_D + ["@13", "A=M", "M=D"]
+               + ["HALT"])
+
+    def make_cpu(self, program, **kwargs):
+        cpu = CPU(**kwargs)
+        screen, keyboard = attach_io(cpu, clock=lambda: cpu.cycles)
+        cpu.load_program(Assembler().assemble(program))
+        return cpu, screen, keyboard
+
+    def test_screen_writes_are_tracked(self):
+        """Every tier reports the written words as dirty"""
+        for kwargs in ({"idioms": False}, {}, {"jit": True}):
+            cpu, screen, _ = self.make_cpu(self.DRAW, **kwargs)
+            cpu.run()
+            self.assertEqual(screen.dirty, {0, 63})
+            self.assertEqual(screen.render(), {"frame": 1, "rows": [0, 1], "words": 2})
+            self.assertEqual(screen.render()["words"], 0)
+            self.assertTrue(screen.pixel(0, 0))
+            self.assertTrue(screen.pixel(511, 1))
+            self.assertFalse(screen.pixel(1, 0))
+
+    def test_superinstruction_writes_reach_screen(self):
+        """pop that N into screen memory goes through the device"""
+        for kwargs in ({"idioms": False}, {}, {"jit": True}):
+            cpu, screen, _ = self.make_cpu(self.DRAW_VM, **kwargs)
+            cpu.run()
+            self.assertEqual(cpu.ram[16389], 3)
+            self.assertEqual(screen.dirty, {5})
+
+    def test_unchanged_words_are_not_dirty(self):
+        """Writing a word's current value does not mark it"""
+        cpu, screen, _ = self.make_cpu(["@16384", "M=0", "HALT"])
+        screen.render()
+        cpu.run()
+        self.assertEqual(screen.dirty, set())
+
+    def test_image_export(self):
+        """PBM and PNG output encode the framebuffer"""
+        cpu, screen, _ = self.make_cpu(self.DRAW)
+        cpu.run()
+        pbm = screen.to_pbm()
+        self.assertTrue(pbm.startswith(b"P4\n512 256\n"))
+        pixels = pbm[len(b"P4\n512 256\n"):]
+        self.assertEqual(pixels[0], 0x80)
+        self.assertEqual(pixels[64 + 63], 0x01)
+        self.assertTrue(screen.to_png().startswith(b"\x89PNG\r\n\x1a\n"))
+
+    def test_keyboard_queue(self):
+        """KBD reads the key held down at the current time"""
+        keyboard = Keyboard(clock=lambda: now)
+        keyboard.type_text("ab", start=1.0, interval=1.0, hold=0.5)
+        now = 0.0
+        self.assertEqual(keyboard.read(24576), 0)
+        now = 1.2
+        self.assertEqual(keyboard.read(24576), ord("a"))
+        now = 1.6
+        self.assertEqual(keyboard.read(24576), 0)
+        now = 2.0
+        self.assertEqual(keyboard.read(24576), ord("b"))
+        self.assertEqual(keyboard.pending(), 1)
+        self.assertEqual(key_code("up"), 131)
+        self.assertEqual(key_code("\n"), 128)
+
+    def test_program_reads_keyboard(self):
+        """@KBD D=M sees queued keys in every tier"""
+        for kwargs in ({"idioms": False}, {}, {"jit": True}):
+            cpu, _, keyboard = self.make_cpu(["@24576", "D=M", "@16", "M=D", "HALT"], **kwargs)
+            keyboard.press("up", at=0)
+            cpu.run()
+            self.assertEqual(cpu.ram[16], 131)
+            self.assertEqual(keyboard.reads, 1)
+
+    def test_reset_clears_devices(self):
+        """CPU.reset releases keys and invalidates the screen"""
+        cpu, screen, keyboard = self.make_cpu(self.DRAW)
+        keyboard.press("x", at=0)
+        keyboard.poll()
+        cpu.reset()
+        self.assertEqual(keyboard.current, 0)
+        self.assertEqual(len(screen.dirty), 8192)
+
+
+class TestTerminal(unittest.TestCase):
+    """Test the incremental terminal renderer"""
+
+    def setUp(self):
+        self.cpu = CPU()
+        self.screen, self.keyboard = attach_io(self.cpu, clock=lambda: self.cpu.cycles)
+        self.stream = io.StringIO()
+
+    def load(self, program):
+        self.cpu.load_program(Assembler().assemble(program))
+
+    def test_first_frame_is_full(self):
+        """The first draw covers every cell in both modes"""
+        for mode, cells in (("braille", 256 * 64), ("half", 512 * 128)):
+            renderer = TerminalRenderer(self.screen, mode, io.StringIO())
+            self.assertEqual(renderer.draw(), cells)
+            self.assertEqual(renderer.draw(), 0)
+
+    def test_only_changed_cells_are_redrawn(self):
+        """One changed pixel rewrites one cell"""
+        renderer = TerminalRenderer(self.screen, stream=self.stream)
+        renderer.draw()
+        self.load(["@1", "D=A", "@16384", "M=D", "HALT"])
+        self.cpu.run()
+        position = len(self.stream.getvalue())
+        self.assertEqual(renderer.draw(), 1)
+        self.assertEqual(self.stream.getvalue()[position:], "\x1b[1;1H\u2801")
+        self.assertTrue(renderer.text().startswith("\u2801\u2800"))
+
+    def test_half_blocks(self):
+        """Half-block cells combine two pixel rows"""
+        self.load(["@3", "D=A", "@16384", "M=D", "@2", "D=A", "@16416", "M=D", "HALT"])
+        self.cpu.run()
+        renderer = TerminalRenderer(self.screen, "half", self.stream)
+        renderer.draw()
+        self.assertTrue(renderer.text().startswith("\u2580\u2588 "))
+
+    def test_decode_keys(self):
+        """Raw input bytes become characters and key names"""
+        self.assertEqual(decode_keys("a\x1b[A\x1b\r\x7f"), ["a", "up", "escape", "newline", "backspace"])
+
+    def test_frame_budget(self):
+        """A fixed budget runs that many cycles per frame until the program stops"""
+        self.load(["@16384", "M=M+1", "@0", "0;JMP"])
+        stats = run_in_terminal(self.cpu, self.screen, self.keyboard, fps=1000,
+                                instructions_per_frame=40, max_frames=3,
+                                renderer=TerminalRenderer(self.screen, stream=self.stream),
+                                sleep=lambda seconds: None)
+        self.assertEqual((stats["frames"], stats["cycles"]), (3, 120))
+        self.assertEqual(self.cpu.ram[16384], 30)
+
+
+class TestSnapshot(unittest.TestCase):
+    """Test snapshot/restore of CPU state"""
+
+    # Write RAM[5] and RAM[1000], then halt
+    PROGRAM = ["@7", "D=A", "@5", "M=D", "@1000", "M=D", "HALT"]
+
+    def setUp(self):
+        self.cpu = CPU()
+        self.cpu.load_program(Assembler().assemble(self.PROGRAM))
+
+    def test_restore_copies_dirty_pages_only(self):
+        """Two written pages are copied back and nothing else"""
+        booted = self.cpu.snapshot()
+        self.cpu.run()
+        self.assertEqual(self.cpu.restore(booted), 2)
+        self.assertEqual((self.cpu.ram[5], self.cpu.ram[1000]), (0, 0))
+        self.assertEqual((self.cpu.A, self.cpu.D, self.cpu.PC, self.cpu.cycles), (0, 0, 0, 0))
+        self.assertEqual(self.cpu.restore(booted), 0)
+        self.assertEqual(self.cpu.run(), (True, 7))
+
+    def test_restore_mid_run(self):
+        """A snapshot taken mid-run resumes with the same results"""
+        self.cpu.run(max_cycles=3)
+        middle = self.cpu.snapshot()
+        self.cpu.run()
+        expected = (self.cpu.A, self.cpu.D, self.cpu.PC, self.cpu.ram[1000])
+        self.cpu.restore(middle)
+        self.assertEqual(self.cpu.cycles, 3)
+        self.assertEqual(self.cpu.run(), (True, 4))
+        self.assertEqual((self.cpu.A, self.cpu.D, self.cpu.PC, self.cpu.ram[1000]), expected)
+
+    def test_restore_reloads_changed_rom(self):
+        """Restoring after loading another program brings the old one back"""
+        booted = self.cpu.snapshot()
+        self.cpu.load_program(Assembler().assemble(["HALT"]))
+        self.cpu.restore(booted)
+        self.assertEqual(self.cpu.run(), (True, 7))
+        self.assertEqual(self.cpu.ram[1000], 7)
+
+    def test_save_and_load(self):
+        """Snapshots round-trip through a compact file"""
+        self.cpu.run()
+        snapshot = self.cpu.snapshot()
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "cpu.snap")
+            snapshot.save(path)
+            self.assertLess(os.path.getsize(path), 2048)
+            loaded = Snapshot.load(path)
+        fresh = CPU()
+        fresh.restore(loaded)
+        self.assertEqual(fresh.ram.memory, self.cpu.ram.memory)
+        self.assertEqual(fresh.rom.memory, self.cpu.rom.memory)
+        self.assertEqual((fresh.A, fresh.D, fresh.PC, fresh.cycles),
+                         (self.cpu.A, self.cpu.D, self.cpu.PC, self.cpu.cycles))
+        with self.assertRaises(ValueError):
+            Snapshot.from_bytes(b"NOTASNAP" + bytes(40))
+
+    def test_size_mismatch(self):
+        """A snapshot only restores into a CPU with the same memory sizes"""
+        with self.assertRaises(ValueError):
+            CPU(ram_size=1024).restore(self.cpu.snapshot())
+
+    def test_screen_pages_are_invalidated(self):
+        """Restored screen pages are redrawn"""
+        screen, _ = attach_io(self.cpu)
+        blank = self.cpu.snapshot()
+        self.cpu.ram[16384 + PAGE_WORDS] = 1
+        screen.render()
+        self.assertEqual(self.cpu.restore(blank), 1)
+        self.assertEqual(screen.dirty, set(range(PAGE_WORDS, 2 * PAGE_WORDS)))
+
+
+class TestBatch(unittest.TestCase):
+    """Test the manifest-driven batch runner"""
+
+    # RAM[2] = RAM[0] + RAM[1]
+    ADD = ["@0", "D=M", "@1", "D=D+M", "@2", "M=D", "HALT"]
+
+    def make_job(self, count):
+        cases = [Case(str(i), {0: i, 1: 2 * i}, {2: 3 * i}) for i in range(count)]
+        cases.append(Case("wrong", {0: 1, 1: 1}, {2: 3}))
+        return Job("add", [int(word, 2) for word in Assembler().assemble(self.ADD)], cases, read=[0])
+
+    def test_results_in_process(self):
+        """Every case runs from a clean state and expectations are checked"""
+        results = list(run_batch([self.make_job(20)], workers=1, chunk_size=7))
+        self.assertEqual(len(results), 21)
+        self.assertTrue(all(r["passed"] for r in results[:20]))
+        self.assertEqual(results[5]["ram"], {"0": 5})
+        self.assertEqual((results[5]["cycles"], results[5]["halted"]), (7, True))
+        self.assertEqual(results[20]["failures"], {"2": {"expected": 3, "actual": 2}})
+
+    def test_process_pool(self):
+        """Pool workers give the same results as an in-process run"""
+        job = self.make_job(50)
+        serial = sorted(json.dumps(r, sort_keys=True) for r in run_batch([job], workers=1))
+        pooled = sorted(json.dumps(r, sort_keys=True) for r in run_batch([job], workers=2, chunk_size=8))
+        self.assertEqual(serial, pooled)
+
+    def test_load_manifest(self):
+        """Manifest paths are relative and RAM lists fill consecutive words"""
+        with tempfile.TemporaryDirectory() as directory:
+            with open(os.path.join(directory, "Add.hack"), "w") as f:
+                f.write("\n".join(Assembler().assemble(self.ADD)) + "\n")
+            manifest = {"jobs": [{"rom": "Add.hack", "max_cycles": 3, "read": [2],
+                                  "cases": [{"ram": {"0": [4, 5]}}, {"ram": {"0": [4, 5]}, "max_cycles": 100}]}]}
+            with open(os.path.join(directory, "manifest.json"), "w") as f:
+                json.dump(manifest, f)
+            jobs = load_manifest(os.path.join(directory, "manifest.json"))
+        results = list(run_batch(jobs, workers=1))
+        self.assertEqual([(r["cycles"], r["halted"], r["ram"]) for r in results],
+                         [(3, False, {"2": 0}), (7, True, {"2": 9})])
+
+
+@unittest.skipIf(np is None, "NumPy not installed")
+class TestLockstep(unittest.TestCase):
+    """Test lockstep execution of many RAM states"""
+
+    # RAM[2] = RAM[0] * RAM[1] by repeated addition, then HALT
+    MULTIPLY = ["@2", "M=0", "@1", "D=M", "@15", "D;JEQ", "@0", "D=M", "@2", "M=D+M",
+                "@1", "M=M-1", "@2", "0;JMP", "HALT", "HALT"]
+
+    def setUp(self):
+        self.binary = Assembler().assemble(self.MULTIPLY)
+        self.inputs = [(3, 4), (7, 0), (0, 9), (300, 250), (5, 5), (1, 31)]
+
+    def test_lanes_match_separate_runs(self):
+        """Every lane ends exactly where its own CPU.run would"""
+        for budget in (1, 9, 40, 100_000):
+            machines = LockstepCPU(len(self.inputs), ram_size=64)
+            machines.load_program(self.binary)
+            machines.ram[:, 0:2] = self.inputs
+            halted, cycles = machines.run(max_cycles=budget)
+            for lane, (x, y) in enumerate(self.inputs):
+                cpu = CPU(ram_size=64)
+                cpu.load_program(self.binary)
+                cpu.ram[0], cpu.ram[1] = x, y
+                self.assertEqual(cpu.run(max_cycles=budget), (bool(halted[lane]), int(cycles[lane])))
+                self.assertEqual((cpu.A, cpu.D, cpu.PC),
+                                 (int(machines.A[lane]), int(machines.D[lane]), int(machines.PC[lane])))
+                self.assertEqual(list(cpu.ram.memory), machines.ram[lane].tolist())
+
+    def test_products(self):
+        """Divergent loop counts regroup and all lanes finish"""
+        machines = LockstepCPU(len(self.inputs), ram_size=64)
+        machines.load_program(self.binary)
+        machines.ram[:, 0:2] = self.inputs
+        halted, _ = machines.run(max_cycles=100_000)
+        self.assertTrue(halted.all())
+        self.assertEqual(machines.ram[:, 2].tolist(), [(x * y) & 0xFFFF for x, y in self.inputs])
+
+    def test_out_of_range_addresses(self):
+        """Per-lane addresses past the end of RAM read 0 and drop writes"""
+        machines = LockstepCPU(2, ram_size=16)
+        machines.load_program(Assembler().assemble(["@0", "A=M", "M=1", "D=M", "@1", "M=D", "HALT"]))
+        machines.ram[:, 0] = [5, 100]
+        machines.run()
+        self.assertEqual(machines.ram[:, 1].tolist(), [1, 0])
+
+
+class TestProfiler(unittest.TestCase):
+    """Test per-PC counts and label/function aggregation"""
+
+    NESTED_CALL = VM_EXAMPLES_DIR / 'NestedCallTest' / 'NestedCallTest.asm'
+
+    def test_counts_add_up(self):
+        """Every cycle lands on one address and the run matches CPU.run"""
+        binary, labels = assemble_with_labels(self.NESTED_CALL)
+        for idioms in (False, True):
+            plain = CPU(idioms=idioms)
+            plain.load_program(binary)
+            cpu = CPU(idioms=idioms)
+            cpu.load_program(binary)
+            profiler = Profiler(cpu, labels)
+            for budget in (1, 37, 5000):
+                self.assertEqual(profiler.run(max_cycles=budget), plain.run(max_cycles=budget))
+            self.assertEqual((cpu.A, cpu.D, cpu.PC), (plain.A, plain.D, plain.PC))
+            self.assertEqual(cpu.ram.memory, plain.ram.memory)
+            self.assertEqual(sum(profiler.instruction_counts()), profiler.cycles)
+            self.assertEqual(cpu.cycles, 5038)
+
+    def test_functions_and_labels(self):
+        """Cycles are grouped by function and by label"""
+        binary, labels = assemble_with_labels(self.NESTED_CALL)
+        cpu = CPU()
+        cpu.load_program(binary)
+        profiler = Profiler(cpu, labels)
+        profiler.run(max_cycles=5000)
+        functions = dict(profiler.by_function())
+        self.assertEqual(set(functions), {"(top)", "Sys.init", "Main.main", "Main.square", "Math.multiply"})
+        self.assertEqual(sum(functions.values()), 5000)
+        self.assertIn("Math.multiply$MULT_LOOP", dict(profiler.by_label()))
+        self.assertEqual(profiler.function_of(labels["Math.multiply$MULT_LOOP"]), "Math.multiply")
+        self.assertEqual(profiler.hotspots(1)[0][2], "Sys.init$SYS_HALT")
+        self.assertIn("Function", profiler.report())
+
+    def test_collapsed_stacks(self):
+        """The shadow call stack follows calls and returns"""
+        binary, labels = assemble_with_labels(self.NESTED_CALL)
+        cpu = CPU()
+        cpu.load_program(binary)
+        profiler = Profiler(cpu, labels)
+        profiler.run(max_cycles=5000)
+        stacks = dict(line.rsplit(" ", 1) for line in profiler.collapsed())
+        self.assertIn("(top);Sys.init;Main.main;Main.square;Math.multiply", stacks)
+        self.assertEqual(profiler.stack, ("(top)", "Sys.init"))
+        self.assertEqual(sum(int(cycles) for cycles in stacks.values()), 5000)
+
+
+class TestDebugger(unittest.TestCase):
+    """Test breakpoints, watchpoints and VM frames"""
+
+    NESTED_CALL = VM_EXAMPLES_DIR / 'NestedCallTest' / 'NestedCallTest.asm'
+
+    def machine(self, **options):
+        binary, labels = assemble_with_labels(self.NESTED_CALL)
+        cpu = CPU(**options)
+        cpu.load_program(binary)
+        return cpu, Debugger(cpu, labels)
+
+    def test_breakpoint_and_frames(self):
+        """cont() stops before a label; frames() walks the VM call chain"""
+        for options in ({}, {"jit": True}):
+            cpu, debugger = self.machine(**options)
+            debugger.break_at("Math.multiply")
+            stop = debugger.cont(max_cycles=5000)
+            self.assertEqual((stop.reason, stop.pc), ("breakpoint", debugger.index.labels["Math.multiply"]))
+            frames = debugger.frames()
+            self.assertEqual([frame["function"] for frame in frames],
+                             ["Math.multiply", "Main.square", "Main.main", "Sys.init"])
+            self.assertEqual(frames[0]["arguments"], [3, 3])
+
+    def test_traps_are_removed(self):
+        """The fused code is unchanged after a run with breakpoints"""
+        cpu, debugger = self.machine()
+        original = list(cpu.fused_code)
+        debugger.break_at("Math.multiply$MULT_LOOP", condition=lambda cpu: cpu.D == 2)
+        self.assertEqual(debugger.cont(max_cycles=5000).reason, "breakpoint")
+        self.assertEqual(cpu.fused_code, original)
+
+        plain, _ = self.machine()
+        plain.run(max_cycles=5000)
+        debugger.clear("Math.multiply$MULT_LOOP")
+        debugger.cont(max_cycles=5000 - cpu.cycles)
+        self.assertEqual(cpu.ram.memory, plain.ram.memory)
+
+    def test_run_to_return(self):
+        """run_to_return stops in the caller with the return value pushed"""
+        cpu, debugger = self.machine()
+        debugger.break_at("Math.multiply")
+        debugger.cont(max_cycles=5000)
+        stop = debugger.run_to_return(max_cycles=5000)
+        self.assertEqual(stop.reason, "return")
+        self.assertEqual(debugger.frames()[0]["function"], "Main.square")
+        self.assertEqual(cpu.ram.memory[cpu.ram.memory[0] - 1], 9)
+
+    def test_watchpoints(self):
+        """Watchpoints report the instruction that wrote or read a word"""
+        cpu, debugger = self.machine()
+        debugger.watch("SP", mode="w", condition=lambda cpu: cpu.ram.memory[0] > 270)
+        stop = debugger.cont(max_cycles=5000)
+        self.assertEqual((stop.reason, stop.address), ("write", 0))
+        self.assertEqual(stop.new, 271)
+        self.assertEqual(stop.old, 270)
+
+        debugger.unwatch("SP")
+        debugger.watch(256, mode="r")
+        self.assertEqual(debugger.cont(max_cycles=5000).reason, "budget")
+
+
+class TestReplay(unittest.TestCase):
+    """Test KBD recording, checkpoints, traces and seeking"""
+
+    # Adds every KBD read to RAM[16] and counts loops in RAM[17]
+    PROGRAM = ["@24576", "D=M", "@16", "M=D+M", "@17", "M=M+1", "@0", "0;JMP"]
+
+    def record(self, trace=False):
+        cpu = CPU()
+        cpu.check_interval = 256
+        _, keyboard = attach_io(cpu, clock=lambda: cpu.cycles)
+        cpu.load_program(Assembler().assemble(self.PROGRAM))
+        for i, char in enumerate("hello"):
+            keyboard.press(char, at=500 + 3000 * i, duration=700)
+        recorder = Recorder(cpu, keyboard, checkpoint_interval=2000, trace=trace)
+        for _ in range(10):
+            recorder.run(max_cycles=2000)
+        recording = recorder.stop()
+        self.assertIs(cpu.devices[1], keyboard)
+        return cpu, Recording.from_bytes(recording.to_bytes())
+
+    def test_replay_matches_recording(self):
+        """Seeking to the end reproduces the recorded RAM in every tier"""
+        cpu, recording = self.record()
+        self.assertEqual(len(recording.events), 10)  # Five presses and releases
+        self.assertGreater(len(recording.checkpoints), 5)
+        for jit in (False, True):
+            replayer = Replayer(recording, jit=jit)
+            replayer.seek(recording.end)
+            self.assertEqual(replayer.cpu.ram.memory[:18], cpu.ram.memory[:18])
+            self.assertEqual(replayer.cpu.cycles, 20000)
+
+    def test_seek_backwards(self):
+        """Seeking back restores a checkpoint; the state only depends on the cycle"""
+        _, recording = self.record()
+        replayer = Replayer(recording)
+        replayer.seek(5000)
+        state = replayer.cpu.ram.memory[:18]
+        replayer.seek(19000)
+        self.assertLessEqual(replayer.seek(5000), 2000)
+        self.assertEqual(replayer.cpu.ram.memory[:18], state)
+
+    def test_trace_and_bisect(self):
+        """The trace logs PCs and RAM writes; bisect finds the same moment"""
+        cpu, recording = self.record(trace=True)
+        records = list(recording.trace_records())
+        self.assertEqual(len(records), 20000)
+        self.assertEqual(records[3], (3, 3, 16, 0))
+        self.assertEqual(records[4][2:], (None, None))
+        first = next(cycle for cycle, _, address, value in records if address == 16 and value > 3000)
+
+        replayer = Replayer(recording)
+        self.assertEqual(replayer.bisect(lambda cpu: cpu.ram[16] > 3000), first + 1)
+        self.assertIsNone(replayer.bisect(lambda cpu: cpu.ram[17] > 5000))
+
+
+class TestImage(unittest.TestCase):
+    """Test binary ROM images"""
+
+    NESTED_CALL = VM_EXAMPLES_DIR / 'NestedCallTest' / 'NestedCallTest.asm'
+
+    def test_round_trip(self):
+        """Words, symbols and sections survive save/load and match the text program"""
+        binary, labels = assemble_with_labels(self.NESTED_CALL)
+        image = read_program(self.NESTED_CALL)
+        self.assertEqual(image.symbols, labels)
+        self.assertEqual(image.sections[0], ("Main.main", labels["Main.main"],
+                                             labels["Main.square"] - labels["Main.main"]))
+        with tempfile.TemporaryDirectory() as scratch:
+            path = os.path.join(scratch, "prog.rom")
+            image.save(path)
+            loaded = load_image(path)
+            text = os.path.join(scratch, "prog.hack")
+            with open(text, "w") as f:
+                f.write(loaded.to_hack())
+            self.assertEqual(read_program(text).words, loaded.words)
+        self.assertEqual(loaded.symbols, image.symbols)
+        self.assertEqual(loaded.sections, image.sections)
+
+        plain = CPU()
+        plain.load_program(binary)
+        cpu = CPU()
+        cpu.load_program_binary(loaded.words)
+        self.assertEqual(cpu.rom.memory, plain.rom.memory)
+
+    def test_load_buffer(self):
+        """ROM.load_program_binary copies little-endian words out of a buffer"""
+        rom = ROM(8)
+        rom.load_program_binary(bytes([0x01, 0x00, 0xFF, 0xFF, 0x34, 0x12]))
+        self.assertEqual(list(rom.memory[:4]), [1, 0xFFFF, 0x1234, 0])
+        rom.load_program_binary(memoryview(HackImage(array('H', [7, 8])).to_bytes())[24:])
+        self.assertEqual(list(rom.memory[:3]), [7, 8, 0x1234])
+        rom.load_program_binary([5, 6])
+        self.assertEqual(list(rom.memory[:2]), [5, 6])
+
+    def test_bad_image(self):
+        with self.assertRaises(ValueError):
+            HackImage.from_buffer(b"HACKSNAP" + bytes(16))
+        with self.assertRaises(ValueError):
+            HackImage.from_buffer(HackImage(array('H', [1, 2])).to_bytes()[:-1])
+
+
+class TestSpinLoops(unittest.TestCase):
+    """Test fast-forwarding of idle and counting loops"""
+
+    # RAM[16] = 300, count it down to 0 adding 3 to RAM[17] each time, then (END) @12 0;JMP
+    COUNTDOWN = ["@300", "D=A", "@16", "M=D",
+                 "@17", "M=M+1", "M=M+1", "M=M+1", "@16", "MD=M-1", "@4", "D;JGT",
+                 "@12", "0;JMP"]
+
+    def setUp(self):
+        self.binary = Assembler().assemble(self.COUNTDOWN)
+
+    def run_both(self, cycles, **kwargs):
+        cpus = []
+        for fast_forward in (False, True):
+            cpu = CPU(fast_forward=fast_forward)
+            cpu.load_program(self.binary)
+            for name, value in kwargs.items():
+                setattr(cpu, name, value)
+            cpus.append((cpu, cpu.run(max_cycles=cycles)))
+        return cpus
+
+    def test_find_loops(self):
+        cpu = CPU()
+        cpu.load_program(self.binary)
+        cpu.ensure_decoded()
+        self.assertEqual(find_loops(cpu.code), {4: 11, 12: 13})
+
+    def test_same_state_as_plain_run(self):
+        """Fast-forwarding gives the registers, RAM and cycle counts of a plain run"""
+        for cycles in (5, 100, 2411, 2412, 2413, 100_000):
+            (plain, expected), (cpu, result) = self.run_both(cycles)
+            self.assertEqual(result, expected)
+            self.assertEqual((cpu.A, cpu.D, cpu.PC, cpu.cycles),
+                             (plain.A, plain.D, plain.PC, plain.cycles))
+            self.assertEqual(cpu.ram.memory[:32], plain.ram.memory[:32])
+        self.assertEqual(list(cpu.ram.memory[16:18]), [0, 900])
+        self.assertGreater(sum(cpu.spin_loops.skipped.values()), 40_000)
+
+    def test_stop_when_idle(self):
+        """An idle loop ends run() as halted when stop_when_idle is set"""
+        (plain, _), (cpu, result) = self.run_both(100_000, stop_when_idle=True)
+        self.assertEqual(result, (True, cpu.cycles))
+        self.assertLess(cpu.cycles, 2500)
+        self.assertEqual(cpu.PC, 12)
+        self.assertEqual(cpu.ram.memory[17], 900)
+
+    def test_hooks_fire_at_the_same_cycles(self):
+        """Check hooks see the same cycles and RAM with and without fast-forwarding"""
+        logs = []
+        for fast_forward in (False, True):
+            cpu = CPU(fast_forward=fast_forward)
+            cpu.load_program(self.binary)
+            cpu.check_interval = 100
+            log = []
+            cpu.add_check_hook(lambda cpu: log.append((cpu.cycles, cpu.ram.memory[16], cpu.ram.memory[17])))
+            cpu.run(max_cycles=5000)
+            logs.append(log)
+        self.assertEqual(logs[0], logs[1])
+        self.assertEqual(len(logs[0]), 50)
+
+
+class TestIntrinsics(unittest.TestCase):
+    """Test Python implementations of VM functions"""
+
+    FACTORIAL = VM_EXAMPLES_DIR / 'Factorial' / 'Factorial.asm'
+
+    def setUp(self):
+        self.binary, labels, variables = assemble_with_symbols(self.FACTORIAL)
+        self.symbols = {**labels, **variables}
+
+    def run_factorial(self, cycles=None, max_cycles=100_000):
+        cpu = CPU()
+        cpu.stop_when_idle = True
+        cpu.load_program(self.binary)
+        intrinsics = None
+        if cycles:
+            intrinsics = Intrinsics(cpu, self.symbols, cycles=cycles)
+            self.assertEqual(intrinsics.register_os(), ["Math.multiply"])
+            cpu.use_intrinsics(intrinsics)
+        result = cpu.run(max_cycles=max_cycles)
+        return cpu, result, intrinsics
+
+    def test_same_result_as_rom_code(self):
+        """5! through the intrinsic leaves the stack, registers and frame pointers as the VM code does"""
+        plain, (halted, plain_cycles), _ = self.run_factorial()
+        self.assertTrue(halted)
+        for mode in ("native", "estimated"):
+            cpu, (halted, cycles), intrinsics = self.run_factorial(mode)
+            self.assertTrue(halted)
+            self.assertEqual(intrinsics.calls["Math.multiply"], 4)
+            self.assertEqual((cpu.A, cpu.D, cpu.PC), (plain.A, plain.D, plain.PC))
+            sp = plain.ram.memory[0]
+            self.assertEqual(cpu.ram.memory[:sp], plain.ram.memory[:sp])
+            self.assertEqual(cpu.ram.memory[sp - 1], 120)
+            if mode == "native":
+                self.assertLess(cycles, plain_cycles)
+            else:
+                self.assertEqual(cycles - self.run_factorial("native")[1][1],
+                                 sum(multiply(None, x, y)[1] - 1 for x, y in ((2, 1), (3, 2), (4, 6), (5, 24))))
+
+    def test_budget_runs_rom_code(self):
+        """A call whose estimate does not fit the budget runs the function's code"""
+        cpu, (_, cycles), intrinsics = self.run_factorial("estimated", max_cycles=2000)
+        self.assertEqual(cycles, 2000)
+        self.assertGreater(intrinsics.declined["Math.multiply"], 0)
+        self.assertEqual(Intrinsics(cpu, self.symbols).register("Nope.nothing", multiply, 2), False)
+        with self.assertRaises(ValueError):
+            Intrinsics(cpu, self.symbols, cycles="free")
+
+    def test_math(self):
+        """16-bit results as the compiled Math.jack computes them"""
+        self.assertEqual(multiply(None, 300, 0xFFFE)[0], 0xFFFF & -600)
+        self.assertEqual(multiply(None, 1000, 1000)[0], 1_000_000 & 0xFFFF)
+        self.assertEqual(divide(None, 0xFFFF & -7, 2)[0], 0xFFFF & -3)
+        self.assertEqual(divide(None, 30000, 7)[0], 4285)
+        self.assertIsNone(divide(None, 5, 0))
+        self.assertEqual([sqrt(None, x)[0] for x in (0, 1, 2, 16, 99, 32767)], [0, 1, 1, 4, 9, 181])
+        self.assertIsNone(sqrt(None, 0x8000))
+
+    def test_memory(self):
+        """First-fit alloc splitting the free block, deAlloc pushing onto the free list"""
+        memory = array('H', bytes(2 * 4096))
+        free_list = 20
+        memory[free_list] = 2048
+        memory[2048] = 100
+        alloc, dealloc = alloc_from(free_list), dealloc_to(free_list)
+
+        def call(function, argument):
+            result, _, writes = function(memory, argument)
+            for address, value in writes:
+                memory[address] = value
+            return result
+
+        self.assertEqual(alloc(memory, 10)[0], 2138)
+        self.assertEqual((memory[2137], memory[2048]), (0, 100))  # Nothing written until accepted
+        block = call(alloc, 10)
+        self.assertEqual((block, memory[block - 1], memory[2048]), (2138, 11, 89))
+        call(dealloc, block)
+        self.assertEqual((memory[free_list], memory[2138]), (2137, 2048))
+        self.assertEqual(call(alloc, 9), 2138)  # The whole 11-word block, now first in the list
+        self.assertEqual(memory[free_list], 2048)
+        self.assertIsNone(alloc(memory, 500))
+
+    # Memory.alloc and Memory.deAlloc stubs that jump to END, for calls
+    # set up by run_heap
+    HEAP = ("@Memory.alloc\n0;JMP\n@Memory.deAlloc\n0;JMP\n"
+            "(Memory.alloc)\n@Memory.1\n@END\n0;JMP\n(Memory.deAlloc)\n@END\n0;JMP\n(END)\n@END\n0;JMP\n")
+
+    def run_heap(self, start, argument, max_cycles, intrinsics, free_block=2048):
+        """Call the stub at start with one argument; returns (cpu, Intrinsics or None, freeList address)"""
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'Heap.asm')
+            with open(path, 'w') as f:
+                f.write(self.HEAP)
+            binary, labels, variables = assemble_with_symbols(path)
+        free_list = variables['Memory.1']
+        cpu = CPU()
+        cpu.load_program(binary)
+        memory = cpu.ram.memory
+        memory[free_list] = free_block
+        memory[2048] = 14336
+        memory[3000] = 7  # A 6-word block at 3001 for deAlloc
+        # Call frame: one argument at ARG = 256, return address END
+        memory[0], memory[1], memory[2] = 262, 262, 256
+        memory[256], memory[257] = argument, labels['END']
+        cpu.PC = start
+        registry = None
+        if intrinsics:
+            registry = Intrinsics(cpu, {**labels, **variables})
+            self.assertEqual(registry.register_os(), ["Memory.alloc", "Memory.deAlloc"])
+            cpu.use_intrinsics(registry)
+        cpu.run(max_cycles=max_cycles)
+        return cpu, registry, free_list
+
+    def test_memory_over_budget_leaves_heap(self):
+        """alloc and deAlloc declined for the budget leave the heap to the ROM code"""
+        for start, argument, name in ((0, 10, "Memory.alloc"), (2, 3001, "Memory.deAlloc")):
+            plain = self.run_heap(start, argument, 5, False)[0].ram.memory
+            cpu, registry, _ = self.run_heap(start, argument, 5, True)
+            self.assertEqual(registry.declined[name], 1)
+            self.assertEqual(cpu.ram.memory[16:], plain[16:])
+            cpu, registry, _ = self.run_heap(start, argument, 100_000, True)
+            self.assertEqual(registry.calls[name], 1)
+            self.assertNotEqual(cpu.ram.memory[16:], plain[16:])
+
+    def test_memory_addresses_wrap(self):
+        """Heap addresses wrap to 16 bits and read 0 past the end of RAM, as in the CPU"""
+        cpu, registry, free_list = self.run_heap(2, 0, 100_000, True)  # deAlloc(0): block -1
+        self.assertEqual(registry.calls["Memory.deAlloc"], 1)
+        self.assertEqual(cpu.ram.memory[free_list], 0xFFFF)
+        cpu, registry, _ = self.run_heap(0, 10, 100_000, True, free_block=0xF000)
+        self.assertEqual(registry.declined["Memory.alloc"], 1)  # Size 0 and next 0: no fit
+
+
+class TestStats(unittest.TestCase):
+    """Test instruction-mix statistics"""
+
+    def test_mix(self):
+        """Counts by kind, comp, dest and jump; M traffic and taken branches"""
+        cpu = CPU()
+        cpu.load_program(Assembler().assemble(TestSpinLoops.COUNTDOWN))
+        stats = InstructionStats(cpu)
+        self.assertEqual(stats.run(max_cycles=100), (False, 100))  # Setup and 12 iterations
+        self.assertEqual(cpu.ram.memory[16:18].tolist(), [288, 36])
+        summary = stats.summary()
+        self.assertEqual(summary["instructions"], {"A": 38, "C": 62, "HALT": 0})
+        self.assertEqual(summary["memory"], {"reads": 48, "writes": 49})
+        self.assertEqual(summary["comp"]["M+1"], 36)
+        self.assertEqual(summary["dest"]["MD"], 12)
+        self.assertEqual(summary["jump"], {"JGT": {"executed": 12, "taken": 12}})
+        self.assertEqual(summary["branches"]["taken_ratio"], 1.0)
+        self.assertEqual(summary["top"][0], ["M=M+1", 36])
+        self.assertEqual(json.loads(stats.to_json()), json.loads(json.dumps(summary)))
+        self.assertIn("JGT", stats.report())
+
+    def test_superinstructions_spread(self):
+        """Fused and plain runs give the same statistics and the same state as CPU.run"""
+        binary = assemble_with_labels(VM_EXAMPLES_DIR / 'NestedCallTest' / 'NestedCallTest.asm')[0]
+        summaries = []
+        for idioms in (True, False):
+            cpu, reference = CPU(idioms=idioms), CPU(idioms=idioms, fast_forward=False)
+            cpu.load_program(binary)
+            reference.load_program(binary)
+            stats = InstructionStats(cpu)
+            self.assertEqual(stats.run(max_cycles=700), reference.run(max_cycles=700))
+            self.assertEqual((cpu.A, cpu.D, cpu.PC), (reference.A, reference.D, reference.PC))
+            self.assertEqual(cpu.ram.memory, reference.ram.memory)
+            summaries.append(stats.summary())
+        self.assertEqual(summaries[0], summaries[1])
+        self.assertGreater(summaries[0]["branches"]["conditional"], 0)
+
+
+class TestExtendedISA(unittest.TestCase):
+    """Test the multiply and shift instructions of CPU(extended_isa=True)"""
+
+    # RAM[2..5] = x * y, x << y, x >> y, x << 4 for x = RAM[0], y = RAM[1]
+    PROGRAM = ["@0", "D=M", "@1", "D=D*M", "@2", "M=D",
+               "@0", "D=M", "@1", "D=D<<M", "@3", "M=D",
+               "@0", "D=M", "@1", "D=D>>M", "@4", "M=D",
+               "@0", "D=M", "@4", "D=D<<A", "@5", "M=D", "HALT"]
+    INPUTS = [(3, 4), (300, 250), (0xFFFF, 2), (0x8001, 15), (7, 17), (0, 9)]
+
+    def setUp(self):
+        self.binary = Assembler(extended=True).assemble(self.PROGRAM)
+
+    def expected(self, x, y):
+        return [(x * y) & 0xFFFF, (x << (y & 15)) & 0xFFFF, x >> (y & 15), (x << 4) & 0xFFFF]
+
+    def test_alu_and_assembler(self):
+        """Extended comps assemble and compute only when enabled"""
+        alu = ALU(extended=True)
+        self.assertEqual(alu.compute(0b000001, 0xFFFF, 3), 0xFFFD)
+        self.assertEqual(alu.compute(0b000011, 1, 20), 16)
+        self.assertEqual(alu.compute(0b000100, 0x8000, 15), 1)
+        with self.assertRaises(KeyError):
+            ALU().compute(0b000001, 2, 3)
+
+        self.assertEqual(self.binary[3], "1111000001010000")  # D=D*M
+        with self.assertRaises(KeyError):
+            Assembler().assemble(["D=D*M"])
+
+        cpu = CPU()
+        cpu.load_program(self.binary)
+        with self.assertRaises(KeyError):
+            cpu.run()
+
+    def test_interpreter_and_jit(self):
+        """Both run loops and step() compute the same products and shifts"""
+        for x, y in self.INPUTS:
+            results = []
+            for cpu in (CPU(extended_isa=True), CPU(extended_isa=True, jit=True)):
+                cpu.load_program(self.binary)
+                cpu.ram[0], cpu.ram[1] = x, y
+                self.assertEqual(cpu.run(max_cycles=100), (True, len(self.PROGRAM)))
+                results.append(cpu.ram.memory[2:6])
+            stepped = CPU(extended_isa=True)
+            stepped.load_program(self.binary)
+            stepped.ram[0], stepped.ram[1] = x, y
+            while stepped.step():
+                pass
+            results.append(stepped.ram.memory[2:6])
+            for result in results:
+                self.assertEqual(list(result), self.expected(x, y))
+
+    @unittest.skipIf(np is None, "NumPy not installed")
+    def test_lockstep(self):
+        """Every lane computes what CPU(extended_isa=True) does"""
+        machines = LockstepCPU(len(self.INPUTS), ram_size=64, extended_isa=True)
+        machines.load_program(self.binary)
+        machines.ram[:, 0:2] = self.INPUTS
+        halted, _ = machines.run(max_cycles=100)
+        self.assertTrue(halted.all())
+        self.assertEqual(machines.ram[:, 2:6].tolist(), [self.expected(x, y) for x, y in self.INPUTS])
+
+
+class TestPipeline(unittest.TestCase):
+    """Test the pipeline timing model"""
+
+    def time(self, program, pipeline="classic", max_cycles=100):
+        cpu = CPU()
+        cpu.load_program(Assembler().assemble(program))
+        model = PipelineModel(cpu, PIPELINES[pipeline])
+        model.run(max_cycles=max_cycles)
+        return model
+
+    def test_hazards(self):
+        """Each hazard costs the cycles between its producer and consumer stages"""
+        model = self.time(["@16", "M=1", "D=M", "HALT"])  # M written in WB, read in MEM
+        self.assertEqual((model.instructions, model.cycles), (4, 9))
+        self.assertEqual(model.stall_totals(), {"data": 0, "address": 0, "memory": 1, "branch": 0})
+        self.assertEqual(model.stalls[2][2], 1)
+
+        model = self.time(["@16", "A=M", "D=M", "HALT"])  # A from EX used as an address in MEM
+        self.assertEqual(model.stall_totals()["address"], 1)
+
+        self.assertEqual(self.time(["@3", "D=A", "HALT"]).stall_totals()["data"], 0)
+        model = self.time(["@3", "D=A", "HALT"], "no-forwarding")  # D=A waits in ID for @3's WB
+        self.assertEqual(model.stall_totals()["data"], 2)
+
+        model = self.time(["@0", "0;JMP"], max_cycles=4)  # Taken jumps flush IF, ID and MEM
+        self.assertEqual((model.cycles, model.stall_totals()["branch"], model.taken[1]), (14, 6, 2))
+
+    def test_matches_cpu_and_reports(self):
+        """Functional results match CPU.run; CPI, stall totals and hot spots add up"""
+        binary, labels = assemble_with_labels(VM_EXAMPLES_DIR / 'NestedCallTest' / 'NestedCallTest.asm')
+        reference = CPU(fast_forward=False)
+        reference.load_program(binary)
+        self.assertEqual(reference.run(max_cycles=700), (False, 700))
+
+        cpis = []
+        for pipeline in ("classic", "no-forwarding", "deep"):
+            cpu = CPU()
+            cpu.load_program(binary)
+            model = PipelineModel(cpu, PIPELINES[pipeline], labels)
+            for chunk in (1, 299, 400):
+                model.run(max_cycles=chunk)
+            self.assertEqual((cpu.A, cpu.D, cpu.PC), (reference.A, reference.D, reference.PC))
+            self.assertEqual(cpu.ram.memory, reference.ram.memory)
+
+            summary = model.summary(limit=1000)
+            depth = len(PIPELINES[pipeline].stages)
+            self.assertEqual(summary["cycles"], 700 + summary["stall_cycles"] + depth - 1)
+            self.assertEqual(sum(spot["total"] for spot in summary["hot_spots"]), summary["stall_cycles"])
+            self.assertEqual(json.loads(model.to_json()), json.loads(json.dumps(model.summary())))
+            self.assertIn("CPI", model.report())
+            cpis.append(summary["cpi"])
+        self.assertLess(cpis[0], cpis[1])
+        self.assertLess(cpis[0], cpis[2])
+        self.assertIn(model.hot_spots(1)[0]["label"], labels)
+
+    def test_config_validation(self):
+        """Stage roles must exist and be in pipeline order"""
+        with self.assertRaises(ValueError):
+            PipelineConfig(branch="XX")
+        with self.assertRaises(ValueError):
+            PipelineConfig(stages=("IF", "ID", "EX", "MEM", "WB"))
+
+
+class TestBranchPredictors(unittest.TestCase):
+    """Test branch predictors attached to CPU.run"""
+
+    # 100 iterations of a backward D;JNE around a D;JEQ taken every other time
+    ALTERNATING = ["@100", "D=A", "@16", "M=D",
+                   "@17", "M=!M", "D=M", "@11", "D;JEQ", "@18", "M=M+1",
+                   "@16", "MD=M-1", "@4", "D;JNE", "HALT"]
+
+    def attach(self, binary, direction, idioms=True, labels=None):
+        cpu = CPU(idioms=idioms)
+        cpu.load_program(binary)
+        predictor = BranchPredictor(cpu, direction, labels=labels)
+        cpu.use_branch_predictor(predictor)
+        return cpu, predictor
+
+    def test_every_jump_observed(self):
+        """Each predictor sees every jump; history-based ones learn the alternating branch"""
+        binary = Assembler().assemble(self.ALTERNATING)
+        mispredicted = {}
+        for name in PREDICTORS:
+            cpu, predictor = self.attach(binary, name)
+            self.assertEqual(cpu.run(max_cycles=10_000), (True, 1005))  # Not fast-forwarded
+            self.assertEqual(cpu.ram[18], 50)
+            self.assertEqual((predictor.executed[8], predictor.taken[8]), (100, 50))
+            self.assertEqual((predictor.executed[14], predictor.taken[14]), (100, 99))
+            mispredicted[name] = predictor.mispredicted[8]
+        self.assertEqual(mispredicted["btfn"], 50)   # Forward: always predicted not taken
+        self.assertEqual(mispredicted["bimodal"], 50)
+        self.assertLess(mispredicted["gshare"], 10)
+        self.assertLess(mispredicted["tournament"], 10)
+
+        cpu, predictor = self.attach(binary, "bimodal")
+        cpu.use_branch_predictor(None)
+        self.assertEqual(cpu.run(max_cycles=10_000)[0], True)
+        self.assertEqual(sum(predictor.executed), 0)
+
+    def test_vm_calls_and_reports(self):
+        """Call/return sites use the return stack; fused and plain runs agree with CPU.run"""
+        binary, labels = assemble_with_labels(VM_EXAMPLES_DIR / 'NestedCallTest' / 'NestedCallTest.asm')
+        reference = CPU(fast_forward=False)
+        reference.load_program(binary)
+        reference.run(max_cycles=3000)
+        summaries = []
+        for idioms in (True, False):
+            cpu, predictor = self.attach(binary, "tournament", idioms, labels)
+            cpu.run(max_cycles=3000)
+            self.assertEqual((cpu.A, cpu.D, cpu.PC), (reference.A, reference.D, reference.PC))
+            self.assertEqual(cpu.ram.memory, reference.ram.memory)
+            summaries.append(predictor.summary())
+        self.assertEqual(summaries[0], summaries[1])
+
+        jumps = summaries[0]["jumps"]
+        self.assertGreater(jumps["call"]["executed"], 0)
+        self.assertEqual(jumps["return"]["executed"], jumps["call"]["executed"] - 1)  # Sys.init never returns
+        self.assertEqual(jumps["return"]["mispredicted"], 0)
+        self.assertIn(CALL, predictor.kinds)
+        self.assertIn(RETURN, predictor.kinds)
+        self.assertTrue(all(site["label"] in labels or site["label"] == "(top)" for site in summaries[0]["sites"]))
+        self.assertEqual(sum(row["executed"] for row in summaries[0]["labels"]), jumps["all"]["executed"])
+        self.assertEqual(json.loads(predictor.to_json()), json.loads(json.dumps(predictor.summary())))
+        self.assertIn("accuracy", predictor.report())
+
+    def test_jit_and_pipeline(self):
+        """The JIT refuses a predictor; the pipeline model charges only mispredictions"""
+        with self.assertRaises(ValueError):
+            CPU(jit=True).use_branch_predictor(BranchPredictor(CPU(), "btfn"))
+
+        binary = Assembler().assemble(self.ALTERNATING)
+        costs = {}
+        for name in (None, "btfn", "gshare"):
+            cpu = CPU()
+            cpu.load_program(binary)
+            predictor = BranchPredictor(cpu, name) if name else None
+            model = PipelineModel(cpu, PIPELINES["classic"], predictor=predictor)
+            model.run(max_cycles=10_000)
+            costs[name] = model.stall_totals()["branch"]
+            if predictor:
+                self.assertEqual(costs[name], 3 * sum(predictor.mispredicted))
+        self.assertEqual(costs[None], 3 * (50 + 99))
+        self.assertLess(costs["gshare"], costs["btfn"])
+        self.assertLess(costs["btfn"], costs[None])
+
+
 if __name__ == '__main__':
     unittest.main()
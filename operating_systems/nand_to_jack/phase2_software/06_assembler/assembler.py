@@ -21,18 +21,22 @@ class SymbolTable:
             'SCREEN': 16384,  # 0x4000
             'KBD': 24576      # 0x6000
         }
+        self.labels = {}  # Label -> ROM address (the subset of symbols that are labels)
+        self.variables = {}  # Variable -> RAM address (allocated from 16 on first use)
 
     def add_label(self, symbol, address):
         """Add a label with its instruction address"""
         if symbol in self.symbols:
             raise ValueError(f"Duplicate symbol: {symbol}")
         self.symbols[symbol] = address
+        self.labels[symbol] = address
 
     def add_variable(self, symbol, address):
         """Add a variable with its RAM address"""
         if symbol in self.symbols:
             return self.symbols[symbol]  # Already exists
         self.symbols[symbol] = address
+        self.variables[symbol] = address
         return address
 
     def contains(self, symbol):
@@ -135,7 +139,18 @@ class Parser:
 class CodeGenerator:
     """Translates assembly mnemonics to binary machine code"""
 
-    def __init__(self):
+    # Extended ISA (CPU(extended_isa=True)): comp encodings the Hack ALU
+    # leaves unused, multiplying and shifting D by A or M
+    EXTENDED_COMP = {
+        "D*A":  "0000001",
+        "D<<A": "0000011",
+        "D>>A": "0000100",
+        "D*M":  "1000001",
+        "D<<M": "1000011",
+        "D>>M": "1000100",
+    }
+
+    def __init__(self, extended=False):
         # Computation lookup table (from Project 4)
         self.comp_table = {
             # a=0 (use A register)
@@ -170,6 +185,8 @@ class CodeGenerator:
             "D&M": "1000000",
             "D|M": "1010101",
         }
+        if extended:
+            self.comp_table.update(self.EXTENDED_COMP)
 
         # Destination lookup table
         self.dest_table = {
@@ -221,9 +238,9 @@ class AssemblerError(Exception):
 class Assembler:
     """Enhanced assembler with error handling"""
 
-    def __init__(self):
+    def __init__(self, extended=False):
         self.symbol_table = SymbolTable()
-        self.code_gen = CodeGenerator()
+        self.code_gen = CodeGenerator(extended)
         self.debug = False  # Enable debug output
 
     def assemble(self, input_filename, output_filename, debug=False):
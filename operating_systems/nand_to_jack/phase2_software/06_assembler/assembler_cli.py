@@ -2,13 +2,14 @@
 """
 Hack Assembler - Command-line driver
 Usage:
-  ./assembler_cli.py input.asm [output.hack] [--debug] [--run [max_cycles]]
+  ./assembler_cli.py input.asm [output.hack] [--debug] [--extended] [--run [max_cycles]]
 
 Examples:
   ./assembler_cli.py program.asm                    # Assemble only
   ./assembler_cli.py program.asm --debug            # Assemble with debug output
   ./assembler_cli.py program.asm --run              # Assemble and run on CPU
   ./assembler_cli.py program.asm --run 100          # Assemble and run for 100 cycles
+  ./assembler_cli.py program.asm --extended --run   # Multiply/shift instructions (D*M, D<<A, ...)
 """
 
 import sys
@@ -27,12 +28,13 @@ except ImportError:
 def main():
     # Parse arguments
     if len(sys.argv) < 2:
-        print("Usage: assembler_cli.py input.asm [output.hack] [--debug] [--run [max_cycles]]")
+        print("Usage: assembler_cli.py input.asm [output.hack] [--debug] [--extended] [--run [max_cycles]]")
         print("\nExamples:")
         print("  ./assembler_cli.py program.asm                    # Assemble only")
         print("  ./assembler_cli.py program.asm --debug            # Assemble with debug output")
         print("  ./assembler_cli.py program.asm --run              # Assemble and run on CPU")
         print("  ./assembler_cli.py program.asm --run 100          # Run for 100 cycles")
+        print("  ./assembler_cli.py program.asm --extended --run   # Extended ISA (D*M, D<<A, D>>A)")
         sys.exit(1)
 
     input_file = sys.argv[1]
@@ -40,6 +42,7 @@ def main():
 
     # Parse flags
     debug = False
+    extended = False
     run_cpu = False
     max_cycles = None
 
@@ -49,6 +52,8 @@ def main():
 
         if arg == '--debug':
             debug = True
+        elif arg == '--extended':
+            extended = True
         elif arg == '--run':
             run_cpu = True
             # Check if next arg is a number
@@ -63,7 +68,7 @@ def main():
     # Assemble
     print(f"Assembling {input_file}...")
 
-    assembler = Assembler()
+    assembler = Assembler(extended=extended)
     try:
         binary = assembler.assemble(input_file, output_file, debug=debug)
         print(f"Output written to {output_file}")
@@ -78,28 +83,24 @@ def main():
             print("Running on CPU...")
             print(f"{'='*60}")
 
-            cpu = CPU()
+            cpu = CPU(extended_isa=extended)
             cpu.load_program(binary)
 
             if max_cycles:
                 cpu.run(max_cycles=max_cycles)
                 print(f"\n✓ Executed {max_cycles} cycles")
             else:
-                # Run until infinite loop detected (same PC twice)
-                cycles = 0
-                prev_pc = -1
+                # Run until HALT or an idle loop such as (END) @END 0;JMP
                 max_default = 10000
+                cpu.stop_when_idle = True
+                halted, cycles = cpu.run(max_cycles=max_default)
 
-                while cycles < max_default:
-                    if cpu.PC == prev_pc:
-                        print(f"\n✓ Infinite loop detected at PC={cpu.PC}, stopping after {cycles} cycles")
-                        break
-                    prev_pc = cpu.PC
-                    cpu.step()
-                    cycles += 1
-
-                if cycles >= max_default:
+                if halted:
+                    print(f"\n✓ Program stopped (HALT or idle loop) at PC={cpu.PC} after {cycles} cycles")
+                elif cycles >= max_default:
                     print(f"\n⚠ Reached maximum {max_default} cycles")
+                else:
+                    print(f"\n✓ Ran past the end of ROM after {cycles} cycles")
 
             # Show key memory locations
             print(f"\n{'='*60}")
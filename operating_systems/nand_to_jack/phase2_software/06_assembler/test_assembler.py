@@ -25,6 +25,9 @@ class TestSymbolTable(unittest.TestCase):
         assert self.st.add_variable('sum', 99) == 16  # Idempotent
         assert self.st.contains('sum')
 
+        # Labels are also kept apart from variables
+        assert self.st.labels == {'LOOP': 10}
+
 
 class TestParser(unittest.TestCase):
     @classmethod
@@ -95,6 +98,17 @@ class TestCodeGenerator(unittest.TestCase):
         with self.assertRaises(ValueError):
             self.cg.generate_c_instruction('D', 'INVALID', '')
 
+    def test_extended_instructions(self):
+        """Multiply and shift comps only with extended=True"""
+        with self.assertRaises(ValueError):
+            self.cg.generate_c_instruction('M', 'D*M', '')
+
+        cg = CodeGenerator(extended=True)
+        assert cg.generate_c_instruction('M', 'D*M', '') == '1111000001001000'
+        assert cg.generate_c_instruction('D', 'D<<A', '') == '1110000011010000'
+        assert cg.generate_c_instruction('D', 'D>>M', '') == '1111000100010000'
+        assert cg.generate_c_instruction('', 'D+1', 'JMP') == '1110011111000111'
+
 
 class TestAssembler(unittest.TestCase):
     def setUp(self):
@@ -1,7 +1,7 @@
 class CodeGenerator:
     """Generate Hack assembly from VM commands"""
 
-    def __init__(self, filename=None):
+    def __init__(self, filename=None, extended=False):
         self.label_counter = 0  # For unique labels in comparisons
         self.return_counter = 0  # For unique return addresses
         # Extract filename for static scope (remove path and .vm extension)
@@ -10,6 +10,8 @@ class CodeGenerator:
         else:
             self.current_file = "default"
         self.current_function = ""  # Track current function for label scoping
+        # Extended ISA (CPU(extended_isa=True)): lower Math.multiply to D*M
+        self.extended = extended
 
     def init(self):
         """Bootstrap code: initialize VM and call Sys.init"""
@@ -414,8 +416,27 @@ class CodeGenerator:
 
         return asm
 
+    def generate_multiply(self):
+        """Math.multiply(x, y) as one D*M instruction (extended ISA)"""
+        return (
+            "// call Math.multiply 2 (D*M)\n"
+            "@SP\n"
+            "M=M-1\n"      # SP--
+            "A=M\n"        # A = SP
+            "D=M\n"        # D = y
+            "@SP\n"
+            "M=M-1\n"      # SP--
+            "A=M\n"        # A = SP
+            "M=D*M\n"      # RAM[SP] = y * x (low 16 bits, like Math.multiply)
+            "@SP\n"
+            "M=M+1\n"      # SP++
+        )
+
     def generate_call(self, function_name, n_args):
         """Generate assembly for function call"""
+        if self.extended and function_name == "Math.multiply" and n_args == 2:
+            return self.generate_multiply()
+
         # Generate unique return address label
         return_label = f"{function_name}$ret.{self.return_counter}"
         self.return_counter += 1
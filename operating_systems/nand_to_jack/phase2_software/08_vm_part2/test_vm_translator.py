@@ -6,6 +6,8 @@ Comprehensive test suite for VM Translator Part 2 (Program Flow and Functions)
 import unittest
 import sys
 import os
+import shutil
+import tempfile
 from pathlib import Path
 
 # Add the computer_architecture directory to the path for CPU
@@ -273,6 +275,25 @@ class TestRecursion(TestVMTranslatorPart2):
         result = self.get_stack_top(cpu)
         self.assertEqual(result, 0, "Expected 0 (successful return)")
 
+    def test_factorial_extended_multiply(self):
+        """Test: with the extended ISA, call Math.multiply 2 becomes D*M"""
+        with tempfile.TemporaryDirectory() as scratch:
+            program = os.path.join(scratch, 'Factorial')
+            shutil.copytree('examples/Factorial', program)
+            VMTranslator(program, extended=True).translate()
+            with open(os.path.join(program, 'Factorial.asm')) as f:
+                asm = f.read()
+            self.assertNotIn('@Math.multiply\n', asm)
+            self.assertIn('M=D*M', asm)
+
+            binary = Assembler(extended=True).assemble(
+                os.path.join(program, 'Factorial.asm'), os.path.join(program, 'Factorial.hack'))
+
+        cpu = CPU(extended_isa=True)
+        cpu.load_program(binary)
+        cpu.run(max_cycles=100000)
+        self.assertEqual(self.get_stack_top(cpu), 120)
+
 
 class TestComplexPrograms(TestVMTranslatorPart2):
     """Test complex multi-file programs with nested calls"""
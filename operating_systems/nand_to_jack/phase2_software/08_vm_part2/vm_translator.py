@@ -6,7 +6,7 @@ from parser import Parser
 class VMTranslator:
     """Main VM-to-Assembly translator with multi-file support"""
 
-    def __init__(self, input_path):
+    def __init__(self, input_path, extended=False):
         self.input_path = input_path
 
         # Determine if input is file or directory
@@ -25,7 +25,7 @@ class VMTranslator:
         else:
             raise ValueError(f"Invalid input path: {input_path}")
 
-        self.code_gen = CodeGenerator()
+        self.code_gen = CodeGenerator(extended=extended)
 
     def translate(self):
         """Translate all VM files to single assembly file"""
@@ -54,14 +54,19 @@ def main():
     """Command-line interface for VM translator"""
     import sys
 
-    if len(sys.argv) != 2:
-        print("Usage: python vm_translator.py <file.vm|directory>")
+    args = sys.argv[1:]
+    extended = "--extended" in args
+    if extended:
+        args.remove("--extended")
+    if len(args) != 1:
+        print("Usage: python vm_translator.py <file.vm|directory> [--extended]")
+        print("  --extended  Lower Math.multiply to the extended ISA's D*M")
         sys.exit(1)
 
-    input_path = sys.argv[1]
+    input_path = args[0]
 
     print(f"Translating {input_path}...")
-    translator = VMTranslator(input_path)
+    translator = VMTranslator(input_path, extended=extended)
     translator.translate()
     print(f"Generated {translator.output_file}")
 